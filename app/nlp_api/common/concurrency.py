@@ -0,0 +1,113 @@
+'''This module implements the execution of the blocking work of the endpoints.
+
+The clients used by the endpoints (pymongo, elasticsearch, the vector store,
+requests) and the model inference are blocking. Running them directly in an
+`async def` endpoint stalls the event loop of the worker for all the other
+requests. The endpoints are instead declared as regular functions decorated
+with `offload_io` or `offload_model`, which run them in bounded thread pools.
+
+The I/O-bound and the model-bound endpoints use separate pools so that slow
+inference does not starve the database queries. In addition, each endpoint
+has its own limit of concurrent executions so that one expensive endpoint
+can't take over a pool.
+
+Threads are used for the model inference as well since the models live in
+the memory of the worker process, and the numerical work done by numpy and
+gensim releases the GIL.
+
+Configuration:
+    - WB_NLP_IO_THREADS: size of the pool for the I/O-bound endpoints.
+    - WB_NLP_MODEL_THREADS: size of the pool for the model-bound endpoints.
+    - WB_NLP_IO_ENDPOINT_CONCURRENCY: concurrent executions of each I/O-bound endpoint.
+    - WB_NLP_MODEL_ENDPOINT_CONCURRENCY: concurrent executions of each model-bound endpoint.
+'''
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+IO_THREADS = int(os.environ.get("WB_NLP_IO_THREADS", 32))
+# The model endpoints also wait on the databases, so use at least a few threads.
+MODEL_THREADS = int(os.environ.get(
+    "WB_NLP_MODEL_THREADS", max(4, os.cpu_count() or 1)))
+IO_ENDPOINT_CONCURRENCY = int(
+    os.environ.get("WB_NLP_IO_ENDPOINT_CONCURRENCY", 16))
+MODEL_ENDPOINT_CONCURRENCY = int(
+    os.environ.get("WB_NLP_MODEL_ENDPOINT_CONCURRENCY", 4))
+
+IO_EXECUTOR = ThreadPoolExecutor(
+    max_workers=IO_THREADS, thread_name_prefix="nlp_api_io")
+MODEL_EXECUTOR = ThreadPoolExecutor(
+    max_workers=MODEL_THREADS, thread_name_prefix="nlp_api_model")
+
+# The semaphores are bound to the event loop, so they are created on first use.
+_LIMITERS = {}
+
+
+def get_limiter(name, limit):
+    limiter = _LIMITERS.get(name)
+
+    if limiter is None:
+        limiter = _LIMITERS[name] = asyncio.Semaphore(limit)
+
+    return limiter
+
+
+async def run_in_executor(executor, func, *args, limiter_name=None, limit=None, **kwargs):
+    '''Runs `func(*args, **kwargs)` in the `executor`. If `limiter_name` is
+    given, at most `limit` calls with the same name run concurrently.
+    '''
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+
+    if limiter_name is None:
+        return await loop.run_in_executor(executor, call)
+
+    async with get_limiter(limiter_name, limit):
+        return await loop.run_in_executor(executor, call)
+
+
+async def run_io(func, *args, **kwargs):
+    return await run_in_executor(IO_EXECUTOR, func, *args, **kwargs)
+
+
+async def run_model(func, *args, **kwargs):
+    return await run_in_executor(MODEL_EXECUTOR, func, *args, **kwargs)
+
+
+def _offload(func, executor, limit):
+    limiter_name = f"{func.__module__}.{func.__qualname__}"
+
+    # `functools.wraps` keeps the signature of `func`, which FastAPI uses to
+    # resolve the parameters of the endpoint.
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_executor(
+            executor, func, *args, limiter_name=limiter_name, limit=limit, **kwargs)
+
+    return wrapper
+
+
+def offload_io(func):
+    '''Decorator that runs the endpoint in the I/O pool.
+    '''
+    return _offload(func, IO_EXECUTOR, IO_ENDPOINT_CONCURRENCY)
+
+
+def offload_model(func):
+    '''Decorator that runs the endpoint in the model pool.
+    '''
+    return _offload(func, MODEL_EXECUTOR, MODEL_ENDPOINT_CONCURRENCY)
+
+
+def get_stats():
+    return dict(
+        io_threads=IO_THREADS,
+        model_threads=MODEL_THREADS,
+        io_endpoint_concurrency=IO_ENDPOINT_CONCURRENCY,
+        model_endpoint_concurrency=MODEL_ENDPOINT_CONCURRENCY,
+        # Semaphore._value is the number of available slots.
+        endpoints={name: dict(available=limiter._value)
+                   for name, limiter in sorted(_LIMITERS.items())},
+    )
@@ -0,0 +1,311 @@
+'''This module implements the jobs running the heavy analysis of documents
+outside of the request, e.g., the parsing, cleaning, and analysis of large
+uploaded reports.
+
+The jobs are run by a bounded pool of worker processes in each API worker
+so that they don't take the threads and the CPU of the interactive
+endpoints. The state and the results of the jobs are stored in an sqlite
+database shared by the API workers of the host, so the status of a job can
+be requested from any of them.
+
+The number of active jobs of each client and the total number of queued
+jobs are limited. The active jobs of the API workers that are not alive
+anymore, e.g., after a restart, are marked as failed before the limits are
+checked. The finished jobs are removed after the retention period.
+
+Configuration:
+    - WB_NLP_JOB_WORKERS: number of processes running the jobs in each API worker.
+    - WB_NLP_JOB_DIR: directory of the database and of the inputs of the jobs.
+    - WB_NLP_JOB_RETENTION: time in seconds that the finished jobs are kept.
+    - WB_NLP_JOB_MAX_ACTIVE_PER_CLIENT: maximum number of queued or running jobs of a client.
+    - WB_NLP_JOB_MAX_QUEUED: maximum number of queued jobs.
+'''
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import logging
+import traceback
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from wb_nlp import dir_manager
+
+
+JOB_WORKERS = int(os.environ.get("WB_NLP_JOB_WORKERS", 2))
+JOB_DIR = os.environ.get(
+    "WB_NLP_JOB_DIR", dir_manager.get_path_from_root("models", "jobs"))
+JOB_RETENTION = float(os.environ.get("WB_NLP_JOB_RETENTION", 24 * 3600))
+JOB_MAX_ACTIVE_PER_CLIENT = int(
+    os.environ.get("WB_NLP_JOB_MAX_ACTIVE_PER_CLIENT", 2))
+JOB_MAX_QUEUED = int(os.environ.get("WB_NLP_JOB_MAX_QUEUED", 100))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+JOB_MANAGER = None
+
+
+class JobLimitError(Exception):
+    pass
+
+
+class JobStore:
+    '''State and results of the jobs stored in an sqlite database.
+    '''
+
+    def __init__(self, root_dir=JOB_DIR):
+        self.root_dir = Path(root_dir)
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.root_dir / "jobs.sqlite"
+
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                task TEXT,
+                client TEXT,
+                status TEXT,
+                owner_pid INTEGER,
+                created_at REAL,
+                started_at REAL,
+                finished_at REAL,
+                error TEXT,
+                result TEXT
+            );
+            CREATE INDEX IF NOT EXISTS jobs_client_status ON jobs (client, status);
+            CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at);
+            ''')
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(str(self.path), timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_input_dir(self, job_id):
+        return self.root_dir / "inputs" / job_id
+
+    def create(self, task, client, max_active_per_client=JOB_MAX_ACTIVE_PER_CLIENT, max_queued=JOB_MAX_QUEUED):
+        job_id = uuid.uuid4().hex
+
+        # Committed apart so that the jobs are released also if a limit is reached.
+        self.fail_orphaned()
+
+        with self.connect() as conn:
+            # Take the write lock so that the limits are checked atomically.
+            conn.execute("BEGIN IMMEDIATE")
+
+            active = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE client = ? AND status IN (?, ?)", (client, *ACTIVE_STATUSES)).fetchone()[0]
+            if active >= max_active_per_client:
+                raise JobLimitError(
+                    f"The client already has {active} active jobs. The limit is {max_active_per_client}.")
+
+            queued = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+            if queued >= max_queued:
+                raise JobLimitError(
+                    f"There are already {queued} queued jobs. Try again later.")
+
+            conn.execute(
+                "INSERT INTO jobs (job_id, task, client, status, owner_pid, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, task, client, QUEUED, os.getpid(), time.time()))
+
+        return job_id
+
+    def fail_orphaned(self):
+        '''Marks as failed the active jobs of the API workers that are not
+        alive anymore, e.g., after a restart. Returns the ids of these jobs.
+        '''
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT job_id, owner_pid FROM jobs WHERE status IN (?, ?)", ACTIVE_STATUSES).fetchall()
+
+        orphaned = [row["job_id"]
+                    for row in rows if not is_pid_alive(row["owner_pid"])]
+
+        for job_id in orphaned:
+            self.set_finished(job_id, error="The job was interrupted.")
+
+        return orphaned
+
+    def set_running(self, job_id):
+        with self.connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ? WHERE job_id = ?",
+                (RUNNING, time.time(), job_id))
+
+    def set_finished(self, job_id, result=None, error=None):
+        with self.connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE job_id = ? AND status IN (?, ?)",
+                (FAILED if error is not None else SUCCEEDED, time.time(),
+                 None if result is None else json.dumps(result, default=str), error,
+                 job_id, QUEUED, RUNNING))
+
+        shutil.rmtree(self.get_input_dir(job_id), ignore_errors=True)
+
+    def get(self, job_id, with_result=False):
+        with self.connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        job = dict(row)
+        result = job.pop("result")
+        job.pop("owner_pid")
+
+        if with_result:
+            job["result"] = None if result is None else json.loads(result)
+
+        if row["status"] in ACTIVE_STATUSES and not is_pid_alive(row["owner_pid"]):
+            # The API worker that owned the job was restarted.
+            self.set_finished(job_id, error="The job was interrupted.")
+            return self.get(job_id, with_result=with_result)
+
+        return job
+
+    def purge(self, retention=JOB_RETENTION):
+        '''Removes the jobs that finished more than `retention` seconds ago.
+        '''
+        with self.connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE finished_at < ?", (time.time() - retention,))
+
+    def get_stats(self):
+        with self.connect() as conn:
+            return {row[0]: row[1] for row in conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status")}
+
+
+def is_pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def run_task(task, params):
+    # Imported here since the tasks are implemented by the routers.
+    from ..routers import search
+    from ..routers.subrouters import topic_model, indicators
+    from .utils import ingest_content, ingest_url_file
+
+    input_file = params.pop("input_file", None)
+    if input_file is not None:
+        doc = ingest_content(Path(input_file).read_bytes(),
+                             params.pop("content_type"))
+    else:
+        doc = ingest_url_file(params.pop("url"))
+
+    if task == "analyze":
+        return topic_model.analyze_document(text=doc.text, ingested=doc, **params)
+    elif task == "search":
+        return search.common_semantic_search(query=doc.text, ingested=doc, **params)
+    elif task == "indicators":
+        return indicators.get_all_indicators_from_document(document=doc.text, ingested=doc, **params)
+
+    raise ValueError(f"Unknown job task: {task}...")
+
+
+def run_job(store_dir, job_id, task, params):
+    '''Entry point of the jobs in the worker processes.
+    '''
+    store = JobStore(store_dir)
+    store.set_running(job_id)
+
+    try:
+        result = run_task(task, params)
+    except Exception as e:
+        logging.error(traceback.format_exc())
+        detail = getattr(e, "detail", None) or str(e)
+        store.set_finished(job_id, error=f"{type(e).__name__}: {detail}")
+        return
+
+    store.set_finished(job_id, result=result)
+
+
+class JobManager:
+    '''Submits the jobs to the local pool of worker processes.
+    '''
+
+    def __init__(self, store=None, max_workers=JOB_WORKERS):
+        self.store = store if store is not None else JobStore()
+        self.max_workers = max_workers
+        self.executor = None
+
+    def get_executor(self):
+        if self.executor is None:
+            # Don't fork the API worker with its threads and open connections.
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"))
+
+        return self.executor
+
+    def submit(self, task, client, params, content=None):
+        '''Creates a job and submits it to the pool. The `content` of an
+        uploaded document is stored with the job for the worker process.
+        '''
+        self.store.purge()
+        job_id = self.store.create(task, client)
+
+        try:
+            if content is not None:
+                input_dir = self.store.get_input_dir(job_id)
+                input_dir.mkdir(parents=True, exist_ok=True)
+                (input_dir / "content").write_bytes(content)
+                params = dict(params, input_file=str(input_dir / "content"))
+
+            future = self.get_executor().submit(
+                run_job, str(self.store.root_dir), job_id, task, params)
+        except Exception as e:
+            self.store.set_finished(job_id, error=str(e))
+            raise
+
+        future.add_done_callback(
+            lambda f: self.on_job_done(job_id, f))
+
+        return job_id
+
+    def on_job_done(self, job_id, future):
+        error = future.exception()
+
+        if error is not None:
+            # The worker process died, e.g., BrokenProcessPool.
+            logging.error(error)
+            self.store.set_finished(job_id, error=f"{type(error).__name__}: {error}")
+
+            if self.executor is not None and getattr(self.executor, "_broken", False):
+                self.executor = None
+
+    def get_stats(self):
+        return dict(workers=self.max_workers, jobs=self.store.get_stats())
+
+
+def get_job_manager():
+    global JOB_MANAGER
+
+    if JOB_MANAGER is None:
+        JOB_MANAGER = JobManager()
+
+    return JOB_MANAGER
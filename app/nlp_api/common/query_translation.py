@@ -0,0 +1,159 @@
+'''This module implements the translation of the non-English tokens of the
+queries.
+
+The translations are cached in the worker and in an sqlite database shared
+by the workers, so that the same token is only sent to the translation
+backend once per `WB_NLP_TRANSLATION_CACHE_TTL`. The tokens of a query that
+are not cached are deduplicated and translated together in a single call to
+the backend. The call runs in a separate thread and the query waits for it
+for at most `WB_NLP_TRANSLATION_TIMEOUT` seconds. Tokens that could not be
+translated in time are kept as they are, and the translations that arrive
+late are still cached for the next queries.
+
+The failures of the backend are cached for `WB_NLP_TRANSLATION_FAILURE_TTL`
+seconds, and no call is submitted while all the threads are busy, so that
+an outage of the backend does not make every query wait for the timeout.
+
+Configuration:
+    - WB_NLP_TRANSLATION_CACHE_PATH: path of the sqlite database of the cached translations.
+    - WB_NLP_TRANSLATION_CACHE_TTL: time to live of the cached translations in seconds.
+    - WB_NLP_TRANSLATION_TIMEOUT: maximum time in seconds that a query waits for the translation backend.
+    - WB_NLP_TRANSLATION_THREADS: number of concurrent calls to the translation backend.
+    - WB_NLP_TRANSLATION_FAILURE_TTL: time in seconds during which a token that failed is not sent again.
+'''
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from wb_cleaning.translate import translation
+
+from wb_nlp import dir_manager
+from wb_nlp.utils.result_cache import ResultCache, LocalTier, SqliteTier
+
+
+TRANSLATION_CACHE_PATH = os.environ.get(
+    "WB_NLP_TRANSLATION_CACHE_PATH",
+    dir_manager.get_path_from_root("models", "cache", "translations.sqlite"))
+TRANSLATION_CACHE_TTL = float(
+    os.environ.get("WB_NLP_TRANSLATION_CACHE_TTL", 30 * 24 * 3600))
+TRANSLATION_TIMEOUT = float(os.environ.get("WB_NLP_TRANSLATION_TIMEOUT", 2))
+TRANSLATION_THREADS = int(os.environ.get("WB_NLP_TRANSLATION_THREADS", 4))
+TRANSLATION_FAILURE_TTL = float(
+    os.environ.get("WB_NLP_TRANSLATION_FAILURE_TTL", 300))
+
+# Separator of the tokens translated in a single call. The backend keeps the
+# line breaks of the input.
+BATCH_SEPARATOR = "\n"
+CACHE_NAMESPACE = "translation"
+
+QUERY_TRANSLATOR = None
+
+
+class QueryTranslator:
+    '''Translates tokens with a cache in front of the translation backend.
+    '''
+
+    def __init__(self, cache=None, timeout=TRANSLATION_TIMEOUT, translate=None, max_workers=TRANSLATION_THREADS,
+                 failure_ttl=TRANSLATION_FAILURE_TTL):
+        if cache is None:
+            cache = ResultCache(
+                local=LocalTier(maxsize=10000),
+                shared=SqliteTier(path=TRANSLATION_CACHE_PATH),
+                ttl=TRANSLATION_CACHE_TTL)
+
+        self.cache = cache
+        self.timeout = timeout
+        self.failure_ttl = failure_ttl
+        self.translate = translate or translation.translate
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="nlp_api_translation")
+        # Calls submitted to the executor and not finished yet.
+        self._slots = threading.BoundedSemaphore(max_workers)
+
+    def get_cached(self, token):
+        return self.cache.get((CACHE_NAMESPACE, token))
+
+    def set_failed(self, tokens, error):
+        for token in tokens:
+            self.cache.set((CACHE_NAMESPACE, token), dict(
+                original=token, failed=True, error=str(error)), ttl=self.failure_ttl)
+
+    def translate_batch(self, tokens):
+        '''Translates `tokens` in a single call to the backend and caches the
+        results. The tokens are translated one by one if the backend does not
+        return one line per token. The tokens are cached as failed if the
+        backend fails.
+        '''
+        translations = {}
+
+        try:
+            tr = self.translate(BATCH_SEPARATOR.join(tokens))
+        except Exception as e:
+            logging.error(e)
+            self.set_failed(tokens, e)
+            return translations
+
+        parts = [p.strip() for p in tr["translated"].split(BATCH_SEPARATOR)]
+
+        if len(parts) == len(tokens):
+            for token, part in zip(tokens, parts):
+                translations[token] = dict(
+                    tr, original=token, translated=part)
+        else:
+            for ix, token in enumerate(tokens):
+                try:
+                    translations[token] = self.translate(token)
+                except Exception as e:
+                    logging.error(e)
+                    self.set_failed(tokens[ix:], e)
+                    break
+
+        for token, tr in translations.items():
+            self.cache.set((CACHE_NAMESPACE, token), tr)
+
+        return translations
+
+    def translate_tokens(self, tokens):
+        '''Returns a dictionary mapping the `tokens` to their translations.
+        Tokens that are not translated within the timeout are omitted.
+        '''
+        translations = {}
+        missing = []
+
+        for token in dict.fromkeys(tokens):
+            tr = self.get_cached(token)
+
+            if tr is None:
+                missing.append(token)
+            elif not tr.get("failed"):
+                translations[token] = tr
+
+        if missing and not self._slots.acquire(blocking=False):
+            # The calls would queue behind the ones that are still running.
+            logging.error(
+                f"Translation of {len(missing)} tokens skipped, all the translation threads are busy...")
+        elif missing:
+            future = self.executor.submit(self.translate_batch, missing)
+            future.add_done_callback(lambda f: self._slots.release())
+
+            try:
+                translations.update(future.result(timeout=self.timeout))
+            except TimeoutError:
+                # The translations will be cached when the call completes.
+                logging.error(
+                    f"Translation of {len(missing)} tokens timed out after {self.timeout}s...")
+
+        return translations
+
+    def get_stats(self):
+        return self.cache.get_stats()
+
+
+def get_query_translator():
+    global QUERY_TRANSLATOR
+
+    if QUERY_TRANSLATOR is None:
+        QUERY_TRANSLATOR = QueryTranslator()
+
+    return QUERY_TRANSLATOR
@@ -0,0 +1,237 @@
+'''This module implements the registry of the models loaded in the API.
+
+Models are loaded lazily on their first use. The registry keeps track of the
+memory used by each model and evicts the least recently used models when the
+total exceeds the configured budget. Pinned models are never evicted.
+
+The memory of a model is estimated from the `nbytes` of the arrays that it
+references, including the memory-mapped ones whose pages are only read on
+use, since the growth of the process RSS during the load misses them.
+
+Configuration:
+    - WB_NLP_MODEL_MEMORY_BUDGET_MB: memory budget for the loaded models (0 means unbounded).
+    - WB_NLP_PINNED_MODELS: comma separated list of model_run_info_id to pin.
+'''
+import gc
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import psutil
+
+
+MODEL_MEMORY_BUDGET_MB = float(
+    os.environ.get("WB_NLP_MODEL_MEMORY_BUDGET_MB", 0))
+PINNED_MODELS = [i.strip() for i in os.environ.get(
+    "WB_NLP_PINNED_MODELS", "").split(",") if i.strip()]
+
+
+def get_rss_mb():
+    return psutil.Process(os.getpid()).memory_info().rss / (1024 ** 2)
+
+
+# Containers larger than this are not scanned for arrays, e.g., vocabularies.
+SIZE_ESTIMATE_MAX_ITEMS = 10000
+SIZE_ESTIMATE_MAX_DEPTH = 6
+
+
+def estimate_size_mb(obj):
+    '''Estimates the memory of the object from the `nbytes` of the NumPy
+    arrays and pandas objects that it references. The arrays sharing the same
+    buffer are only counted once.
+    '''
+    seen = set()
+
+    def _size(value, depth):
+        if isinstance(value, np.ndarray):
+            # Count the views of an array once.
+            while isinstance(value.base, np.ndarray):
+                value = value.base
+        elif isinstance(value, (str, bytes, int, float, bool, type(None), type)) or callable(value):
+            return 0
+
+        if id(value) in seen or depth > SIZE_ESTIMATE_MAX_DEPTH:
+            return 0
+        seen.add(id(value))
+
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+
+        if type(value).__module__.startswith("pandas") and hasattr(value, "memory_usage"):
+            # pandas Series and DataFrame.
+            return int(np.sum(value.memory_usage(deep=False)))
+
+        if isinstance(value, dict):
+            items = value.values()
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            items = value
+        elif hasattr(value, "__dict__"):
+            items = vars(value).values()
+        else:
+            return 0
+
+        if len(items) > SIZE_ESTIMATE_MAX_ITEMS:
+            return 0
+
+        return sum(_size(item, depth + 1) for item in items)
+
+    return _size(obj, 0) / (1024 ** 2)
+
+
+class ModelRegistry:
+    '''Bounded registry of the loaded models.
+
+    The `loader` is a function that accepts a model id and returns the
+    `model_run_info` of the model with the loaded model in the `model` key.
+    '''
+
+    def __init__(self, loader, memory_budget_mb=MODEL_MEMORY_BUDGET_MB, pinned=None):
+        self.loader = loader
+        self.memory_budget_mb = memory_budget_mb
+        self.pinned = set(pinned or [])
+
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        # One lock per model so that a slow load does not block the others.
+        self._load_locks = {}
+        self._eviction_hooks = []
+
+    def add_eviction_hook(self, hook):
+        '''Registers a function `hook(model_id, model_run_info)` called after a
+        model is evicted. Use this to clear the caches that depend on the model.
+        '''
+        self._eviction_hooks.append(hook)
+
+    def __contains__(self, model_id):
+        return model_id in self._entries
+
+    def get(self, model_id):
+        with self._lock:
+            entry = self._entries.get(model_id)
+            if entry is not None:
+                self._touch(model_id, entry)
+                return entry["model_run_info"]
+
+        # The loads of a model are serialized so that it is not loaded twice.
+        with self._lock:
+            load_lock = self._load_locks.setdefault(model_id, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(model_id)
+                if entry is not None:
+                    self._touch(model_id, entry)
+                    return entry["model_run_info"]
+
+            start = time.time()
+
+            model_run_info = self.loader(model_id)
+
+            entry = dict(
+                model_run_info=model_run_info,
+                size_mb=estimate_size_mb(model_run_info.get("model")),
+                load_time=time.time() - start,
+                loaded_at=time.time(),
+                last_used=time.time(),
+                hits=0,
+            )
+
+            logging.info(
+                f"Loaded model {model_id} in {entry['load_time']:.2f}s using {entry['size_mb']:.2f}MB...")
+
+            with self._lock:
+                self._entries[model_id] = entry
+                self._touch(model_id, entry)
+
+            self.enforce_budget(keep=model_id)
+
+        return model_run_info
+
+    def _touch(self, model_id, entry):
+        entry["last_used"] = time.time()
+        entry["hits"] += 1
+        self._entries.move_to_end(model_id)
+
+    def get_total_size_mb(self):
+        with self._lock:
+            return sum(entry["size_mb"] for entry in self._entries.values())
+
+    def enforce_budget(self, keep=None):
+        '''Evicts the least recently used models that are not pinned until the
+        total size of the loaded models is within the budget.
+        '''
+        if not self.memory_budget_mb:
+            return []
+
+        evicted = []
+        with self._lock:
+            candidates = [model_id for model_id in self._entries
+                          if model_id not in self.pinned and model_id != keep]
+
+        for model_id in candidates:
+            if self.get_total_size_mb() <= self.memory_budget_mb:
+                break
+
+            if self.evict(model_id):
+                evicted.append(model_id)
+
+        return evicted
+
+    def evict(self, model_id):
+        with self._lock:
+            entry = self._entries.pop(model_id, None)
+
+        if entry is None:
+            return False
+
+        model_run_info = entry["model_run_info"]
+
+        # The caches of the model are attributes of the instance and are
+        # released with it.
+        for hook in self._eviction_hooks:
+            try:
+                hook(model_id, model_run_info)
+            except Exception as e:
+                logging.error(e)
+
+        del model_run_info, entry
+        gc.collect()
+
+        logging.info(f"Evicted model {model_id}...")
+
+        return True
+
+    def pin(self, model_id, load=True):
+        self.pinned.add(model_id)
+
+        if load:
+            self.get(model_id)
+
+    def unpin(self, model_id):
+        self.pinned.discard(model_id)
+        self.enforce_budget()
+
+    def get_stats(self):
+        with self._lock:
+            models = [
+                dict(
+                    model_id=model_id,
+                    model_name=entry["model_run_info"].get("model_name"),
+                    size_mb=round(entry["size_mb"], 2),
+                    load_time=round(entry["load_time"], 2),
+                    loaded_at=entry["loaded_at"],
+                    last_used=entry["last_used"],
+                    hits=entry["hits"],
+                    pinned=model_id in self.pinned,
+                ) for model_id, entry in reversed(self._entries.items())]
+
+        return dict(
+            memory_budget_mb=self.memory_budget_mb,
+            total_size_mb=round(sum(m["size_mb"] for m in models), 2),
+            process_rss_mb=round(get_rss_mb(), 2),
+            pinned=sorted(self.pinned),
+            models=models,
+        )
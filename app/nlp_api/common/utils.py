@@ -1,23 +1,37 @@
-import logging
+import os
 from pathlib import Path
 import json
+from collections import namedtuple
 from functools import lru_cache
 from fastapi import HTTPException
 import requests
+import numpy as np
 
 from wb_cleaning.interfaces import language
-from wb_cleaning.translate import translation
 from wb_cleaning.processing import document
 
 from wb_nlp.interfaces import mongodb
+from wb_nlp.interfaces.connections import reconnect_on_failure
+from wb_nlp.utils.result_cache import get_result_cache
+from wb_nlp.utils.ingestion_cache import get_ingestion_cache, get_content_key
 
 from wb_nlp.types.models import (
     ModelTypes,
 )
 from wb_nlp.models import word2vec_base, lda_base, mallet_base
 
-# This is faster than lru_cache
-MODEL_CACHE = {}
+from .registry import ModelRegistry, PINNED_MODELS
+from .query_translation import get_query_translator
+
+
+MAX_DOCUMENT_BYTES = int(
+    os.environ.get("WB_NLP_MAX_DOCUMENT_BYTES", 50 * 1024 * 1024))
+# (connect, read) timeouts of the download of the documents from urls.
+URL_TIMEOUT = (
+    float(os.environ.get("WB_NLP_URL_CONNECT_TIMEOUT", 10)),
+    float(os.environ.get("WB_NLP_URL_READ_TIMEOUT", 60)))
+
+IngestedDocument = namedtuple("IngestedDocument", ["key", "text"])
 
 
 @lru_cache(maxsize=64)
@@ -35,47 +49,57 @@ def process_config(path: Path):
     return config
 
 
-# @lru_cache(maxsize=32)
-def get_model_by_model_id(model_id):
-    global MODEL_CACHE
+@reconnect_on_failure("mongodb")
+def load_model_run_info(model_id):
+    model_runs_info_collection = mongodb.get_model_runs_info_collection()
+    model_run_info = model_runs_info_collection.find_one({"_id": model_id})
+    print(model_run_info)
 
-    if model_id not in MODEL_CACHE:
-        model_runs_info_collection = mongodb.get_model_runs_info_collection()
-        model_run_info = model_runs_info_collection.find_one({"_id": model_id})
-        print(model_run_info)
+    if model_run_info is None:
+        raise HTTPException(
+            status_code=404, detail=f"Invalid model_id: {model_id}. Model not found.")
+
+    if model_run_info["model_name"] == ModelTypes.word2vec.value:
 
-        if model_run_info["model_name"] == ModelTypes.word2vec.value:
+        model = word2vec_base.Word2VecModel(
+            model_config_id=model_run_info["model_config_id"],
+            cleaning_config_id=model_run_info["cleaning_config_id"],
+            model_run_info_id=model_id,
+            raise_empty_doc_status=False,
+            read_only=True,
+        )
 
-            model = word2vec_base.Word2VecModel(
-                model_config_id=model_run_info["model_config_id"],
-                cleaning_config_id=model_run_info["cleaning_config_id"],
-                model_run_info_id=model_id,
-                raise_empty_doc_status=False,
-            )
+    elif model_run_info["model_name"] == ModelTypes.lda.value:
 
-        elif model_run_info["model_name"] == ModelTypes.lda.value:
+        model = lda_base.LDAModel(
+            model_config_id=model_run_info["model_config_id"],
+            cleaning_config_id=model_run_info["cleaning_config_id"],
+            model_run_info_id=model_id,
+            raise_empty_doc_status=False,
+            read_only=True,
+        )
 
-            model = lda_base.LDAModel(
-                model_config_id=model_run_info["model_config_id"],
-                cleaning_config_id=model_run_info["cleaning_config_id"],
-                model_run_info_id=model_id,
-                raise_empty_doc_status=False,
-            )
+    elif model_run_info["model_name"] == ModelTypes.mallet.value:
 
-        elif model_run_info["model_name"] == ModelTypes.mallet.value:
+        model = mallet_base.MalletModel(
+            model_config_id=model_run_info["model_config_id"],
+            cleaning_config_id=model_run_info["cleaning_config_id"],
+            model_run_info_id=model_id,
+            raise_empty_doc_status=False,
+            read_only=True,
+        )
 
-            model = mallet_base.MalletModel(
-                model_config_id=model_run_info["model_config_id"],
-                cleaning_config_id=model_run_info["cleaning_config_id"],
-                model_run_info_id=model_id,
-                raise_empty_doc_status=False,
-            )
+    model_run_info["model"] = model
 
-        model_run_info["model"] = model
+    return model_run_info
 
-        MODEL_CACHE[model_id] = model_run_info
 
-    return MODEL_CACHE[model_id]
+MODEL_REGISTRY = ModelRegistry(
+    loader=load_model_run_info, pinned=PINNED_MODELS)
+
+
+def get_model_by_model_id(model_id):
+    return MODEL_REGISTRY.get(model_id)
 
 
 def get_validated_model(model_name, model_id):
@@ -89,36 +113,104 @@ def get_validated_model(model_name, model_id):
     return model_run_info["model"]
 
 
-@lru_cache(maxsize=128)
-def read_uploaded_file(file):
-
-    if file.content_type.startswith("text/"):
-        text = file.file.read().decode("utf-8", errors="ignore")
-    elif file.content_type.startswith("application/pdf"):
-
+def extract_text(content, content_type):
+    if content_type.startswith("text/"):
+        text = content.decode("utf-8", errors="ignore")
+    elif content_type.startswith("application/pdf"):
         doc = document.PDFDoc2Txt()
-        text_pages = doc.parse(source=file.file, source_type="buffer")
+        text_pages = doc.parse(source=content, source_type="buffer")
         text = " ".join(text_pages)
+    else:
+        raise HTTPException(
+            status_code=415, detail="The document is not of a valid data type. Make sure the document is a pdf or txt file.")
 
     return text
 
 
-@lru_cache(maxsize=128)
-def read_url_file(url):
+def ingest_content(content, content_type):
+    # The text extracted from the document is cached by the hash of its content.
+    cache = get_ingestion_cache()
+    key = get_content_key(content)
+    text = cache.get_text(key)
 
-    buf = requests.get(url, verify=False)
+    if text is None:
+        text = extract_text(content, content_type)
+        cache.set_text(key, text)
 
-    if buf.headers["Content-Type"].startswith("text/"):
-        text = buf.content.decode("utf-8", errors="ignore")
-    elif buf.headers["Content-Type"].startswith("application/pdf"):
-        doc = document.PDFDoc2Txt()
-        text_pages = doc.parse(source=buf.content, source_type="buffer")
-        text = " ".join(text_pages)
-    else:
+    return IngestedDocument(key=key, text=text)
+
+
+def ingest_uploaded_file(file):
+    content = file.file.read(MAX_DOCUMENT_BYTES + 1)
+
+    if len(content) > MAX_DOCUMENT_BYTES:
+        raise HTTPException(
+            status_code=413, detail=f"The file is larger than the limit of {MAX_DOCUMENT_BYTES} bytes.")
+
+    return ingest_content(content, file.content_type)
+
+
+def ingest_url_file(url):
+    cache = get_ingestion_cache()
+    entry = cache.get_url(url)
+    headers = {}
+    cached_text = cache.get_text(entry["key"]) if entry is not None else None
+
+    if cached_text is not None:
+        # Revalidate the cached content instead of downloading it again.
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    try:
+        with requests.get(url, headers=headers, verify=False, stream=True, timeout=URL_TIMEOUT) as response:
+            if headers and response.status_code == 304:
+                return IngestedDocument(key=entry["key"], text=cached_text)
+
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "")
+
+            if not content_type.startswith(("text/", "application/pdf")):
+                raise HTTPException(
+                    status_code=404, detail="URL doesn't point to a valid data type. Make sure the url is for a pdf or txt file.")
+
+            if int(response.headers.get("Content-Length") or 0) > MAX_DOCUMENT_BYTES:
+                raise HTTPException(
+                    status_code=413, detail=f"The document is larger than the limit of {MAX_DOCUMENT_BYTES} bytes.")
+
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                size += len(chunk)
+                if size > MAX_DOCUMENT_BYTES:
+                    raise HTTPException(
+                        status_code=413, detail=f"The document is larger than the limit of {MAX_DOCUMENT_BYTES} bytes.")
+                chunks.append(chunk)
+
+    except requests.exceptions.Timeout:
+        raise HTTPException(
+            status_code=504, detail="Timed out while downloading the document from the URL.")
+    except requests.exceptions.RequestException as e:
         raise HTTPException(
-            status_code=404, detail="URL doesn't point to a valid data type. Make sure the url is for a pdf or txt file.")
+            status_code=400, detail=f"Failed to download the document from the URL: {e}")
+
+    doc = ingest_content(b"".join(chunks), content_type)
+    cache.set_url(
+        url, doc.key,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+        content_type=content_type)
+
+    return doc
+
+
+def read_uploaded_file(file):
+    return ingest_uploaded_file(file).text
 
-    return text
+
+def read_url_file(url):
+    return ingest_url_file(url).text
 
 
 @lru_cache(maxsize=128)
@@ -127,19 +219,63 @@ def clean_text(model_name, model_id, text):
     return model.clean_text(text)
 
 
+def clean_ingested_text(model_name, model_id, doc):
+    cache = get_ingestion_cache()
+    text = cache.get_cleaned(doc.key, model_id)
+
+    if text is None:
+        model = get_validated_model(model_name, model_id)
+        text = model.clean_text(doc.text)
+        cache.set_cleaned(doc.key, model_id, text)
+
+    return text
+
+
+def get_ingested_doc_vec(model, doc, text, name=None, compute=None):
+    '''Returns the vector of the document `text` derived from the ingested
+    `doc`. The vector is cached under `name`, the model id by default.
+    '''
+    cache = get_ingestion_cache()
+    name = name or model.model_id
+    doc_vec = cache.get_vector(doc.key, name)
+
+    if doc_vec is None:
+        if compute is None:
+            doc_vec, _ = model.compute_doc_vec(text, normalize=True)
+        else:
+            doc_vec = compute(text)
+
+        doc_vec = np.asarray(doc_vec).flatten()
+        cache.set_vector(doc.key, name, doc_vec)
+
+    return doc_vec
+
+
+def _clear_model_caches(model_id, model_run_info):
+    clean_text.cache_clear()
+    # Only release the memory of this worker, the shared tier stays valid.
+    get_result_cache().local.invalidate(model_id)
+
+
+MODEL_REGISTRY.add_eviction_hook(_clear_model_caches)
+
+
 def check_translate_keywords(query):
     en = language.get_en_dict()
+    tokens = query.split()
+
+    # Check each distinct token once and translate the non-English ones together.
+    candidates = [token for token in dict.fromkeys(tokens)
+                  if "_" not in token and not en.check(token)]
+    translations = get_query_translator().translate_tokens(
+        candidates) if candidates else {}
+
     tquery = []
     translated = {}
-    for i in query.split():
-        if "_" not in i:
-            if not en.check(i):
-                try:
-                    tr = translation.translate(i)
-                    i = tr["translated"]
-                    translated[i] = tr
-                except Exception as e:
-                    logging.error(e)
-                    continue
+    for i in tokens:
+        tr = translations.get(i)
+        if tr is not None:
+            i = tr["translated"]
+            translated[i] = tr
         tquery.append(i)
     return dict(query=" ".join(tquery), translated=translated)
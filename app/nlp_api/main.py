@@ -3,11 +3,10 @@ import uvicorn
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from wb_nlp import dir_manager
-from wb_nlp.interfaces import mongodb
 from wb_nlp.types.models import ModelTypes, IndicatorTypes
-from .routers import cleaner, models, corpus, search, geo
+from .routers import cleaner, models, corpus, search, geo, admin, jobs
 from .routers.subrouters import lda, mallet, word2vec, wdi, indicators, microdata
-from .common.utils import get_validated_model
+from .common.utils import MODEL_REGISTRY
 
 tags_metadata = [
     {
@@ -30,6 +29,10 @@ tags_metadata = [
         "name": "LDA Model",
         "description": "This collection of endpoints provide interfaces to the services built with the LDA model.",
     },
+    {
+        "name": "Jobs",
+        "description": "This collection of endpoints run the analysis of large uploaded files and documents from urls as jobs whose status and result are polled.",
+    },
 ]
 
 app = FastAPI(
@@ -46,6 +49,8 @@ app.include_router(corpus.router, prefix="/nlp")
 app.include_router(cleaner.router, prefix="/nlp")
 app.include_router(models.router, prefix="/nlp")
 app.include_router(search.router, prefix="/nlp")
+app.include_router(admin.router, prefix="/nlp")
+app.include_router(jobs.router, prefix="/nlp")
 app.include_router(
     word2vec.router,
     prefix="/nlp/models",
@@ -95,23 +100,18 @@ app.mount("/nlp/static/indicators",
 
 @app.on_event("startup")
 async def startup_event():
-    model_runs_collection = mongodb.get_model_runs_info_collection()
-    for run in model_runs_collection.find({}):
-        model_id = run["model_run_info_id"]
-        model_name = ModelTypes(run["model_name"])
+    # Models are loaded lazily by the registry. Only the pinned models are
+    # loaded at startup.
+    for model_id in sorted(MODEL_REGISTRY.pinned):
         try:
-            model = get_validated_model(model_name, model_id)
+            model_run_info = MODEL_REGISTRY.get(model_id)
 
-            if model_name == ModelTypes("word2vec"):
+            if ModelTypes(model_run_info["model_name"]) == ModelTypes("word2vec"):
                 for indicator_code in IndicatorTypes:
                     logging.info(
                         f"Building {indicator_code} for model {model_id}")
-                    indicator_model = indicators.get_indicator_model(
+                    indicators.get_indicator_model(
                         indicator_code=indicator_code, model_id=model_id)
-                    indicator_model.build_indicator_vectors(
-                        is_parallel=True if indicator_code == IndicatorTypes("microdata") else False)
-
-                model.get_similar_words_graph("data")
 
         except Exception as e:
             logging.error(e)
@@ -0,0 +1,142 @@
+'''This router contains the implementation for the admin API.
+
+The admin API is disabled unless `WB_NLP_ADMIN_TOKEN` is set. The requests
+must then send the token in the `X-Admin-Token` header.
+
+Configuration:
+    - WB_NLP_ADMIN_TOKEN: token required by the admin endpoints.
+'''
+import os
+import hmac
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+
+from wb_nlp.utils.result_cache import get_result_cache
+from wb_nlp.utils.ingestion_cache import get_ingestion_cache
+from wb_nlp.interfaces.doc_metadata import get_doc_metadata_hydrator
+from wb_nlp.interfaces.doc_id_map import get_doc_id_map
+from wb_nlp.interfaces.connections import get_connection_manager
+from wb_nlp.interfaces.collection_catalog import get_collection_catalog
+
+from ..common.utils import MODEL_REGISTRY
+from ..common import concurrency
+from ..common.query_translation import get_query_translator
+from ..common.jobs import get_job_manager
+
+
+ADMIN_TOKEN = os.environ.get("WB_NLP_ADMIN_TOKEN", "")
+
+
+def verify_admin_token(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        # The admin API is not exposed without a token.
+        raise HTTPException(status_code=404, detail="Not found")
+
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["Admin"],
+    dependencies=[Depends(verify_admin_token)],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@ router.get("/models")
+async def get_loaded_models():
+    '''This endpoint returns the models currently loaded in the worker together with their estimated memory usage.
+    '''
+    return MODEL_REGISTRY.get_stats()
+
+
+@ router.post("/models/{model_id}/pin")
+def pin_model(model_id: str):
+    '''This endpoint loads the model, if not yet loaded, and prevents it from being evicted.
+    '''
+    MODEL_REGISTRY.pin(model_id)
+
+    return MODEL_REGISTRY.get_stats()
+
+
+@ router.post("/models/{model_id}/unpin")
+def unpin_model(model_id: str):
+    '''This endpoint allows the model to be evicted when the memory budget is exceeded.
+    '''
+    MODEL_REGISTRY.unpin(model_id)
+
+    return MODEL_REGISTRY.get_stats()
+
+
+@ router.post("/models/{model_id}/evict")
+def evict_model(model_id: str):
+    '''This endpoint unloads the model from the worker.
+    '''
+    if model_id in MODEL_REGISTRY.pinned:
+        raise HTTPException(
+            status_code=400, detail=f"Model {model_id} is pinned. Unpin the model first.")
+
+    if not MODEL_REGISTRY.evict(model_id):
+        raise HTTPException(
+            status_code=404, detail=f"Model {model_id} is not loaded.")
+
+    return MODEL_REGISTRY.get_stats()
+
+
+@ router.get("/cache")
+async def get_cache_stats():
+    '''This endpoint returns the hit and miss counters of the query result cache, the document metadata cache, the translation cache, and the cache of the uploaded documents of the worker.
+    '''
+    return dict(
+        results=get_result_cache().get_stats(),
+        doc_metadata=get_doc_metadata_hydrator().get_stats(),
+        translations=get_query_translator().get_stats(),
+        ingestion=get_ingestion_cache().get_stats(),
+    )
+
+
+@ router.post("/cache/{model_id}/invalidate")
+def invalidate_cache(model_id: str):
+    '''This endpoint removes the cached query results of the model from the worker and from the shared cache.
+    '''
+    cache = get_result_cache()
+    cache.invalidate(model_id)
+
+    return cache.get_stats()
+
+
+@ router.get("/doc_id_map")
+def get_doc_id_map_stats():
+    '''This endpoint returns the generation and the size of the map between the `int_id` and the `id` of the documents loaded in the worker.
+    '''
+    return get_doc_id_map().get_stats()
+
+
+@ router.get("/concurrency")
+async def get_concurrency_stats():
+    '''This endpoint returns the sizes of the pools running the endpoints and the available slots of each endpoint.
+    '''
+    return concurrency.get_stats()
+
+
+@ router.get("/jobs")
+def get_jobs_stats():
+    '''This endpoint returns the number of job processes of the worker and the number of jobs by status.
+    '''
+    return get_job_manager().get_stats()
+
+
+@ router.get("/connections")
+async def get_connections_stats():
+    '''This endpoint returns the state, the health check and failure counters, and the pool sizes of the clients of the backends of the worker.
+    '''
+    return get_connection_manager().get_stats()
+
+
+@ router.get("/collections")
+async def get_collections_stats():
+    '''This endpoint returns the cached count, dimension, partitions, and build version of the collections of the vector store checked by the worker.
+    '''
+    return get_collection_catalog().get_stats()
@@ -11,6 +11,8 @@ from pydantic import BaseModel, Field
 from wb_cleaning.cleaning import cleaner
 from wb_cleaning.types.cleaning import CleaningConfig
 from wb_cleaning.utils.data_types import HashableDict
+from ..common.concurrency import offload_model
+
 
 router = APIRouter(
     prefix="/cleaner",
@@ -31,7 +33,8 @@ def get_cleaner(config):
 
 
 @ router.post("/clean")
-async def clean(
+@ offload_model
+def clean(
         cleaning_config: CleaningConfig,
         text: str = "Forcibly displaced populations including refugees, internally displaced persons, stateless people, asylum seekers, and host populations.",):
     '''This endpoint cleans the given `text` data.
@@ -10,6 +10,7 @@ from fastapi import APIRouter, Depends, HTTPException, Body, Query
 from wb_cleaning.types import metadata
 
 from wb_nlp.interfaces import mongodb, elasticsearch
+from wb_nlp.interfaces.connections import reconnect_on_failure
 
 router = APIRouter(
     prefix="/corpus",
@@ -20,6 +21,7 @@ router = APIRouter(
 
 
 @router.get("/get_last_update_date")
+@reconnect_on_failure("mongodb")
 def get_last_update_date():
     collection = mongodb.get_latest_update_collection()
     data = collection.find_one(sort=[("_id", pymongo.DESCENDING)])
@@ -72,6 +74,7 @@ def get_doc_metadata_by_id(id: str = "wb_725385"):
     # response_model=metadata.MetadataModel,
     # summary="Get count of documents based on arbitrary grouping fields.")
 )
+@reconnect_on_failure("mongodb")
 def get_doc_count(
         group_by: List[str] = ["year", "country"],
         sort_by: List[metadata.SortOn] = [
@@ -124,6 +127,7 @@ def get_doc_count(
     # response_model=metadata.MetadataModel,
     # summary="Get count of documents based on arbitrary grouping fields.")
 )
+@reconnect_on_failure("mongodb")
 def get_normalized_doc_count(
         group_by: List[str] = ["year", "country"],
         sort_by: List[metadata.SortOn] = [
@@ -0,0 +1,207 @@
+'''This router contains the implementation for the jobs API.
+
+The analysis of uploaded files and of documents from urls can take longer
+than the timeout of the requests for large documents. These endpoints
+submit the analysis as a job and return its id. The status and the result
+of the job are then polled with the `/jobs/{job_id}` endpoints.
+
+The jobs are limited per client. The client is identified by the address
+appended to `X-Forwarded-For` by the trusted proxies in front of the API,
+the entries before them are set by the client and are ignored.
+
+Configuration:
+    - WB_NLP_TRUSTED_PROXY_HOPS: number of proxies in front of the API that append to `X-Forwarded-For`.
+'''
+import os
+
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request
+from pydantic import HttpUrl
+
+from wb_nlp.types.models import ModelTypes
+
+from ..common.utils import MAX_DOCUMENT_BYTES
+from ..common.jobs import get_job_manager, JobLimitError, SUCCEEDED
+from ..common.concurrency import offload_io
+
+
+TRUSTED_PROXY_HOPS = int(os.environ.get("WB_NLP_TRUSTED_PROXY_HOPS", 1))
+
+
+router = APIRouter(
+    prefix="/jobs",
+    tags=["Jobs"],
+    dependencies=[],
+    responses={404: {"description": "Not found"}},
+)
+
+
+def get_client_id(request: Request):
+    # Each trusted proxy appends the address of its peer, so the client is
+    # the entry appended by the outermost trusted proxy.
+    forwarded_for = request.headers.get("X-Forwarded-For")
+
+    if forwarded_for and TRUSTED_PROXY_HOPS > 0:
+        hops = [hop.strip() for hop in forwarded_for.split(",")]
+        return hops[-min(TRUSTED_PROXY_HOPS, len(hops))]
+
+    return request.client.host if request.client else "unknown"
+
+
+def read_upload_content(file: UploadFile):
+    content = file.file.read(MAX_DOCUMENT_BYTES + 1)
+
+    if len(content) > MAX_DOCUMENT_BYTES:
+        raise HTTPException(
+            status_code=413, detail=f"The file is larger than the limit of {MAX_DOCUMENT_BYTES} bytes.")
+
+    return content
+
+
+def submit_job(request: Request, task, params, file: UploadFile = None, url: str = None):
+    content = None
+
+    if file is not None:
+        content = read_upload_content(file)
+        params = dict(params, content_type=file.content_type)
+    else:
+        params = dict(params, url=str(url))
+
+    try:
+        job_id = get_job_manager().submit(
+            task, get_client_id(request), params, content=content)
+    except JobLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    return dict(job_id=job_id, status=get_job_manager().store.get(job_id)["status"])
+
+
+@ router.post("/analyze_file")
+@ offload_io
+def submit_analyze_file(
+    request: Request,
+    model_name: ModelTypes = Form(...),
+    model_id: str = Form(...),
+    file: UploadFile = File(...),
+    topn_words: int = Form(10),
+    total_word_score: float = Form(1.0),
+    sort: bool = Form(True),
+    clean: bool = Form(True),
+    format_words: bool = Form(True)
+):
+    '''This endpoint submits a job that extracts the countries and infers the topics of the uploaded file using the topic model selected.
+    '''
+    return submit_job(request, "analyze", dict(
+        model_name=model_name, model_id=model_id, topn_words=topn_words,
+        total_word_score=total_word_score, sort=sort, clean=clean, format_words=format_words), file=file)
+
+
+@ router.post("/analyze_url")
+@ offload_io
+def submit_analyze_url(
+    request: Request,
+    model_name: ModelTypes = Form(...),
+    model_id: str = Form(...),
+    url: HttpUrl = Form(...),
+    topn_words: int = Form(10),
+    total_word_score: float = Form(1.0),
+    sort: bool = Form(True),
+    clean: bool = Form(True),
+    format_words: bool = Form(True)
+):
+    '''This endpoint submits a job that extracts the countries and infers the topics of the document in the url using the topic model selected.
+    '''
+    return submit_job(request, "analyze", dict(
+        model_name=model_name, model_id=model_id, topn_words=topn_words,
+        total_word_score=total_word_score, sort=sort, clean=clean, format_words=format_words), url=url)
+
+
+@ router.post("/search_file")
+@ offload_io
+def submit_search_file(
+    request: Request,
+    model_name: ModelTypes = Form(...),
+    model_id: str = Form(...),
+    file: UploadFile = File(...),
+    from_result: int = Form(0),
+    size: int = Form(10),
+    clean: bool = Form(True),
+):
+    '''This endpoint submits a job that finds the documents in the database semantically similar to the uploaded file.
+    '''
+    return submit_job(request, "search", dict(
+        model_name=model_name, model_id=model_id, from_result=from_result, size=size, clean=clean), file=file)
+
+
+@ router.post("/search_url")
+@ offload_io
+def submit_search_url(
+    request: Request,
+    model_name: ModelTypes = Form(...),
+    model_id: str = Form(...),
+    url: HttpUrl = Form(...),
+    from_result: int = Form(0),
+    size: int = Form(10),
+    clean: bool = Form(True),
+):
+    '''This endpoint submits a job that finds the documents in the database semantically similar to the document in the url.
+    '''
+    return submit_job(request, "search", dict(
+        model_name=model_name, model_id=model_id, from_result=from_result, size=size, clean=clean), url=url)
+
+
+@ router.post("/indicators_file")
+@ offload_io
+def submit_indicators_file(
+    request: Request,
+    model_id: str = Form(...),
+    file: UploadFile = File(...),
+    topn: int = Form(10),
+):
+    '''This endpoint submits a job that finds the indicators similar to the uploaded file.
+    '''
+    return submit_job(request, "indicators", dict(model_id=model_id, topn=topn), file=file)
+
+
+@ router.post("/indicators_url")
+@ offload_io
+def submit_indicators_url(
+    request: Request,
+    model_id: str = Form(...),
+    url: HttpUrl = Form(...),
+    topn: int = Form(10),
+):
+    '''This endpoint submits a job that finds the indicators similar to the document in the url.
+    '''
+    return submit_job(request, "indicators", dict(model_id=model_id, topn=topn), url=url)
+
+
+@ router.get("/{job_id}")
+@ offload_io
+def get_job_status(job_id: str):
+    '''This endpoint returns the status of the job: `queued`, `running`, `succeeded`, or `failed`.
+    '''
+    job = get_job_manager().store.get(job_id)
+
+    if job is None:
+        raise HTTPException(
+            status_code=404, detail=f"Job {job_id} not found. Finished jobs are removed after the retention period.")
+
+    return job
+
+
+@ router.get("/{job_id}/result")
+@ offload_io
+def get_job_result(job_id: str):
+    '''This endpoint returns the result of the job once it succeeded.
+    '''
+    job = get_job_manager().store.get(job_id, with_result=True)
+
+    if job is None:
+        raise HTTPException(
+            status_code=404, detail=f"Job {job_id} not found. Finished jobs are removed after the retention period.")
+
+    if job["status"] != SUCCEEDED:
+        raise HTTPException(
+            status_code=409, detail=dict(status=job["status"], error=job["error"]))
+
+    return job["result"]
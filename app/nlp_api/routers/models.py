@@ -1,15 +1,17 @@
 '''This router contains the implementation for the cleaning API.
 '''
 import json
-from fastapi import APIRouter, UploadFile, File, Query  # , HTTPException, Form
+from fastapi import APIRouter, UploadFile, File, Query, HTTPException  # , Form
 import pydantic
 from typing import List
 
 from wb_nlp.interfaces import mongodb
+from wb_nlp.interfaces.connections import reconnect_on_failure
+from wb_nlp.interfaces.doc_metadata import get_doc_metadata_hydrator
 
 from wb_nlp.types.models import (
     ModelTypes, GetVectorParams, SimilarWordsParams, SimilarDocsParams,
-    SimilarWordsByDocIDParams, SimilarDocsByDocIDParams, ModelRunInfo, GetVectorReturns, SimilarWordsReturns,
+    SimilarWordsByDocIDParams, SimilarDocsByDocIDParams, SimilarDocsBatchParams, ModelRunInfo, GetVectorReturns, SimilarWordsReturns,
     SimilarWordsByDocIDReturns,
     SimilarDocsReturns,
     SimilarDocsByDocIDReturns,
@@ -18,6 +20,7 @@ from wb_nlp.types.models import (
 
 # , read_uploaded_file, read_url_file
 from ..common.utils import get_validated_model, check_translate_keywords
+from ..common.concurrency import offload_io, offload_model
 
 
 router = APIRouter(
@@ -29,7 +32,9 @@ router = APIRouter(
 
 
 @ router.get("/get_available_models")
-async def get_available_models(
+@ offload_io
+@ reconnect_on_failure("mongodb")
+def get_available_models(
     model_type: List[ModelTypes] = Query(...,
                                          description="List of model names."),
     expand: bool = Query(
@@ -63,7 +68,8 @@ async def get_available_models(
 
 
 @ router.post("/{model_name}/get_text_vector", response_model=GetVectorReturns)
-async def get_text_vector(model_name: ModelTypes, transform_params: GetVectorParams):
+@ offload_model
+def get_text_vector(model_name: ModelTypes, transform_params: GetVectorParams):
     '''This endpoint converts the `raw_text` provided into a vector transformed using the specified word2vec model.
     '''
 
@@ -88,7 +94,8 @@ async def get_file_vector(model_name: ModelTypes, file: UploadFile = File(None,
 
 
 @ router.post("/{model_name}/get_similar_words", response_model=SimilarWordsReturns)
-async def get_similar_words(model_name: ModelTypes, transform_params: SimilarWordsParams):
+@ offload_model
+def get_similar_words(model_name: ModelTypes, transform_params: SimilarWordsParams):
     '''This endpoint converts the `raw_text` provided into a vector transformed using the specified word2vec model.
     '''
     model = get_validated_model(model_name, transform_params.model_id)
@@ -103,7 +110,8 @@ async def get_similar_words(model_name: ModelTypes, transform_params: SimilarWor
 
 # @ router.post("/{model_name}/get_similar_docs", response_model=SimilarDocsReturns)
 @ router.post("/{model_name}/get_similar_docs")
-async def get_similar_docs(model_name: ModelTypes, transform_params: SimilarDocsParams):
+@ offload_model
+def get_similar_docs(model_name: ModelTypes, transform_params: SimilarDocsParams):
     '''This endpoint converts the `raw_text` provided into a vector transformed using the specified word2vec model.
     '''
 
@@ -121,6 +129,31 @@ async def get_similar_docs(model_name: ModelTypes, transform_params: SimilarDocs
     return result
 
 
+@ router.post("/{model_name}/get_similar_docs_batch")
+@ offload_model
+def get_similar_docs_batch(model_name: ModelTypes, transform_params: SimilarDocsBatchParams):
+    '''This endpoint returns the similar documents for each of the `raw_texts` or `doc_ids` provided. The inputs are transformed together and searched in a single request to the vector index.
+    '''
+    if (transform_params.raw_texts is None) == (transform_params.doc_ids is None):
+        raise HTTPException(
+            status_code=400, detail="Exactly one of `raw_texts` or `doc_ids` must be provided.")
+
+    model = get_validated_model(model_name, transform_params.model_id)
+
+    documents = None
+    if transform_params.raw_texts is not None:
+        documents = [check_translate_keywords(text)["query"]
+                     for text in transform_params.raw_texts]
+
+    return model.search_similar_documents_batch(
+        documents=documents,
+        doc_ids=transform_params.doc_ids,
+        size=transform_params.topn_docs,
+        duplicate_threshold=transform_params.duplicate_threshold,
+        show_duplicates=transform_params.show_duplicates,
+        metric_type=transform_params.metric_type.value)
+
+
 # @ router.post("/{model_name}/upload/get_similar_docs", response_model=SimilarDocsReturns)
 # async def get_upload_similar_docs(
 
@@ -162,7 +195,8 @@ async def get_similar_docs(model_name: ModelTypes, transform_params: SimilarDocs
 
 
 @ router.post("/{model_name}/get_similar_words_by_doc_id", response_model=SimilarWordsByDocIDReturns)
-async def get_similar_words_by_doc_id(model_name: ModelTypes, transform_params: SimilarWordsByDocIDParams):
+@ offload_model
+def get_similar_words_by_doc_id(model_name: ModelTypes, transform_params: SimilarWordsByDocIDParams):
     '''This endpoint converts the `raw_text` provided into a vector transformed using the specified word2vec model.
     '''
 
@@ -176,7 +210,8 @@ async def get_similar_words_by_doc_id(model_name: ModelTypes, transform_params:
 
 # @ router.post("/{model_name}/get_similar_docs_by_doc_id", response_model=SimilarDocsByDocIDReturns)
 @ router.post("/{model_name}/get_similar_docs_by_doc_id")
-async def get_similar_docs_by_doc_id(model_name: ModelTypes, transform_params: SimilarDocsByDocIDParams, return_metadata: bool = True):
+@ offload_model
+def get_similar_docs_by_doc_id(model_name: ModelTypes, transform_params: SimilarDocsByDocIDParams, return_metadata: bool = True):
     '''This endpoint converts the `raw_text` provided into a vector transformed using the specified word2vec model.
     '''
 
@@ -190,11 +225,10 @@ async def get_similar_docs_by_doc_id(model_name: ModelTypes, transform_params: S
         metric_type=transform_params.metric_type.value)
 
     if return_metadata:
-        es_nlp_doc_metadata = mongodb.get_es_nlp_doc_metadata_collection()
-        metadata_map = {d["id"]: d for d in es_nlp_doc_metadata.find(
-            {"id": {"$in": [r["id"] for r in result]}})}
+        metadata_map = get_doc_metadata_hydrator().get(
+            [r["id"] for r in result])
 
         for r in result:
-            r["metadata"] = metadata_map[r["id"]]
+            r["metadata"] = metadata_map.get(r["id"])
 
     return result
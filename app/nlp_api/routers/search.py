@@ -2,21 +2,24 @@
 '''
 from datetime import datetime
 from typing import List
-from fastapi import APIRouter, UploadFile, File, Form, Query
+from fastapi import APIRouter, UploadFile, File, Form, Query, HTTPException
 from pydantic import HttpUrl
 from contexttimer import Timer
 
 from wb_cleaning.extraction import country_extractor
 
 from wb_nlp.interfaces import elasticsearch
+from wb_nlp.interfaces.doc_metadata import get_doc_metadata_hydrator, hydrate_doc_metadata
 from wb_nlp.types.models import (
-    ModelTypes
+    ModelTypes, SemanticSearchBatchParams
 )
 
 from ..common.utils import (
-    get_validated_model, read_uploaded_file,
-    read_url_file, clean_text, check_translate_keywords
+    get_validated_model, ingest_uploaded_file,
+    ingest_url_file, clean_text, clean_ingested_text,
+    get_ingested_doc_vec, check_translate_keywords
 )
+from ..common.concurrency import offload_io, offload_model
 
 
 router = APIRouter(
@@ -28,7 +31,8 @@ router = APIRouter(
 
 
 @ router.get("/keyword")
-async def keyword_search(
+@ offload_io
+def keyword_search(
     query: str,
     min_year: int = None,
     max_year: int = None,
@@ -149,7 +153,9 @@ def common_semantic_search(
         from_result: int = 0,
         size: int = 10,
         clean: bool = True,
-        translated: dict = None):
+        translated: dict = None,
+        ingested=None):
+    # The cleaned text and the vector of `ingested` documents are cached by their content.
 
     with Timer() as timer:
 
@@ -160,7 +166,15 @@ def common_semantic_search(
 
         print(f"Elapsed 2: {timer.elapsed}")
         print("QUERY: ", query[:100])
-        if clean:
+        doc_vec = None
+        if ingested is not None:
+            if clean:
+                query = clean_ingested_text(model_name, model_id, ingested)
+
+            doc_vec = get_ingested_doc_vec(
+                model, ingested, query, name=model_id if clean else f"{model_id}.raw")
+
+        elif clean:
             query = clean_text(model_name, model_id, query)
             # query = model.clean_text(query)
 
@@ -170,14 +184,14 @@ def common_semantic_search(
         result = model.search_similar_documents(
             document=query,
             from_result=from_result,
-            size=size)
+            size=size,
+            doc_vec=doc_vec)
 
         print(f"Elapsed 4: {timer.elapsed}")
-        id_rank = {res["id"]: res["rank"] for res in result}
+        doc_ids = [res["id"] for res in sorted(result, key=lambda x: x["rank"])]
 
         print(f"Elapsed 5: {timer.elapsed}")
-        response = elasticsearch.get_metadata_by_ids(
-            doc_ids=list(id_rank.keys()), source_excludes=["body"])
+        hits = hydrate_doc_metadata(doc_ids)
 
         total = dict(
             value=None,
@@ -185,7 +199,6 @@ def common_semantic_search(
         )
 
         print(f"Elapsed 6: {timer.elapsed}")
-        hits = [h for h in sorted(response, key=lambda x: id_rank[x["id"]])]
 
         print(f"Elapsed 7: {timer.elapsed}")
 
@@ -199,7 +212,8 @@ def common_semantic_search(
 
 
 @ router.get("/{model_name}/semantic")
-async def semantic_search(
+@ offload_model
+def semantic_search(
     model_name: ModelTypes,
     model_id: str,
     query: str,
@@ -221,8 +235,61 @@ async def semantic_search(
         query=query, from_result=from_result, size=size, clean=clean, translated=translated)
 
 
+@ router.post("/{model_name}/semantic/batch")
+@ offload_model
+def semantic_search_batch(
+    model_name: ModelTypes,
+    search_params: SemanticSearchBatchParams,
+):
+    '''This endpoint provides the semantic search functionality for a batch of `queries` or `doc_ids`. The queries are embedded together, searched in a single request to the vector index, and the metadata of all the results are retrieved in a single request.
+    '''
+    if (search_params.queries is None) == (search_params.doc_ids is None):
+        raise HTTPException(
+            status_code=400, detail="Exactly one of `queries` or `doc_ids` must be provided.")
+
+    model = get_validated_model(model_name, search_params.model_id)
+
+    queries = None
+    translated = [None] * len(search_params.doc_ids or [])
+
+    if search_params.queries is not None:
+        queries = []
+        translated = []
+
+        for query in search_params.queries:
+            payload = check_translate_keywords(query)
+            query = payload["query"]
+
+            if search_params.clean:
+                query = clean_text(model_name, search_params.model_id, query)
+
+            queries.append(query)
+            translated.append(payload["translated"])
+
+    results = model.search_similar_documents_batch(
+        documents=queries,
+        doc_ids=search_params.doc_ids,
+        from_result=search_params.from_result,
+        size=search_params.size)
+
+    metadata = get_doc_metadata_hydrator().get(
+        [res["id"] for r in results for res in r["result"]])
+
+    return [
+        dict(
+            hits=[metadata[res["id"]]
+                  for res in r["result"] if res["id"] in metadata],
+            result=r["result"],
+            success=r["success"],
+            message=r["message"],
+            translated=tr,
+            next=search_params.from_result + search_params.size,
+        ) for r, tr in zip(results, translated)]
+
+
 @ router.post("/{model_name}/file")
-async def file_search(
+@ offload_model
+def file_search(
     model_name: ModelTypes,
     model_id: str = Form(...),
     file: UploadFile = File(...),
@@ -234,13 +301,14 @@ async def file_search(
     '''
     print({"filename": file.filename})
 
-    document = read_uploaded_file(file)
+    doc = ingest_uploaded_file(file)
 
-    return common_semantic_search(model_name=model_name, model_id=model_id, query=document, from_result=from_result, size=size, clean=clean)
+    return common_semantic_search(model_name=model_name, model_id=model_id, query=doc.text, from_result=from_result, size=size, clean=clean, ingested=doc)
 
 
 @ router.post("/{model_name}/url")
-async def url_search(
+@ offload_model
+def url_search(
     model_name: ModelTypes,
     model_id: str = Form(...),
     url: HttpUrl = Form(...),
@@ -251,9 +319,9 @@ async def url_search(
     '''This endpoint provides the service for the semantic search functionality. This uses a word embedding model to find semantically similar documents in the database.
     '''
 
-    document = read_url_file(url)
+    doc = ingest_url_file(url)
 
-    return common_semantic_search(model_name=model_name, model_id=model_id, query=document, from_result=from_result, size=size, clean=clean)
+    return common_semantic_search(model_name=model_name, model_id=model_id, query=doc.text, from_result=from_result, size=size, clean=clean, ingested=doc)
 
 
 # '_filter_der_country_details_region': {'filter': {'match_all': {}},
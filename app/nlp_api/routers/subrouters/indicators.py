@@ -14,9 +14,11 @@ from wb_nlp.types.models import (
 from wb_nlp.models import wdi_base, sdg_base, microdata_base
 
 from ...common.utils import (
-    get_validated_model, read_uploaded_file,
-    read_url_file,
+    get_validated_model, ingest_uploaded_file,
+    ingest_url_file, get_ingested_doc_vec, MODEL_REGISTRY,
 )
+from ...common.concurrency import offload_io, offload_model
+
 
 router = APIRouter(
     prefix="/indicators",
@@ -55,9 +57,18 @@ def get_indicator_model(indicator_code, model_id):
             model_run_info_id=model.model_id,
         )
 
+    # The indicator vectors are built offline with scripts/models/build_indicator_vectors.py.
     return indicator_model
 
 
+def _clear_indicator_models(model_id, model_run_info):
+    # The indicator models hold a reference to the word2vec model.
+    get_indicator_model.cache_clear()
+
+
+MODEL_REGISTRY.add_eviction_hook(_clear_indicator_models)
+
+
 @lru_cache(maxsize=None)
 def _get_wdi_metadata(url_meta):
     response = requests.get(url_meta)
@@ -86,7 +97,8 @@ def _get_similar_indicators_by_doc_id(indicator_code: IndicatorTypes, doc_id: st
 
 
 @ router.get("/{indicator_code}/get_similar_indicators_by_doc_id")
-async def get_similar_indicators_by_doc_id(indicator_code: IndicatorTypes, doc_id: str, model_id: str, topn: int = 10):
+@ offload_model
+def get_similar_indicators_by_doc_id(indicator_code: IndicatorTypes, doc_id: str, model_id: str, topn: int = 10):
     '''This endpoint converts the `raw_text` provided into a vector transformed using the specified word2vec model.
     '''
 
@@ -94,7 +106,8 @@ async def get_similar_indicators_by_doc_id(indicator_code: IndicatorTypes, doc_i
 
 
 @ router.get("/wdi/get_wdi_metadata")
-async def get_wdi_metadata(url_meta: AnyHttpUrl):
+@ offload_io
+def get_wdi_metadata(url_meta: AnyHttpUrl):
     '''This endpoint converts the `raw_text` provided into a vector transformed using the specified word2vec model.
     '''
 
@@ -107,7 +120,7 @@ async def get_wdi_metadata(url_meta: AnyHttpUrl):
     return data
 
 
-def get_all_indicators_from_document(model_id: str, document: str, topn: int = 10):
+def get_all_indicators_from_document(model_id: str, document: str, topn: int = 10, ingested=None):
     payload = {}
     doc_vec = None
 
@@ -115,10 +128,23 @@ def get_all_indicators_from_document(model_id: str, document: str, topn: int = 1
         indicator_model = get_indicator_model(indicator_code, model_id)
         ret_cols = get_ret_cols(indicator_code)
 
+        if not indicator_model.is_ready():
+            # Skip the indicators whose vectors were not built yet.
+            payload[indicator_code.value] = []
+            continue
+
         if doc_vec is None:
-            result = indicator_model.wvec_model.process_doc(
-                {"text": document}, normalize=True)
-            doc_vec = result["doc_vec"]
+            wvec_model = indicator_model.wvec_model
+
+            def _process_doc(text):
+                return wvec_model.process_doc({"text": text}, normalize=True)["doc_vec"]
+
+            if ingested is None:
+                doc_vec = _process_doc(document)
+            else:
+                doc_vec = get_ingested_doc_vec(
+                    wvec_model, ingested, document,
+                    name=f"{wvec_model.model_id}.process_doc", compute=_process_doc)
 
         payload[indicator_code.value] = indicator_model.get_similar_indicators_by_vector(
             doc_vec, topn=topn, ret_cols=ret_cols, as_records=True)
@@ -127,17 +153,19 @@ def get_all_indicators_from_document(model_id: str, document: str, topn: int = 1
 
 
 @ router.post("/all/get_similar_indicators_from_file")
-async def get_similar_indicators_from_file(model_id: str = Form(...), file: UploadFile = File(...), topn: int = 10):
-    document = read_uploaded_file(file)
+@ offload_model
+def get_similar_indicators_from_file(model_id: str = Form(...), file: UploadFile = File(...), topn: int = 10):
+    doc = ingest_uploaded_file(file)
 
-    return get_all_indicators_from_document(model_id=model_id, document=document, topn=topn)
+    return get_all_indicators_from_document(model_id=model_id, document=doc.text, topn=topn, ingested=doc)
 
 
 @ router.post("/all/get_similar_indicators_from_url")
-async def get_similar_indicators_from_url(model_id: str = Form(...), url: HttpUrl = Form(...), topn: int = 10):
-    document = read_url_file(url)
+@ offload_model
+def get_similar_indicators_from_url(model_id: str = Form(...), url: HttpUrl = Form(...), topn: int = 10):
+    doc = ingest_url_file(url)
 
-    return get_all_indicators_from_document(model_id=model_id, document=document, topn=topn)
+    return get_all_indicators_from_document(model_id=model_id, document=doc.text, topn=topn, ingested=doc)
 
 
 # https://api.worldbank.org/v2/sources/2/series/it.net.secr/metadata?format=json
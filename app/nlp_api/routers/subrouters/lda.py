@@ -7,6 +7,8 @@ from wb_nlp.types.models import (
     TopicCompositionParams, PartitionTopicShareParams, FullTopicProfilesParams
 )
 from . import topic_model
+from ...common.concurrency import offload_model
+
 
 router = APIRouter(
     prefix="/lda",
@@ -36,7 +38,8 @@ DEFAULT_QUERY_FIELDS = topic_model.DEFAULT_QUERY_FIELDS
 
 
 @ router.get("/get_model_topic_words")
-async def get_model_topic_words(
+@ offload_model
+def get_model_topic_words(
     model_id: str = DEFAULT_QUERY_FIELDS["model_id"],
     topn_words: int = DEFAULT_QUERY_FIELDS["topn_words"],
     total_word_score: float = DEFAULT_QUERY_FIELDS["total_word_score"]
@@ -50,7 +53,8 @@ async def get_model_topic_words(
 
 
 @ router.get("/get_model_topic_ranges")
-async def get_model_topic_ranges(
+@ offload_model
+def get_model_topic_ranges(
     model_id: str = DEFAULT_QUERY_FIELDS["model_id"],
 ):
     return topic_model.get_model_topic_ranges(
@@ -60,7 +64,8 @@ async def get_model_topic_ranges(
 
 
 @ router.get("/get_topic_words")
-async def get_topic_words(
+@ offload_model
+def get_topic_words(
     model_id: str = DEFAULT_QUERY_FIELDS["model_id"],
     topic_id: int = DEFAULT_QUERY_FIELDS["topic_id"],
     topn_words: int = DEFAULT_QUERY_FIELDS["topn_words"],
@@ -76,7 +81,8 @@ async def get_topic_words(
 
 
 @ router.get("/get_doc_topic_words")
-async def get_doc_topic_words(
+@ offload_model
+def get_doc_topic_words(
     model_id: str = DEFAULT_QUERY_FIELDS["model_id"],
     text: str = Query(..., description="Input text for topic inference."),
     topn_topics: int = DEFAULT_QUERY_FIELDS["topn_topics"],
@@ -96,7 +102,8 @@ async def get_doc_topic_words(
 
 
 @ router.post("/get_docs_by_topic_composition")
-async def get_docs_by_topic_composition(
+@ offload_model
+def get_docs_by_topic_composition(
     transform_params: TopicCompositionParams
 ):
     return topic_model.get_docs_by_topic_composition(
@@ -106,7 +113,8 @@ async def get_docs_by_topic_composition(
 
 
 @ router.post("/get_docs_by_topic_composition_count")
-async def get_docs_by_topic_composition_count(
+@ offload_model
+def get_docs_by_topic_composition_count(
     transform_params: TopicCompositionParams
 ):
 
@@ -117,7 +125,8 @@ async def get_docs_by_topic_composition_count(
 
 
 @ router.post("/get_partition_topic_share")
-async def get_partition_topic_share(
+@ offload_model
+def get_partition_topic_share(
     transform_params: PartitionTopicShareParams
 ):
     return topic_model.get_partition_topic_share(
@@ -127,7 +136,8 @@ async def get_partition_topic_share(
 
 
 @ router.get("/get_full_topic_profiles")
-async def get_full_topic_profiles(
+@ offload_model
+def get_full_topic_profiles(
     model_id: str = DEFAULT_QUERY_FIELDS["model_id"],
     topic_id: int = DEFAULT_QUERY_FIELDS["topic_id"],
     year_start: int = DEFAULT_QUERY_FIELDS["year_start"],
@@ -153,7 +163,8 @@ async def get_full_topic_profiles(
 
 
 @ router.get("/get_topics_by_doc_id")
-async def get_topics_by_doc_id(
+@ offload_model
+def get_topics_by_doc_id(
     model_id: str = DEFAULT_QUERY_FIELDS["model_id"],
     doc_id: str = Query(..., description="Document id"),
     topn_words: int = DEFAULT_QUERY_FIELDS["topn_words"],
@@ -176,7 +187,8 @@ async def get_topics_by_doc_id(
 
 
 @ router.post("/analyze_file")
-async def analyze_file(
+@ offload_model
+def analyze_file(
     model_id: str = Form(...),
     file: UploadFile = File(...),
     topn_words: int = Form(10),
@@ -200,7 +212,8 @@ async def analyze_file(
 
 
 @ router.post("/analyze_url")
-async def analyze_url(
+@ offload_model
+def analyze_url(
     model_id: str = Form(...),
     url: HttpUrl = Form(...),
     topn_words: int = Form(10),
@@ -3,6 +3,7 @@
 from functools import lru_cache
 from fastapi import APIRouter
 import requests
+from ...common.concurrency import offload_io
 
 
 router = APIRouter(
@@ -35,7 +36,8 @@ def _get_microdata_metadata(idno):
 
 
 @ router.get("/get_microdata_metadata/{idno}")
-async def get_microdata_metadata(idno: str):
+@ offload_io
+def get_microdata_metadata(idno: str):
     '''This provides an interface to the IHSN microdata catalog API.
     '''
     data = None
@@ -48,7 +50,8 @@ async def get_microdata_metadata(idno: str):
 
 
 @ router.get("/get_microdata_study_info/{idno}")
-async def get_microdata_study_info(idno: str):
+@ offload_io
+def get_microdata_study_info(idno: str):
     '''This provides an interface to the IHSN microdata catalog's API study info.
     '''
     data = None
@@ -15,10 +15,11 @@ from wb_nlp.types.models import (
     ModelTypes,
     TopicCompositionParams, PartitionTopicShareParams, FullTopicProfilesParams
 )
-from wb_nlp.interfaces import mongodb, elasticsearch
+from wb_nlp.interfaces import elasticsearch
+from wb_nlp.interfaces.doc_metadata import hydrate_doc_metadata
 from ...common.utils import (
-    get_validated_model, read_uploaded_file,
-    read_url_file, clean_text
+    get_validated_model, ingest_uploaded_file,
+    ingest_url_file, clean_text, clean_ingested_text
 )
 
 # router = APIRouter(
@@ -139,13 +140,8 @@ def get_docs_by_topic_composition(
         size=size,
         return_all_topics=transform_params.return_all_topics)
 
-    id_rank = {res["id"]: res["rank"] for res in result["hits"]}
-
-    docs_metadata = mongodb.get_collection(
-        db_name="test_nlp", collection_name="docs_metadata")
-    # docs_metadata = mongodb.get_docs_metadata_collection()
-
-    response = docs_metadata.find({"id": {"$in": list(id_rank.keys())}})
+    doc_ids = [res["id"]
+               for res in sorted(result["hits"], key=lambda x: x["rank"])]
 
     total = dict(
         value=result["total"],
@@ -154,7 +150,7 @@ def get_docs_by_topic_composition(
 
     return dict(
         total=total,
-        hits=[h for h in sorted(response, key=lambda x: id_rank[x["id"]])],
+        hits=hydrate_doc_metadata(doc_ids),
         api_result=result,
         next=from_result + size,
         result=result,
@@ -283,7 +279,8 @@ def analyze_document(
     total_word_score: float = 1,
     sort: bool = True,
     clean: bool = True,
-    format_words: bool = True
+    format_words: bool = True,
+    ingested=None,
 ):
     # Get country related metadata
 
@@ -302,7 +299,9 @@ def analyze_document(
 
     model = get_validated_model(model_name, model_id)
 
-    if clean:
+    if clean and ingested is not None:
+        model_text = clean_ingested_text(model_name, model_id, ingested)
+    elif clean:
         model_text = clean_text(model_name, model_id, text)
         # query = model.clean_text(query)
     else:
@@ -349,12 +348,13 @@ def analyze_file(
     '''
     print({"filename": file.filename})
 
-    document = read_uploaded_file(file)
+    doc = ingest_uploaded_file(file)
 
     return analyze_document(
         model_name=model_name,
         model_id=model_id,
-        text=document,
+        text=doc.text,
+        ingested=doc,
         topn_words=topn_words,
         total_word_score=total_word_score,
         sort=sort,
@@ -376,12 +376,13 @@ def analyze_url(
     '''This endpoint provides the service for analyzing a document given a url. This returns extracted countries from the document and the infered topics based on the model selected.
     '''
 
-    document = read_url_file(url)
+    doc = ingest_url_file(url)
 
     return analyze_document(
         model_name=model_name,
         model_id=model_id,
-        text=document,
+        text=doc.text,
+        ingested=doc,
         topn_words=topn_words,
         total_word_score=total_word_score,
         sort=sort,
@@ -13,6 +13,8 @@ from wb_nlp.types.models import (
 from wb_nlp import dir_manager
 
 from ...common.utils import get_validated_model
+from ...common.concurrency import offload_io, offload_model
+
 
 router = APIRouter(
     prefix="/wdi",
@@ -31,7 +33,8 @@ def _get_wdi_metadata(url_meta):
 
 
 @ router.get("/get_similar_wdi_by_doc_id")
-async def get_similar_wdi_by_doc_id(doc_id: str, model_id: str, topn: int = 10):
+@ offload_model
+def get_similar_wdi_by_doc_id(doc_id: str, model_id: str, topn: int = 10):
     '''This endpoint converts the `raw_text` provided into a vector transformed using the specified word2vec model.
     '''
     model = get_validated_model(ModelTypes(
@@ -54,7 +57,8 @@ async def get_similar_wdi_by_doc_id(doc_id: str, model_id: str, topn: int = 10):
 
 
 @ router.get("/get_wdi_metadata")
-async def get_wdi_metadata(url_meta: AnyHttpUrl):
+@ offload_io
+def get_wdi_metadata(url_meta: AnyHttpUrl):
     '''This endpoint converts the `raw_text` provided into a vector transformed using the specified word2vec model.
     '''
 
@@ -8,6 +8,8 @@ from wb_nlp.types.models import (
 )
 
 from ...common.utils import get_validated_model
+from ...common.concurrency import offload_model
+
 
 router = APIRouter(
     prefix="/word2vec",
@@ -18,7 +20,8 @@ router = APIRouter(
 
 
 @ router.get("/get_similar_words_graph")
-async def get_similar_words_graph(
+@ offload_model
+def get_similar_words_graph(
     model_id: str = Query(..., description="Identification of the desired model configuration to use for the operation. The cleaning pipeline associated with this model will also be applied."),
     raw_text: str = Query(
         ..., description="Input text to transform."),
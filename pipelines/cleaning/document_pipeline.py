@@ -18,19 +18,28 @@ Expected output:
 1. Get metadata
 
 """
-from collections import Counter
+from collections import Counter, deque
+import os
 import html
 import json
+import time
 import shutil
+import signal
+import resource
+import multiprocessing
+from multiprocessing.connection import wait
 from pathlib import Path
+import dask
 from polyglot.detect import Detector
+from pdf2image import convert_from_bytes
 
-from prefect import task, Flow, Parameter, flatten, Task
+from prefect import task, Flow, Parameter, flatten, unmapped, Task
 from prefect.executors import DaskExecutor
 from prefect.triggers import all_finished
 from prefect.tasks.shell import ShellTask
 
 from wb_nlp import dir_manager
+from wb_nlp.utils.manifest import PDFManifest, PDF_DONE, PDF_FAILED, PDF_TIMEOUT, PDF_MISSING
 from wb_cleaning.types.metadata import MetadataModel
 from wb_cleaning.processing import document
 from wb_cleaning.extraction.pdf_cover import DocumentCover
@@ -44,6 +53,11 @@ from wb_cleaning.extraction.english_content_extractor import filter_document_by_
 
 MAX_LINES = 500
 
+# Defaults of the PDF processing stage.
+PDF_WORKERS = 4
+PDF_TIMEOUT_SECONDS = 600
+PDF_MEMORY_LIMIT = 4 * 1024 ** 3
+
 shell_task = ShellTask(helper_script=f"cd {dir_manager.get_path_from_root()}")
 
 
@@ -432,6 +446,157 @@ def extract_batched_pdf_cover(input_files):
         _extract_pdf_cover(input_file)
 
 
+def get_pdf_manifest(corpus_id):
+    return PDFManifest(dir_manager.get_data_dir(
+        "corpus", corpus_id, "pdf_manifest.sqlite"))
+
+
+def _write_atomic(output_file, write):
+    tmp_file = output_file.with_name(f"{output_file.name}.{os.getpid()}.tmp")
+    write(tmp_file)
+    os.replace(tmp_file, output_file)
+
+
+def _extract_pdf_text_and_cover(input_file):
+    '''
+    Extracts the text and the cover of the pdf from a single read of the file.
+
+    input_file: assumes this form /path-to-corpus/corpus/<corpus_id>/PDF_ORIG/<doc_id>.pdf
+    '''
+    doc_id = input_file.stem
+    corpus_id = input_file.parent.parent.name
+    corpus_dir = Path(dir_manager.get_data_dir("corpus", corpus_id))
+
+    output_file = corpus_dir / "TXT_ORIG" / f"{doc_id}.txt"
+    cover_file = corpus_dir / "COVER" / f"{doc_id}.png"
+    scraped_txt_file = input_file.parent.parent / "TXT_ORIG" / f"{doc_id}.txt"
+
+    content = None
+    message = "OK"
+
+    if not output_file.exists():
+        if not scraped_txt_file.exists():
+            content = input_file.read_bytes()
+            pages = document.PDFDoc2Txt().parse(
+                source=content, source_type="buffer")
+
+            _write_atomic(output_file, lambda p: p.write_text(" ".join(pages)))
+        else:
+            shutil.copy(scraped_txt_file, output_file)
+
+    if not cover_file.exists():
+        try:
+            # The pdf may be missing if the text was scraped.
+            if content is None:
+                content = input_file.read_bytes()
+
+            # Only render the first page.
+            cover = convert_from_bytes(content, first_page=1, last_page=1)[0]
+            _write_atomic(cover_file, lambda p: cover.save(p, "PNG"))
+        except Exception as e:
+            # Gracefully handle cover extraction error.
+            # Example: pdf2image.exceptions.PDFPageCountError: Unable to get page count.
+            message = f"Cover not extracted: {e}"
+
+    return message
+
+
+def _pdf_worker(input_file, conn, memory_limit):
+    # Own process group so that the subprocesses (e.g., poppler) are killed with the worker.
+    os.setsid()
+
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    try:
+        conn.send((PDF_DONE, _extract_pdf_text_and_cover(input_file)))
+    except MemoryError:
+        conn.send((PDF_FAILED, "Memory limit exceeded."))
+    except FileNotFoundError as e:
+        # Neither the pdf nor a scraped text of the document exists.
+        conn.send((PDF_MISSING if not input_file.exists() else PDF_FAILED, f"{type(e).__name__}: {e}"))
+    except Exception as e:
+        conn.send((PDF_FAILED, f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def _process_pdfs(input_files, manifest, workers=PDF_WORKERS, timeout=PDF_TIMEOUT_SECONDS, memory_limit=PDF_MEMORY_LIMIT, retry_failed=False):
+    '''
+    Processes each pdf in a separate process that is killed if it exceeds
+    the `timeout` or the `memory_limit`. At most `workers` files are processed
+    concurrently. The status of each file is recorded in the `manifest`.
+
+    Returns the text files of all the pdfs successfully processed.
+    '''
+    ctx = multiprocessing.get_context("fork")
+    pending = deque(manifest.get_pending(input_files, retry_failed=retry_failed))
+    running = {}
+
+    print(f"Processing {len(pending)} of {len(input_files)} pdfs...")
+
+    while pending or running:
+        while pending and len(running) < workers:
+            input_file = pending.popleft()
+            recv_conn, send_conn = ctx.Pipe(duplex=False)
+            proc = ctx.Process(target=_pdf_worker, args=(
+                input_file, send_conn, memory_limit), daemon=True)
+            proc.start()
+            send_conn.close()
+            running[proc.sentinel] = (proc, recv_conn, input_file, time.time())
+
+        ready = wait(list(running), timeout=1)
+        now = time.time()
+
+        for sentinel, (proc, recv_conn, input_file, started) in list(running.items()):
+            elapsed = now - started
+
+            if sentinel in ready:
+                if recv_conn.poll():
+                    status, message = recv_conn.recv()
+                else:
+                    # Killed without reporting, e.g., by the OOM killer.
+                    status, message = PDF_FAILED, f"Worker exited with code {proc.exitcode}."
+            elif elapsed > timeout:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    # The worker didn't create its process group yet.
+                    proc.kill()
+                status, message = PDF_TIMEOUT, f"Timed out after {timeout}s."
+            else:
+                continue
+
+            proc.join()
+            recv_conn.close()
+            del running[sentinel]
+
+            manifest.set_status(input_file, status,
+                                message=message, elapsed=elapsed)
+
+    text_files = []
+    for input_file in input_files:
+        output_file = Path(dir_manager.get_data_dir(
+            "corpus", input_file.parent.parent.name, "TXT_ORIG", f"{input_file.stem}.txt"))
+
+        if output_file.exists():
+            text_files.append(output_file)
+
+    return text_files
+
+
+@task
+def process_batched_pdfs(input_files, workers=PDF_WORKERS, timeout=PDF_TIMEOUT_SECONDS, memory_limit=PDF_MEMORY_LIMIT, retry_failed=False):
+    if not input_files:
+        return []
+
+    manifest = get_pdf_manifest(input_files[0].parent.parent.name)
+
+    return _process_pdfs(
+        input_files, manifest, workers=workers, timeout=timeout,
+        memory_limit=memory_limit, retry_failed=retry_failed)
+
+
 #######################
 # TEXT PROCESSING TASKS
 #######################
@@ -540,13 +705,18 @@ def remove_corpus_tmp_dir(corpus_id):
 #     pass
 
 
-def main(corpus_id, scraper_root=None, size=None):
+def main(corpus_id, scraper_root=None, size=None, pdf_workers=PDF_WORKERS, pdf_timeout=PDF_TIMEOUT_SECONDS, pdf_memory_limit=PDF_MEMORY_LIMIT, retry_failed=False):
     assert corpus_id, "Please specify the corpus_id to be processed with the --corpus-id=<corpus_id> parameter..."
 
     with Flow("cleaning") as flow:
         flow_corpus_id = Parameter("corpus_id", default="WB")
         flow_scraper_root = Parameter("scraper_root", default=None)
         max_process_size = Parameter("size", default=None)
+        flow_pdf_workers = Parameter("pdf_workers", default=PDF_WORKERS)
+        flow_pdf_timeout = Parameter("pdf_timeout", default=PDF_TIMEOUT_SECONDS)
+        flow_pdf_memory_limit = Parameter(
+            "pdf_memory_limit", default=PDF_MEMORY_LIMIT)
+        flow_retry_failed = Parameter("retry_failed", default=False)
 
         flow_corpus_id = create_corpus_dirs(flow_corpus_id)
 
@@ -602,10 +772,17 @@ def main(corpus_id, scraper_root=None, size=None):
         # valid_text_files = extract_valid_language_lines.map(corpus_text_files)
         # end_report = end_task_report(valid_text_files)
 
-        extract_batched_pdf_cover.map(batched_pdf_paths)
+        # extract_batched_pdf_cover.map(batched_pdf_paths)
+        # batched_corpus_text_files = convert_batched_pdf_to_text.map(
+        #     batched_pdf_paths)
 
-        batched_corpus_text_files = convert_batched_pdf_to_text.map(
-            batched_pdf_paths)
+        # Each pdf is read once for both the text and the cover.
+        batched_corpus_text_files = process_batched_pdfs.map(
+            batched_pdf_paths,
+            workers=unmapped(flow_pdf_workers),
+            timeout=unmapped(flow_pdf_timeout),
+            memory_limit=unmapped(flow_pdf_memory_limit),
+            retry_failed=unmapped(flow_retry_failed))
 
         batched_valid_text_files = extract_batched_valid_language_lines.map(
             batched_corpus_text_files)
@@ -619,7 +796,12 @@ def main(corpus_id, scraper_root=None, size=None):
         #     batched_valid_text_files)
         # remove_corpus_tmp_dir(flow_corpus_id)
 
-    flow.run(corpus_id=corpus_id, size=size, scraper_root=scraper_root, executor=DaskExecutor(
+    # The pdf stage starts its own worker processes, which daemonic dask workers can't.
+    dask.config.set({"distributed.worker.daemon": False})
+
+    flow.run(corpus_id=corpus_id, size=size, scraper_root=scraper_root,
+             pdf_workers=pdf_workers, pdf_timeout=pdf_timeout,
+             pdf_memory_limit=pdf_memory_limit, retry_failed=retry_failed, executor=DaskExecutor(
         adapt_kwargs={"maximum": 128}))
 
 
@@ -631,6 +813,14 @@ if __name__ == "__main__":
     parser.add_argument(
         '--scraper-root', dest='scraper_root', type=str, default=None)
     parser.add_argument('--size', dest='size', type=int, default=None)
+    parser.add_argument('--pdf-workers', dest='pdf_workers',
+                        type=int, default=PDF_WORKERS)
+    parser.add_argument('--pdf-timeout', dest='pdf_timeout',
+                        type=int, default=PDF_TIMEOUT_SECONDS)
+    parser.add_argument('--pdf-memory-limit', dest='pdf_memory_limit',
+                        type=int, default=PDF_MEMORY_LIMIT)
+    parser.add_argument('--retry-failed', dest='retry_failed',
+                        action='store_true')
     args = parser.parse_args()
 
     main(**vars(args))
@@ -81,6 +81,7 @@ import json
 from pathlib import Path
 from wb_nlp import dir_manager
 from wb_nlp.interfaces import elasticsearch, mongodb
+from wb_nlp.interfaces.doc_id_map import refresh_doc_id_map
 
 
 def get_docs_metadata_collection():
@@ -178,6 +179,9 @@ def main():
     print("load_data_to_es")
     mongodb_doc_count = load_data_to_es()
 
+    print("refresh_doc_id_map")
+    refresh_doc_id_map()
+
     print("set_update_latest_data")
     set_update_latest_data(mongodb_doc_count)
 
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import click
+import wb_nlp
+from wb_nlp.types.models import IndicatorTypes
+from wb_nlp.models import word2vec_base, wdi_base, sdg_base, microdata_base
+
+
+_logger = logging.getLogger(__name__)
+
+INDICATOR_MODELS = {
+    IndicatorTypes.wdi: wdi_base.WDIModel,
+    IndicatorTypes.sdg: sdg_base.SDGModel,
+    IndicatorTypes.microdata: microdata_base.MicrodataModel,
+}
+
+
+@click.command()
+@click.option('-mcid', '--model-config-id', 'model_config_id', required=True,
+              help='Configuration id of the word2vec model used to embed the indicators.')
+@click.option('-ccid', '--cleaning-config-id', 'cleaning_config_id', required=True,
+              help='Configuration id of the cleaning pipeline used in cleaning the input data.')
+@click.option('-mrid', '--model-run-info-id', 'model_run_info_id', required=True,
+              help='Model run id of the word2vec model used to embed the indicators.')
+@click.option('-i', '--indicator-code', 'indicator_codes', multiple=True,
+              type=click.Choice([i.value for i in IndicatorTypes]),
+              help='Indicators to build. All the indicators are built by default.')
+@click.option('--n-jobs', 'n_jobs', type=int, default=None,
+              help='Number of processes used to clean the microdata metadata.')
+@click.option('--quiet', 'log_level', flag_value=logging.WARNING, default=True)
+@click.option('-v', '--verbose', 'log_level', flag_value=logging.INFO)
+@click.option('-vv', '--very-verbose', 'log_level', flag_value=logging.DEBUG)
+@click.version_option(wb_nlp.__version__)
+def main(model_config_id: str, cleaning_config_id: str, model_run_info_id: str, indicator_codes: tuple, n_jobs: int, log_level: int):
+
+    wvec_model = word2vec_base.Word2VecModel(
+        model_config_id=model_config_id,
+        cleaning_config_id=cleaning_config_id,
+        model_run_info_id=model_run_info_id,
+        raise_empty_doc_status=False,
+        log_level=log_level,
+    )
+
+    indicator_codes = [IndicatorTypes(i) for i in indicator_codes] or list(IndicatorTypes)
+
+    for indicator_code in indicator_codes:
+        _logger.info(f"Building the vectors of {indicator_code.value}...")
+
+        indicator_model = INDICATOR_MODELS[indicator_code](
+            wvec_model=wvec_model,
+            model_config_id=model_config_id,
+            cleaning_config_id=cleaning_config_id,
+            model_run_info_id=model_run_info_id,
+            log_level=log_level,
+        )
+
+        # The build is skipped for the indicators already in the collection.
+        indicator_model.build_indicator_vectors(
+            is_parallel=indicator_code == IndicatorTypes.microdata, n_jobs=n_jobs)
+
+
+if __name__ == '__main__':
+    # python -u ./scripts/models/build_indicator_vectors.py --model-config-id <model_config_id> --cleaning-config-id <cleaning_config_id> --model-run-info-id <model_run_info_id> -vv |& tee ./data/logs/build_indicator_vectors.py.log
+    main()
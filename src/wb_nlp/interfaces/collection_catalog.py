@@ -0,0 +1,151 @@
+'''This module implements a catalog of the metadata of the collections of the
+vector store: the number of vectors, the dimension, the partitions, and the
+build version of each collection.
+
+The readiness checks of the models run on every query. The catalog answers
+them from memory instead of asking the vector store each time. An entry is
+refreshed when the build version of the collection changes, i.e., after
+`build_doc_vecs` or `drop_milvus_collection`, and at the latest every
+`WB_NLP_COLLECTION_CATALOG_TTL` seconds. Entries of collections that are
+empty or missing are refreshed more often so that a collection becomes
+available soon after it is built by another process.
+
+The build version of a collection is kept in a file next to the model. The
+catalog caches it too, and stats the file at most every
+`WB_NLP_COLLECTION_VERSION_CHECK_INTERVAL` seconds. The file is only read
+again when its modification time changed.
+
+Configuration:
+    - WB_NLP_COLLECTION_CATALOG_TTL: maximum age in seconds of an entry.
+    - WB_NLP_COLLECTION_CATALOG_EMPTY_TTL: maximum age in seconds of an entry of an empty collection.
+    - WB_NLP_COLLECTION_VERSION_CHECK_INTERVAL: interval in seconds between the checks of the version file of a collection.
+'''
+import os
+import time
+import logging
+import threading
+
+from wb_nlp.interfaces.vector_store import get_vector_store
+
+
+COLLECTION_CATALOG_TTL = float(
+    os.environ.get("WB_NLP_COLLECTION_CATALOG_TTL", 300))
+COLLECTION_CATALOG_EMPTY_TTL = float(
+    os.environ.get("WB_NLP_COLLECTION_CATALOG_EMPTY_TTL", 5))
+
+COLLECTION_VERSION_CHECK_INTERVAL = float(
+    os.environ.get("WB_NLP_COLLECTION_VERSION_CHECK_INTERVAL", 2))
+
+COLLECTION_CATALOG = None
+
+
+class CollectionCatalog:
+    '''In-memory metadata of the collections of the vector store.
+    '''
+
+    def __init__(self, ttl=COLLECTION_CATALOG_TTL, empty_ttl=COLLECTION_CATALOG_EMPTY_TTL,
+                 version_check_interval=COLLECTION_VERSION_CHECK_INTERVAL):
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self.version_check_interval = version_check_interval
+        self.entries = {}
+        # collection_name -> (version, mtime_ns of the version file, checked_at)
+        self.versions = {}
+        self.stats = dict(hits=0, refreshes=0, errors=0)
+        self._lock = threading.Lock()
+
+    def refresh(self, collection_name, version=None):
+        '''Reads the metadata of the collection from the vector store.
+        '''
+        vector_store = get_vector_store()
+
+        try:
+            if vector_store.has_collection(collection_name):
+                entry = dict(vector_store.describe(collection_name), exists=True)
+            else:
+                entry = dict(count=0, dim=None, partitions=[],
+                             version=None, exists=False)
+        except Exception as e:
+            logging.error(e)
+            self.stats["errors"] += 1
+            raise
+
+        # The build version of the model takes precedence over the one of the store.
+        entry.update(build_version=version, refreshed_at=time.time())
+
+        with self._lock:
+            self.entries[collection_name] = entry
+            self.stats["refreshes"] += 1
+
+        return entry
+
+    def get(self, collection_name, version=None):
+        '''Returns the metadata of the collection. The entry is refreshed if
+        it expired or if the `version` differs from the one cached.
+        '''
+        entry = self.entries.get(collection_name)
+
+        if entry is not None and entry["build_version"] == version:
+            ttl = self.ttl if entry["count"] else self.empty_ttl
+
+            if time.time() - entry["refreshed_at"] < ttl:
+                self.stats["hits"] += 1
+                return entry
+
+        return self.refresh(collection_name, version=version)
+
+    def get_version(self, collection_name, version_file, default="0"):
+        '''Returns the build version of the collection stored in
+        `version_file`, or `default` if the file does not exist.
+        '''
+        now = time.time()
+        cached = self.versions.get(collection_name)
+
+        if cached is not None and now - cached[2] < self.version_check_interval:
+            return cached[0]
+
+        try:
+            mtime_ns = version_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+
+        if cached is not None and cached[1] == mtime_ns:
+            version = cached[0]
+        elif mtime_ns is None:
+            version = default
+        else:
+            try:
+                version = version_file.read_text().strip()
+            except FileNotFoundError:
+                version, mtime_ns = default, None
+
+        with self._lock:
+            self.versions[collection_name] = (version, mtime_ns, now)
+
+        return version
+
+    def is_ready(self, collection_name, version=None):
+        return self.get(collection_name, version=version)["count"] > 0
+
+    def invalidate(self, collection_name=None):
+        with self._lock:
+            if collection_name is None:
+                self.entries.clear()
+                self.versions.clear()
+            else:
+                self.entries.pop(collection_name, None)
+                self.versions.pop(collection_name, None)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, ttl=self.ttl, empty_ttl=self.empty_ttl,
+                        collections={name: dict(entry) for name, entry in sorted(self.entries.items())})
+
+
+def get_collection_catalog():
+    global COLLECTION_CATALOG
+
+    if COLLECTION_CATALOG is None:
+        COLLECTION_CATALOG = CollectionCatalog()
+
+    return COLLECTION_CATALOG
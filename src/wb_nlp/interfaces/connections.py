@@ -0,0 +1,283 @@
+'''This module implements the management of the clients of the backends
+(Mongo, Elasticsearch, Milvus).
+
+Each process keeps a single pooled client per backend. The clients are not
+checked on each use: a background thread pings them every
+`WB_NLP_HEALTH_CHECK_INTERVAL` seconds, and a client that fails the check or
+that is reported as failed by its users is recreated on its next use. The
+connection attempts are retried with a jittered exponential backoff.
+
+The functions using a client are wrapped with `reconnect_on_failure`: on a
+connection error, the client is checked right away, and the function is
+retried once with a new client if the check fails. The writes that are not
+idempotent, e.g., the inserts in Milvus that don't dedupe the ids, are not
+retried.
+
+The clients are dropped in the child processes after a fork (gunicorn,
+Dask, and the pools of worker processes), so that the children don't share
+the sockets of the parent, and are recreated on their first use.
+
+Configuration:
+    - WB_NLP_HEALTH_CHECK_INTERVAL: seconds between the health checks, 0 to only check on failure.
+    - WB_NLP_CONNECT_RETRIES: number of connection attempts before failing.
+    - WB_NLP_CONNECT_BACKOFF: base delay in seconds of the backoff between the attempts.
+    - WB_NLP_CONNECT_MAX_BACKOFF: maximum delay in seconds between the attempts.
+'''
+import os
+import time
+import random
+import logging
+import functools
+import threading
+
+
+HEALTH_CHECK_INTERVAL = float(
+    os.environ.get("WB_NLP_HEALTH_CHECK_INTERVAL", 30))
+CONNECT_RETRIES = int(os.environ.get("WB_NLP_CONNECT_RETRIES", 5))
+CONNECT_BACKOFF = float(os.environ.get("WB_NLP_CONNECT_BACKOFF", 0.2))
+CONNECT_MAX_BACKOFF = float(os.environ.get("WB_NLP_CONNECT_MAX_BACKOFF", 5))
+
+CONNECTION_MANAGER = None
+
+
+def get_backoff_delay(attempt, base=CONNECT_BACKOFF, max_delay=CONNECT_MAX_BACKOFF):
+    # Full jitter so that the workers don't reconnect in lockstep.
+    return random.uniform(0, min(max_delay, base * (2 ** attempt)))
+
+
+class ManagedClient:
+    '''A client of a backend created by `factory` and checked by `health_check`.
+    '''
+
+    def __init__(self, name, factory, health_check, close=None, get_pool_stats=None, on_reset=None, retries=CONNECT_RETRIES,
+                 failure_errors=(Exception,)):
+        self.name = name
+        self.factory = factory
+        self.health_check = health_check
+        # Errors of the users of the client that trigger a health check.
+        self.failure_errors = failure_errors
+        self.close = close
+        self.get_pool_stats = get_pool_stats
+        self.on_reset = on_reset
+        self.retries = retries
+
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''Drops the client without closing it. Used in the child processes
+        after a fork where the client belongs to the parent.
+        '''
+        self.client = None
+        self.healthy = False
+        self.stats = dict(connects=0, connect_failures=0, health_checks=0,
+                          health_check_failures=0, reported_failures=0,
+                          last_check_at=None, last_error=None)
+
+        if self.on_reset is not None:
+            self.on_reset()
+
+    def connect(self):
+        last_error = None
+
+        for attempt in range(self.retries):
+            if attempt:
+                time.sleep(get_backoff_delay(attempt - 1))
+
+            try:
+                client = self.factory()
+                self.health_check(client)
+            except Exception as e:
+                last_error = e
+                self.stats["connect_failures"] += 1
+                self.stats["last_error"] = str(e)
+                logging.error(
+                    f"Connection to {self.name} failed (attempt {attempt + 1} of {self.retries}): {e}")
+                continue
+
+            self.stats["connects"] += 1
+            return client
+
+        raise ConnectionError(
+            f"Connection to {self.name} is not available: {last_error}") from last_error
+
+    def get(self):
+        client = self.client
+
+        if client is not None and self.healthy:
+            return client
+
+        with self._lock:
+            if self.client is None or not self.healthy:
+                old_client = self.client
+                self.client = self.connect()
+                self.healthy = True
+
+                if old_client is not None:
+                    self._close(old_client)
+
+            return self.client
+
+    def _close(self, client):
+        if self.close is None:
+            return
+
+        try:
+            self.close(client)
+        except Exception as e:
+            logging.error(e)
+
+    def mark_failed(self):
+        '''Reports a failure of the client. The client is checked right away
+        and recreated on its next use if the check fails. Returns whether the
+        client is still healthy.
+        '''
+        self.stats["reported_failures"] += 1
+        self.check()
+
+        return self.healthy
+
+    def check(self):
+        client = self.client
+
+        if client is None:
+            return
+
+        self.stats["health_checks"] += 1
+        self.stats["last_check_at"] = time.time()
+
+        try:
+            self.health_check(client)
+            self.healthy = True
+        except Exception as e:
+            self.stats["health_check_failures"] += 1
+            self.stats["last_error"] = str(e)
+            self.healthy = False
+
+    def get_stats(self):
+        stats = dict(self.stats, connected=self.client is not None,
+                     healthy=self.healthy)
+
+        if self.client is not None and self.get_pool_stats is not None:
+            try:
+                stats["pool"] = self.get_pool_stats(self.client)
+            except Exception as e:
+                stats["pool"] = dict(error=str(e))
+
+        return stats
+
+
+class ConnectionManager:
+    '''Registry of the clients of the process.
+    '''
+
+    def __init__(self, health_check_interval=HEALTH_CHECK_INTERVAL):
+        self.health_check_interval = health_check_interval
+        self.clients = {}
+        self.pid = os.getpid()
+
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, name, factory, health_check, **kwargs):
+        with self._lock:
+            if name not in self.clients:
+                self.clients[name] = ManagedClient(
+                    name, factory, health_check, **kwargs)
+
+            return self.clients[name]
+
+    def get(self, name):
+        self.ensure_health_checks()
+
+        return self.clients[name].get()
+
+    def mark_failed(self, name):
+        return self.clients[name].mark_failed()
+
+    def get_clients(self, name):
+        '''Returns the clients registered as `name` or as `name:<suffix>`,
+        e.g., the clients of each Mongo server.
+        '''
+        return [managed for client_name, managed in list(self.clients.items())
+                if client_name == name or client_name.startswith(f"{name}:")]
+
+    def after_fork(self):
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        for managed in self.clients.values():
+            managed._lock = threading.Lock()
+            managed.reset()
+
+    def ensure_health_checks(self):
+        if self.health_check_interval <= 0 or self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self.run_health_checks, name="wb_nlp_health_checks", daemon=True)
+                self._thread.start()
+
+    def run_health_checks(self):
+        while True:
+            time.sleep(self.health_check_interval)
+
+            for managed in list(self.clients.values()):
+                managed.check()
+
+    def get_stats(self):
+        return dict(
+            pid=self.pid,
+            health_check_interval=self.health_check_interval,
+            clients={name: managed.get_stats()
+                     for name, managed in sorted(self.clients.items())})
+
+
+def reconnect_on_failure(name, retry=True):
+    '''Decorator of the functions using the client `name`. If the function
+    fails with one of the `failure_errors` of the client, the failure is
+    reported to the manager. The function is retried once if the client is
+    found unhealthy, so that it runs with a new client, unless `retry` is
+    False, e.g., for the writes that would be applied twice.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                failed = [managed for managed in get_connection_manager().get_clients(name)
+                          if isinstance(e, managed.failure_errors)]
+
+                # Evaluate all the health checks before deciding to retry.
+                if all([managed.mark_failed() for managed in failed]) or not retry:
+                    raise
+
+                logging.warning(
+                    f"The {name} client failed its health check after: {e}. Retrying with a new client...")
+
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def get_connection_manager():
+    global CONNECTION_MANAGER
+
+    if CONNECTION_MANAGER is None:
+        CONNECTION_MANAGER = ConnectionManager()
+
+    return CONNECTION_MANAGER
+
+
+def _after_fork_in_child():
+    if CONNECTION_MANAGER is not None:
+        CONNECTION_MANAGER.after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
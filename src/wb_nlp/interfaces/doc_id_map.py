@@ -0,0 +1,489 @@
+'''This module implements the mapping between the `int_id` of the documents,
+used as the ids of the vectors in the vector index, and their `id`.
+
+The mapping is stored in NumPy arrays on disk and loaded by memory-map so
+that the worker processes share the same pages:
+
+    - int_ids.npy: the sorted int64 `int_id` of the documents.
+    - id_offsets.npy, id_chars.npy: the utf-8 encoded `id` of the documents
+      packed in a single uint8 array in the order of `int_ids`.
+    - id_hashes.npy, id_positions.npy: the sorted 64-bit hashes of the `id`
+      and the position of the corresponding document in `int_ids`.
+
+Each build of the arrays is written in a new generation directory and the
+`CURRENT` file is then atomically replaced to point to it. The processes
+using the map load the new generation when they notice the change.
+
+The map is refreshed incrementally. The documents are stamped with the
+server time of their last write (`updated_at`), and the `CURRENT` file keeps
+the latest stamp seen by the refresh as a watermark. The refresh only reads
+the documents written after the watermark, minus an overlap for the writes
+committed out of order, and appends the ones that are not in the map yet to
+the existing arrays. Lookups of documents that are not in the map fall back
+to the database.
+
+Configuration:
+    - WB_NLP_DOC_ID_MAP_DIR: directory where the arrays are stored.
+    - WB_NLP_DOC_ID_MAP_CHECK_INTERVAL: interval in seconds between the checks for a new generation of the map.
+'''
+import os
+import json
+import time
+import shutil
+import threading
+from datetime import datetime, timedelta
+from hashlib import blake2b
+from pathlib import Path
+
+import numpy as np
+import pymongo
+
+from wb_nlp import dir_manager
+from wb_nlp.interfaces import mongodb
+from wb_nlp.interfaces.connections import reconnect_on_failure
+from wb_nlp.utils.scripts import file_lock
+
+
+DOC_ID_MAP_DIR = os.environ.get(
+    "WB_NLP_DOC_ID_MAP_DIR",
+    dir_manager.get_path_from_root("models", "doc_id_map"))
+DOC_ID_MAP_CHECK_INTERVAL = float(
+    os.environ.get("WB_NLP_DOC_ID_MAP_CHECK_INTERVAL", 60))
+
+ARRAY_NAMES = ["int_ids", "id_offsets",
+               "id_chars", "id_hashes", "id_positions"]
+# Number of previous generations kept so that the processes that have not
+# reloaded the map yet can still open it.
+KEEP_GENERATIONS = 2
+# Documents written this long before the watermark are read again by the
+# refresh since concurrent writes may be committed out of order.
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+DOC_ID_MAP = None
+
+
+def hash_doc_id(doc_id):
+    return int.from_bytes(
+        blake2b(doc_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def hash_doc_ids(doc_ids):
+    return np.fromiter((hash_doc_id(doc_id) for doc_id in doc_ids),
+                       dtype=np.uint64, count=len(doc_ids))
+
+
+def pack_doc_ids(doc_ids):
+    '''Returns the (offsets, chars) of the packed utf-8 encoded `doc_ids`.
+    '''
+    encoded = [doc_id.encode("utf-8") for doc_id in doc_ids]
+
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    chars = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    return offsets, chars
+
+
+def build_arrays(int_ids, doc_ids):
+    '''Returns the arrays of the map of the (`int_ids`, `doc_ids`) pairs.
+    '''
+    int_ids = np.asarray(int_ids, dtype=np.int64)
+    order = np.argsort(int_ids, kind="stable")
+
+    int_ids = int_ids[order]
+    doc_ids = [doc_ids[ix] for ix in order]
+
+    offsets, chars = pack_doc_ids(doc_ids)
+    hashes = hash_doc_ids(doc_ids)
+    positions = np.argsort(hashes, kind="stable")
+
+    return dict(
+        int_ids=int_ids,
+        id_offsets=offsets,
+        id_chars=chars,
+        id_hashes=hashes[positions],
+        id_positions=positions.astype(np.int64),
+    )
+
+
+def merge_arrays(arrays, int_ids, doc_ids):
+    '''Returns the arrays of the map with the (`int_ids`, `doc_ids`) pairs
+    added to the existing `arrays`. The ids of the existing pairs are copied
+    as bytes, without decoding them.
+    '''
+    new_arrays = build_arrays(int_ids, doc_ids)
+
+    all_int_ids = np.concatenate([arrays["int_ids"], new_arrays["int_ids"]])
+    order = np.argsort(all_int_ids, kind="stable")
+
+    lengths = np.concatenate([
+        np.diff(arrays["id_offsets"]), np.diff(new_arrays["id_offsets"])])[order]
+    starts = np.concatenate([
+        arrays["id_offsets"][:-1], new_arrays["id_offsets"][:-1] + len(arrays["id_chars"])])[order]
+    chars = np.concatenate([arrays["id_chars"], new_arrays["id_chars"]])
+
+    offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    char_positions = np.repeat(starts - offsets[:-1], lengths) + \
+        np.arange(offsets[-1], dtype=np.int64)
+
+    # The hashes in the order of the ids of each map.
+    hashes = []
+    for a in [arrays, new_arrays]:
+        unsorted_hashes = np.empty(len(a["id_hashes"]), dtype=np.uint64)
+        unsorted_hashes[a["id_positions"]] = a["id_hashes"]
+        hashes.append(unsorted_hashes)
+
+    hashes = np.concatenate(hashes)[order]
+    positions = np.argsort(hashes, kind="stable")
+
+    return dict(
+        int_ids=all_int_ids[order],
+        id_offsets=offsets,
+        id_chars=chars[char_positions],
+        id_hashes=hashes[positions],
+        id_positions=positions.astype(np.int64),
+    )
+
+
+def read_watermark(current):
+    watermark = (current or {}).get("watermark")
+
+    return datetime.fromisoformat(watermark) if watermark else None
+
+
+class DocIdMap:
+    '''Bidirectional map between the `int_id` and the `id` of the documents.
+    '''
+
+    def __init__(self, root_dir=DOC_ID_MAP_DIR, collection=None, check_interval=DOC_ID_MAP_CHECK_INTERVAL):
+        self.root_dir = Path(root_dir)
+        self.collection = collection
+        self.check_interval = check_interval
+
+        self.generation = None
+        self.arrays = None
+        self.checked_at = 0
+
+        # Pairs found in the database but not in the map yet.
+        self._extra_int_id_to_id = {}
+        self._extra_id_to_int_id = {}
+        self._lock = threading.Lock()
+
+    def get_collection(self):
+        if self.collection is None:
+            return mongodb.get_es_nlp_doc_metadata_collection()
+
+        return self.collection
+
+    @property
+    def current_file(self):
+        return self.root_dir / "CURRENT"
+
+    @property
+    def lock_file(self):
+        return self.root_dir / ".lock"
+
+    def read_current(self):
+        try:
+            return json.loads(self.current_file.read_text())
+        except FileNotFoundError:
+            return None
+
+    def load(self, force=False):
+        '''Loads the current generation of the map if it changed. The map is
+        built from the database if it does not exist.
+        '''
+        current = self.read_current()
+
+        if current is None:
+            self.refresh()
+            current = self.read_current()
+
+        if not force and self.generation == current["generation"]:
+            return
+
+        gen_dir = self.root_dir / current["generation"]
+        arrays = {name: np.load(gen_dir / f"{name}.npy", mmap_mode="r")
+                  for name in ARRAY_NAMES}
+
+        with self._lock:
+            self.arrays = arrays
+            self.generation = current["generation"]
+            self._extra_int_id_to_id.clear()
+            self._extra_id_to_int_id.clear()
+
+    def check(self):
+        '''Loads the map if it's not loaded yet, otherwise reloads it at most
+        every `check_interval` seconds if a new generation is available.
+        '''
+        now = time.time()
+
+        if self.arrays is None or now - self.checked_at > self.check_interval:
+            self.checked_at = now
+            self.load()
+
+    def __len__(self):
+        self.check()
+        return len(self.arrays["int_ids"])
+
+    def get_doc_id_at(self, position):
+        offsets = self.arrays["id_offsets"]
+
+        return self.arrays["id_chars"][offsets[position]:offsets[position + 1]].tobytes().decode("utf-8")
+
+    def find_int_ids(self, int_ids):
+        '''Returns the (positions, found) of the `int_ids` in the map.
+        '''
+        map_int_ids = self.arrays["int_ids"]
+        int_ids = np.asarray(int_ids, dtype=np.int64)
+
+        positions = np.searchsorted(map_int_ids, int_ids)
+        positions = np.minimum(positions, max(len(map_int_ids) - 1, 0))
+
+        if len(map_int_ids) == 0:
+            return positions, np.zeros(len(int_ids), dtype=bool)
+
+        return positions, map_int_ids[positions] == int_ids
+
+    def find_doc_ids(self, doc_ids):
+        '''Returns the positions of the `doc_ids` in the map, -1 if not found.
+        '''
+        map_hashes = self.arrays["id_hashes"]
+        map_positions = self.arrays["id_positions"]
+
+        hashes = hash_doc_ids(doc_ids)
+        starts = np.searchsorted(map_hashes, hashes, side="left")
+        ends = np.searchsorted(map_hashes, hashes, side="right")
+
+        positions = np.full(len(doc_ids), -1, dtype=np.int64)
+
+        for ix in np.flatnonzero(ends > starts):
+            # Verify the id since different ids may have the same hash.
+            for hix in range(starts[ix], ends[ix]):
+                position = map_positions[hix]
+
+                if self.get_doc_id_at(position) == doc_ids[ix]:
+                    positions[ix] = position
+                    break
+
+        return positions
+
+    def get_doc_ids(self, int_ids):
+        '''Returns the `id` of the documents with the given `int_ids`, None
+        for the documents that don't exist.
+        '''
+        self.check()
+
+        positions, found = self.find_int_ids(int_ids)
+        doc_ids = [self.get_doc_id_at(position) if f else None
+                   for position, f in zip(positions, found)]
+
+        missing = [int(int_id)
+                   for int_id, doc_id in zip(int_ids, doc_ids) if doc_id is None]
+
+        if missing:
+            self.fetch_missing(int_ids=missing)
+
+            with self._lock:
+                doc_ids = [self._extra_int_id_to_id.get(int(int_id)) if doc_id is None else doc_id
+                           for int_id, doc_id in zip(int_ids, doc_ids)]
+
+        return doc_ids
+
+    def get_int_ids(self, doc_ids):
+        '''Returns the `int_id` of the documents with the given `doc_ids`, None
+        for the documents that don't exist.
+        '''
+        self.check()
+
+        doc_ids = list(doc_ids)
+        positions = self.find_doc_ids(doc_ids)
+        map_int_ids = self.arrays["int_ids"]
+
+        int_ids = [int(map_int_ids[position]) if position >= 0 else None
+                   for position in positions]
+
+        missing = [doc_id for doc_id, int_id in zip(
+            doc_ids, int_ids) if int_id is None]
+
+        if missing:
+            self.fetch_missing(doc_ids=missing)
+
+            with self._lock:
+                int_ids = [self._extra_id_to_int_id.get(doc_id) if int_id is None else int_id
+                           for doc_id, int_id in zip(doc_ids, int_ids)]
+
+        return int_ids
+
+    def get_doc_id(self, int_id):
+        return self.get_doc_ids([int_id])[0]
+
+    def get_int_id(self, doc_id):
+        return self.get_int_ids([doc_id])[0]
+
+    def fetch_missing(self, doc_ids=None, int_ids=None):
+        '''Looks up in the database the documents that are not in the map,
+        e.g., documents loaded after the last refresh of the map.
+        '''
+        with self._lock:
+            if doc_ids is not None:
+                doc_ids = [doc_id for doc_id in doc_ids
+                           if doc_id not in self._extra_id_to_int_id]
+            if int_ids is not None:
+                int_ids = [int_id for int_id in int_ids
+                           if int_id not in self._extra_int_id_to_id]
+
+        if doc_ids:
+            query = {"id": {"$in": doc_ids}}
+        elif int_ids:
+            query = {"int_id": {"$in": int_ids}}
+        else:
+            return
+
+        for doc in self.get_collection().find(query, projection=["id", "int_id"]):
+            with self._lock:
+                self._extra_id_to_int_id[doc["id"]] = doc["int_id"]
+                self._extra_int_id_to_id[doc["int_id"]] = doc["id"]
+
+    def iter_collection_pairs(self, query=None, batch_size=10000):
+        int_ids = []
+        doc_ids = []
+
+        for doc in self.get_collection().find(query or {}, projection={"_id": 0, "id": 1, "int_id": 1}, batch_size=batch_size):
+            if doc.get("int_id") is None:
+                continue
+
+            int_ids.append(doc["int_id"])
+            doc_ids.append(doc["id"])
+
+            if len(int_ids) == batch_size:
+                yield int_ids, doc_ids
+                int_ids = []
+                doc_ids = []
+
+        if int_ids:
+            yield int_ids, doc_ids
+
+    def get_latest_update(self):
+        '''Returns the latest `updated_at` stamp of the documents, None if the
+        documents are not stamped. The field is indexed by the loader of the
+        documents (see `mongodb.create_es_nlp_doc_metadata_indexes`).
+        '''
+        latest = self.get_collection().find_one(
+            {"updated_at": {"$exists": True}}, projection={"_id": 0, "updated_at": 1},
+            sort=[("updated_at", pymongo.DESCENDING)])
+
+        return latest["updated_at"] if latest else None
+
+    @reconnect_on_failure("mongodb")
+    def refresh(self, full=False):
+        '''Adds the documents written since the last refresh that are not in
+        the map yet and writes a new generation of the map. Returns the
+        number of documents added.
+        '''
+        with file_lock(self.lock_file):
+            current = self.read_current()
+            arrays = None
+            query = None
+
+            # Read before the scan so that the documents written during the
+            # scan are read again by the next refresh.
+            latest_update = self.get_latest_update()
+
+            if current is not None and not full:
+                gen_dir = self.root_dir / current["generation"]
+                arrays = {name: np.load(gen_dir / f"{name}.npy", mmap_mode="r")
+                          for name in ARRAY_NAMES}
+
+                watermark = read_watermark(current)
+                if watermark is not None:
+                    query = {"updated_at": {
+                        "$gte": watermark - WATERMARK_OVERLAP}}
+
+            new_int_ids = []
+            new_doc_ids = []
+
+            for int_ids, doc_ids in self.iter_collection_pairs(query=query):
+                int_ids = np.asarray(int_ids, dtype=np.int64)
+
+                if arrays is not None and len(arrays["int_ids"]):
+                    positions = np.minimum(np.searchsorted(
+                        arrays["int_ids"], int_ids), len(arrays["int_ids"]) - 1)
+                    is_new = arrays["int_ids"][positions] != int_ids
+                else:
+                    is_new = np.ones(len(int_ids), dtype=bool)
+
+                new_int_ids.extend(int_ids[is_new].tolist())
+                new_doc_ids.extend(doc_ids[ix] for ix in np.flatnonzero(is_new))
+
+            if arrays is None:
+                self.write_generation(build_arrays(
+                    new_int_ids, new_doc_ids), watermark=latest_update)
+            elif new_int_ids:
+                self.write_generation(merge_arrays(
+                    arrays, new_int_ids, new_doc_ids), watermark=latest_update or read_watermark(current))
+            elif latest_update is not None and latest_update != read_watermark(current):
+                # Only move the watermark, the arrays did not change.
+                self.write_current(
+                    current["generation"], current["size"], latest_update)
+
+        return len(new_int_ids)
+
+    def write_generation(self, arrays, watermark=None):
+        '''Writes `arrays` in a new generation directory and makes it current.
+        `watermark` is the latest `updated_at` stamp read by the refresh.
+        Must be called while holding the lock of the map.
+        '''
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+
+        generation = f"gen-{time.time_ns()}"
+        tmp_dir = self.root_dir / f"{generation}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir()
+
+        for name in ARRAY_NAMES:
+            np.save(tmp_dir / f"{name}.npy", arrays[name])
+
+        os.replace(tmp_dir, self.root_dir / generation)
+
+        self.write_current(generation, len(arrays["int_ids"]), watermark)
+
+        # Open memory maps of the removed generations stay valid.
+        generations = sorted(self.root_dir.glob("gen-*[0-9]"))
+        for gen_dir in generations[:-KEEP_GENERATIONS]:
+            shutil.rmtree(gen_dir, ignore_errors=True)
+
+    def write_current(self, generation, size, watermark=None):
+        tmp_current = self.current_file.with_suffix(".tmp")
+        tmp_current.write_text(json.dumps(
+            dict(generation=generation, size=size,
+                 watermark=watermark.isoformat() if watermark else None)))
+        os.replace(tmp_current, self.current_file)
+
+    def get_stats(self):
+        self.check()
+
+        with self._lock:
+            return dict(
+                generation=self.generation,
+                size=len(self.arrays["int_ids"]),
+                nbytes=sum(a.nbytes for a in self.arrays.values()),
+                extra=len(self._extra_int_id_to_id),
+            )
+
+
+def get_doc_id_map():
+    global DOC_ID_MAP
+
+    if DOC_ID_MAP is None:
+        DOC_ID_MAP = DocIdMap()
+
+    return DOC_ID_MAP
+
+
+def refresh_doc_id_map(full=False):
+    added = get_doc_id_map().refresh(full=full)
+    print(f"Added {added} documents to the doc id map...")
+
+    return added
@@ -0,0 +1,127 @@
+'''This module implements the retrieval of the metadata of the documents
+returned by the search endpoints.
+
+The metadata is retrieved from the documents index in Elasticsearch with a
+single `mget` request, without the body of the documents. The metadata of
+the recently returned documents is kept in a bounded LRU since the same
+documents tend to appear in the results of many queries.
+
+Configuration:
+    - WB_NLP_DOC_METADATA_CACHE_SIZE: maximum number of documents in the cache.
+    - WB_NLP_DOC_METADATA_CACHE_TTL: time to live of the cached metadata in seconds.
+'''
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from wb_nlp.interfaces import elasticsearch
+
+
+DOC_METADATA_CACHE_SIZE = int(
+    os.environ.get("WB_NLP_DOC_METADATA_CACHE_SIZE", 20000))
+DOC_METADATA_CACHE_TTL = float(
+    os.environ.get("WB_NLP_DOC_METADATA_CACHE_TTL", 3600))
+
+DOC_METADATA_HYDRATOR = None
+
+
+class DocMetadataHydrator:
+    '''Retrieves the metadata of documents by id.
+    '''
+
+    def __init__(self, index=None, source_excludes=None, maxsize=DOC_METADATA_CACHE_SIZE, ttl=DOC_METADATA_CACHE_TTL):
+        self.index = index
+        self.source_excludes = source_excludes or ["body"]
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = dict(hits=0, misses=0, requests=0)
+
+    def _get_cached(self, doc_ids):
+        now = time.time()
+        cached = {}
+
+        with self._lock:
+            for doc_id in doc_ids:
+                entry = self._entries.get(doc_id)
+
+                if entry is None:
+                    continue
+
+                if entry[0] < now:
+                    del self._entries[doc_id]
+                    continue
+
+                self._entries.move_to_end(doc_id)
+                cached[doc_id] = entry[1]
+
+        return cached
+
+    def _set_cached(self, metadata):
+        expires_at = time.time() + self.ttl
+
+        with self._lock:
+            for doc_id, meta in metadata.items():
+                self._entries[doc_id] = (expires_at, meta)
+                self._entries.move_to_end(doc_id)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get(self, doc_ids):
+        '''Returns a dictionary mapping the ids found to their metadata.
+        '''
+        doc_ids = list(dict.fromkeys(doc_ids))
+        metadata = self._get_cached(doc_ids)
+        missing = [doc_id for doc_id in doc_ids if doc_id not in metadata]
+
+        if missing:
+            fetched = {meta["id"]: meta for meta in elasticsearch.mget_metadata_by_ids(
+                missing, index=self.index, source_excludes=self.source_excludes)}
+
+            self._set_cached(fetched)
+            metadata.update(fetched)
+
+        with self._lock:
+            self.stats["requests"] += 1 if missing else 0
+            self.stats["hits"] += len(doc_ids) - len(missing)
+            self.stats["misses"] += len(missing)
+
+        # Return copies so that the callers can't alter the cached values.
+        return {doc_id: dict(meta) for doc_id, meta in metadata.items()}
+
+    def hydrate(self, doc_ids):
+        '''Returns the metadata of the documents in the order of `doc_ids`.
+        Documents that are not found are skipped.
+        '''
+        metadata = self.get(doc_ids)
+
+        return [metadata[doc_id] for doc_id in doc_ids if doc_id in metadata]
+
+    def invalidate(self, doc_ids=None):
+        with self._lock:
+            if doc_ids is None:
+                self._entries.clear()
+            else:
+                for doc_id in doc_ids:
+                    self._entries.pop(doc_id, None)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, size=len(self._entries), maxsize=self.maxsize)
+
+
+def get_doc_metadata_hydrator():
+    global DOC_METADATA_HYDRATOR
+
+    if DOC_METADATA_HYDRATOR is None:
+        DOC_METADATA_HYDRATOR = DocMetadataHydrator()
+
+    return DOC_METADATA_HYDRATOR
+
+
+def hydrate_doc_metadata(doc_ids):
+    return get_doc_metadata_hydrator().hydrate(doc_ids)
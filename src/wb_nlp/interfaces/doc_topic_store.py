@@ -0,0 +1,238 @@
+'''This module implements a local store of the document-topic matrix of
+the topic models.
+
+The matrix of a model run is stored as a memory-mapped float32 array with
+an aligned array of document ids under `models/doc_topics/<model_run_info_id>`.
+The workers building the document vectors write shards that are consolidated
+into the matrix at the end of the build. Summary statistics of the topics are
+computed during the consolidation so that the API does not have to aggregate
+them from Elasticsearch.
+'''
+import os
+import json
+import uuid
+import fcntl
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from elasticsearch.helpers import scan
+
+from wb_nlp import dir_manager
+from wb_nlp.interfaces import elasticsearch
+
+
+DOC_TOPIC_STORE_DIR = os.environ.get(
+    "WB_NLP_DOC_TOPIC_STORE_DIR",
+    dir_manager.get_path_from_root("models", "doc_topics"))
+
+TOPIC_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99]
+
+
+class DocTopicStore:
+    '''Store of the document-topic matrix of a model run.
+    '''
+
+    def __init__(self, model_run_info_id, root_dir=DOC_TOPIC_STORE_DIR):
+        self.model_run_info_id = model_run_info_id
+        self.store_dir = Path(root_dir) / model_run_info_id
+        self.shards_dir = self.store_dir / "shards"
+        self._loaded = None
+
+    @property
+    def meta_path(self):
+        return self.store_dir / "meta.json"
+
+    def exists(self):
+        return self.meta_path.exists()
+
+    def read_meta(self):
+        with open(self.meta_path) as open_file:
+            return json.load(open_file)
+
+    @contextmanager
+    def _write_lock(self):
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+
+        with open(self.store_dir / ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save_array(self, path, array):
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as open_file:
+            np.save(open_file, array)
+        os.replace(tmp_path, path)
+
+    def write_shard(self, doc_ids, vectors):
+        '''Writes the topics of a group of documents. The shard is merged into
+        the matrix by `consolidate`.
+        '''
+        self.shards_dir.mkdir(parents=True, exist_ok=True)
+        shard_id = uuid.uuid4().hex
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        doc_ids = np.array(doc_ids, dtype=str)
+        assert len(doc_ids) == len(vectors)
+
+        # Write the ids last since these mark the shard as complete.
+        self._save_array(self.shards_dir / f"{shard_id}-topics.npy", vectors)
+        self._save_array(self.shards_dir / f"{shard_id}-ids.npy", doc_ids)
+
+    def consolidate(self):
+        '''Merges the shards into the matrix and updates the topic statistics.
+        The topics of a document in a later shard replace the existing ones.
+        '''
+        with self._write_lock():
+            shard_ids_paths = sorted(
+                self.shards_dir.glob("*-ids.npy"), key=lambda p: p.stat().st_mtime) if self.shards_dir.exists() else []
+
+            if not shard_ids_paths:
+                return False
+
+            ids_list = []
+            topics_list = []
+            version = 0
+
+            if self.exists():
+                meta = self.read_meta()
+                version = meta["version"]
+                ids_list.append(np.load(self.store_dir / f"ids-{version}.npy"))
+                topics_list.append(
+                    np.load(self.store_dir / f"topics-{version}.npy"))
+
+            for ids_path in shard_ids_paths:
+                ids_list.append(np.load(ids_path))
+                topics_list.append(np.load(
+                    ids_path.parent / ids_path.name.replace("-ids.npy", "-topics.npy")))
+
+            ids = np.concatenate(ids_list)
+            topics = np.vstack(topics_list)
+
+            # Keep the last occurrence of each id.
+            _, last_pos = np.unique(ids[::-1], return_index=True)
+            keep = np.sort(len(ids) - 1 - last_pos)
+            ids, topics = ids[keep], topics[keep]
+
+            self._write(ids, topics, version + 1)
+
+            for ids_path in shard_ids_paths:
+                ids_path.parent.joinpath(ids_path.name.replace(
+                    "-ids.npy", "-topics.npy")).unlink()
+                ids_path.unlink()
+
+        return True
+
+    def _write(self, ids, topics, version):
+        self._save_array(self.store_dir / f"ids-{version}.npy", ids)
+        self._save_array(self.store_dir / f"topics-{version}.npy", topics)
+
+        meta = dict(
+            version=version,
+            count=int(len(ids)),
+            num_topics=int(topics.shape[1]),
+            stats=compute_topic_stats(topics),
+            quantiles=compute_topic_quantiles(topics),
+        )
+
+        tmp_path = self.meta_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as open_file:
+            json.dump(meta, open_file)
+        os.replace(tmp_path, self.meta_path)
+
+        # Open memory maps of older versions stay valid after unlinking.
+        for path in self.store_dir.glob("*.npy"):
+            if not path.stem.endswith(f"-{version}"):
+                path.unlink()
+
+    def load(self):
+        '''Returns the memory-mapped (ids, topics) arrays of the store.
+        '''
+        meta = self.read_meta()
+
+        if self._loaded is None or self._loaded[0] != meta["version"]:
+            version = meta["version"]
+            self._loaded = (
+                version,
+                np.load(self.store_dir / f"ids-{version}.npy", mmap_mode="r"),
+                np.load(self.store_dir / f"topics-{version}.npy", mmap_mode="r"))
+
+        return self._loaded[1], self._loaded[2]
+
+    def get_topic_stats(self):
+        '''Returns the statistics of the topics in the same format as the
+        Elasticsearch stats aggregation: {"topic_<i>": {count, min, max, avg, sum}}.
+        '''
+        return self.read_meta()["stats"]
+
+    def get_topic_quantiles(self):
+        '''Returns the quantiles of the topics: {"topic_<i>": {"<q>": value}}.
+        '''
+        return self.read_meta()["quantiles"]
+
+
+def compute_topic_stats(topics):
+    count = len(topics)
+
+    if count == 0:
+        return {f"topic_{i}": dict(count=0, min=None, max=None, avg=None, sum=0.0) for i in range(topics.shape[1])}
+
+    topics_sum = topics.sum(axis=0, dtype=np.float64)
+    topics_min = topics.min(axis=0)
+    topics_max = topics.max(axis=0)
+
+    return {
+        f"topic_{i}": dict(
+            count=count,
+            min=float(topics_min[i]),
+            max=float(topics_max[i]),
+            avg=float(topics_sum[i] / count),
+            sum=float(topics_sum[i]))
+        for i in range(topics.shape[1])}
+
+
+def compute_topic_quantiles(topics, quantiles=None):
+    quantiles = quantiles or TOPIC_QUANTILES
+
+    if len(topics) == 0:
+        return {f"topic_{i}": {} for i in range(topics.shape[1])}
+
+    values = np.quantile(topics, quantiles, axis=0)
+
+    return {
+        f"topic_{i}": {str(q): float(values[qix, i]) for qix, q in enumerate(quantiles)}
+        for i in range(topics.shape[1])}
+
+
+def build_doc_topic_store_from_es(model_run_info_id, num_topics):
+    '''Materializes the store of an existing model run from the topics
+    indexed in Elasticsearch.
+    '''
+    store = DocTopicStore(model_run_info_id)
+
+    doc_ids = []
+    vectors = []
+
+    for obj in scan(
+            elasticsearch.get_client(),
+            query=dict(
+                query=dict(term=dict(model_run_info_id=model_run_info_id)),
+                _source=["id", "topics"]),
+            size=5000,
+            index=elasticsearch.DOC_TOPIC_INDEX):
+        topics = obj["_source"]["topics"]
+
+        doc_ids.append(obj["_source"]["id"])
+        vectors.append([topics.get(f"topic_{i}", 0)
+                        for i in range(num_topics)])
+
+    if not doc_ids:
+        return store
+
+    store.write_shard(doc_ids, np.array(vectors).reshape(-1, num_topics))
+    store.consolidate()
+
+    return store
@@ -1,13 +1,16 @@
 from datetime import datetime
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import os
 import re
 from pathlib import Path
+from pymongo import UpdateOne
 import elasticsearch_dsl
 import pandas as pd
 
 # from elasticsearch import helpers
 from elasticsearch import Elasticsearch, exceptions
-from elasticsearch.helpers import scan
-from elasticsearch.exceptions import ConnectionTimeout
+from elasticsearch.helpers import scan, streaming_bulk, parallel_bulk
 
 from elasticsearch_dsl import Document, Date, Integer, Keyword, Text, Object, Nested, A, Boolean
 from elasticsearch_dsl.connections import connections
@@ -21,21 +24,111 @@ from wb_cleaning.types.metadata_enums import MajorDocTypes
 from wb_nlp.dir_manager import get_path_from_root
 from wb_nlp.interfaces import mongodb
 
-connections.create_connection(hosts=['es01'])
+from wb_nlp.interfaces.connections import get_connection_manager, reconnect_on_failure
+
+ES_HOST = "es01"
+ES_PORT = 9200
+ES_POOL_SIZE = int(os.environ.get("WB_NLP_ES_POOL_SIZE", 25))
+
+connections.create_connection(hosts=[ES_HOST])
 
 
-_ES_CLIENT = None
 DOC_INDEX = "nlp-documents"
 DOC_TOPIC_INDEX = "nlp-doc-topics"
 
 
+def _create_client():
+    client = Elasticsearch(
+        hosts=[{"host": ES_HOST, "port": ES_PORT}], timeout=30, max_retries=5, retry_on_timeout=True, maxsize=ES_POOL_SIZE)
+
+    # The documents use the default connection, share the pool with them.
+    connections.add_connection("default", client)
+
+    return client
+
+
+def _ping(client):
+    if not client.ping():
+        raise ConnectionError(f"Elasticsearch at {ES_HOST}:{ES_PORT} is not responding.")
+
+
+def _reset_default_connection():
+    # The default connection may belong to the parent process.
+    connections.create_connection(hosts=[ES_HOST])
+
+
 def get_client():
-    global _ES_CLIENT
-    if _ES_CLIENT is None:
-        _ES_CLIENT = Elasticsearch(
-            hosts=[{"host": "es01", "port": 9200}], timeout=30, max_retries=5, retry_on_timeout=True)
+    manager = get_connection_manager()
+
+    manager.register(
+        "elasticsearch",
+        factory=_create_client,
+        health_check=_ping,
+        close=lambda client: client.transport.close(),
+        get_pool_stats=lambda client: dict(
+            maxsize=ES_POOL_SIZE, nodes=len(client.transport.connection_pool.connections)),
+        on_reset=_reset_default_connection,
+        failure_errors=(exceptions.ConnectionError, ConnectionError))
+
+    return manager.get("elasticsearch")
+
+
+def derive_nlp_doc_fields(body):
+    '''Extracts the derived fields of an NLPDoc from its `body`.
+    This is a standalone function so that the extraction can be run in worker processes.
+    '''
+    fields = {}
+
+    # Set all application tags to False first
+    # Then just use the tag updated script to set the True values
+    fields["app_tag_jdc"] = False
+
+    fields["tokens"] = len(body.split())
+    fields["views"] = 0
+
+    # Extract JDC specific tags
+    fields["der_jdc_data"] = jdc_tags_extractor.get_jdc_tag_counts(body)
+    fields["der_jdc_tags"] = [i["tag"] for i in fields["der_jdc_data"]]
+
+    # Extract country mentions data
+    country_counts = country_extractor.get_country_counts(body)
+    fields["der_countries"] = country_counts
+    fields["der_country_counts"] = country_counts
+
+    country_groups = set()
+    country_names = []
+
+    if country_counts:
+        sorted_country_codes = sorted(
+            country_counts, key=lambda x: country_counts[x], reverse=True)
+        for code in sorted_country_codes:
+            g = country_extractor.country_code_country_group_map.get(code)
+            if g:
+                country_groups.update(g)
 
-    return _ES_CLIENT
+            n = country_extractor.get_country_name_from_code(code)
+            if n:
+                if n not in country_names:
+                    country_names.append(n)
+
+        top_code = sorted_country_codes[0]
+        fields["der_top_country"] = country_extractor.get_country_name_from_code(
+            top_code)
+        fields["der_top_region"] = country_extractor.get_region_from_country_code(
+            top_code)
+
+    fields["der_country"] = country_names  # Don't sort!
+    fields["der_country_groups"] = sorted(country_groups)
+
+    fields["der_country_details"] = country_extractor.get_country_count_details(
+        country_counts)
+
+    fields["der_regions"] = country_extractor.get_country_counts_regions(
+        country_counts)
+
+    fields["der_acronyms"] = acronyms.extract_acronyms_array(body)
+
+    return fields
 
 
 class NLPDoc(Document):
@@ -85,64 +178,24 @@ class NLPDoc(Document):
         }
 
     def save(self, **kwargs):
-        # Set all application tags to False first
-        # Then just use the tag updated script to set the True values
-        self.app_tag_jdc = False
-
-        self.tokens = len(self.body.split())
-        self.views = 0
+        for field, value in derive_nlp_doc_fields(self.body).items():
+            setattr(self, field, value)
 
-        # Extract JDC specific tags
-        self.der_jdc_data = jdc_tags_extractor.get_jdc_tag_counts(self.body)
-        self.der_jdc_tags = [i["tag"] for i in self.der_jdc_data]
-
-        # Extract country mentions data
-        country_counts = country_extractor.get_country_counts(self.body)
-        self.der_countries = country_counts
-        self.der_country_counts = country_counts
-
-        country_groups = set()
-        country_names = []
-
-        if self.der_country_counts:
-            sorted_country_codes = sorted(
-                self.der_country_counts, key=lambda x: self.der_country_counts[x], reverse=True)
-            for code in sorted_country_codes:
-                g = country_extractor.country_code_country_group_map.get(code)
-                if g:
-                    country_groups.update(g)
-
-                n = country_extractor.get_country_name_from_code(code)
-                if n:
-                    if n not in country_names:
-                        country_names.append(n)
-
-            top_code = sorted_country_codes[0]
-            self.der_top_country = country_extractor.get_country_name_from_code(
-                top_code)
-            self.der_top_region = country_extractor.get_region_from_country_code(
-                top_code)
-
-        self.der_country = country_names  # Don't sort!
-        self.der_country_groups = sorted(country_groups)
-
-        self.der_country_details = country_extractor.get_country_count_details(
-            country_counts)
-
-        self.der_regions = country_extractor.get_country_counts_regions(
-            country_counts)
+        doc_meta = self.get_doc_meta()
+        # `updated_at` is the watermark of the refresh of the doc id map.
+        mongodb.get_es_nlp_doc_metadata_collection().update_one({"_id": doc_meta["_id"]}, {
+            "$set": doc_meta, "$currentDate": {"updated_at": True}}, upsert=True)
 
-        self.der_acronyms = acronyms.extract_acronyms_array(self.body)
+        return super(NLPDoc, self).save(**kwargs)
 
+    def get_doc_meta(self):
+        # Metadata stored in mongodb, i.e., all fields except the body.
         doc_meta = self.to_dict()
         if "body" in doc_meta:
             del doc_meta["body"]
         doc_meta["_id"] = doc_meta["id"]
 
-        mongodb.get_es_nlp_doc_metadata_collection().update_one({"_id": doc_meta["_id"]}, {
-            "$set": doc_meta}, upsert=True)
-
-        return super(NLPDoc, self).save(**kwargs)
+        return doc_meta
 
     def structure_stats_by_year_data(self, data, round_size=None):
         year_buckets = data["year"]["buckets"]
@@ -407,7 +460,9 @@ class JDCNLPDocFacetedSearch(FacetedSearch):
         return search
 
 
+@reconnect_on_failure("elasticsearch")
 def get_indexed_corpus_size(filters=None):
+    get_client()
 
     # search = NLPDoc.search()
     search = NLPDocFacetedSearch().search()
@@ -420,33 +475,117 @@ def get_indexed_corpus_size(filters=None):
     return search.count()
 
 
-def store_docs_topics(doc_ids, vectors, model_run_info_id, metadata=None, ignore_existing=True):
+@contextmanager
+def disabled_refresh(index, refresh_interval="30s"):
+    '''Disables the periodic refresh of the `index` while bulk loading data.
+    The `refresh_interval` is restored and the index refreshed on exit.
+    '''
+    client = get_client()
+    client.indices.put_settings(
+        index=index, body={"index": {"refresh_interval": "-1"}})
+
+    try:
+        yield
+    finally:
+        client.indices.put_settings(
+            index=index, body={"index": {"refresh_interval": refresh_interval}})
+        client.indices.refresh(index=index)
+
+
+@reconnect_on_failure("elasticsearch")
+def get_existing_ids(ids, index=None, chunk_size=5000):
+    '''Returns the subset of `ids` that are present in the `index`.
+    This only checks the given ids instead of scanning the whole index.
+    '''
+    if index is None:
+        index = NLPDoc.Index.name
+
+    ids = list(ids)
+    existing_ids = set()
+
+    for start in range(0, len(ids), chunk_size):
+        response = get_client().mget(
+            index=index, body={"ids": ids[start: start + chunk_size]}, _source=False)
+
+        existing_ids.update(doc["_id"]
+                            for doc in response["docs"] if doc.get("found"))
+
+    return existing_ids
+
+
+def bulk_index(actions, chunk_size=500, max_retries=3, thread_count=None, raise_on_error=True):
+    '''Indexes the `actions` using the bulk api.
+
+    If `thread_count` is set, the `parallel_bulk` helper is used. Otherwise,
+    the actions are sent with `streaming_bulk` which retries the documents
+    rejected with a 429 status up to `max_retries` times.
+
+    Returns the number of successful and failed actions.
+    '''
+    client = get_client()
+
+    if thread_count:
+        results = parallel_bulk(
+            client, actions, thread_count=thread_count, chunk_size=chunk_size,
+            raise_on_error=raise_on_error)
+    else:
+        results = streaming_bulk(
+            client, actions, chunk_size=chunk_size, max_retries=max_retries,
+            initial_backoff=2, raise_on_error=raise_on_error)
+
+    success = 0
+    failed = 0
+    for ok, item in results:
+        if ok:
+            success += 1
+        else:
+            failed += 1
+            print(f"Failed to index: {item}")
+
+    return success, failed
+
+
+def store_docs_topics(doc_ids, vectors, model_run_info_id, metadata=None, ignore_existing=True, chunk_size=500, max_retries=3, thread_count=None, disable_refresh=False):
     '''
     metadata: dict {id: {field: value, ...}}
+
+    The topics are indexed in bulk. Set `disable_refresh` when loading a large
+    number of documents in one call. When the loading is split in several calls,
+    wrap the calls in the `disabled_refresh` context instead.
     '''
+    doc_ids = list(doc_ids)
+    metadata = metadata or {}
     existing_ids = set()
 
     if ignore_existing:
-        existing_ids = get_ids(index=DocTopic.Index.name)
-
-    for ix, (doc_id, topic_list) in enumerate(zip(doc_ids, vectors)):
-        if ix and ix % 10000 == 0:
-            print(ix)
+        existing_ids = get_existing_ids(
+            [f"{model_run_info_id}-{doc_id}" for doc_id in doc_ids],
+            index=DocTopic.Index.name)
+
+    def _actions():
+        for doc_id, topic_list in zip(doc_ids, vectors):
+            es_id = f"{model_run_info_id}-{doc_id}"
+
+            if es_id in existing_ids:
+                continue
+
+            data = dict(
+                id=doc_id,
+                topics={f"topic_{topic_id}": value for topic_id,
+                        value in enumerate(topic_list)},
+                model_run_info_id=model_run_info_id,
+            )
 
-        topics = {f"topic_{topic_id}": value for topic_id,
-                  value in enumerate(topic_list)}
+            if metadata.get(doc_id) is not None:
+                data.update(metadata[doc_id])
 
-        es_id = f"{model_run_info_id}-{doc_id}"
+            yield DocTopic(meta={'id': es_id}, **data).to_dict(include_meta=True)
 
-        if es_id in existing_ids:
-            continue
+    if disable_refresh:
+        with disabled_refresh(DocTopic.Index.name, DocTopic.Index.settings["refresh_interval"]):
+            return bulk_index(_actions(), chunk_size=chunk_size, max_retries=max_retries, thread_count=thread_count)
 
-        store_doc_topics(
-            es_id=es_id,
-            doc_id=doc_id,
-            topics=topics,
-            model_run_info_id=model_run_info_id,
-            metadata=metadata.get(doc_id))
+    return bulk_index(_actions(), chunk_size=chunk_size, max_retries=max_retries, thread_count=thread_count)
 
 
 def store_doc_topics(es_id, doc_id, topics, model_run_info_id, metadata=None):
@@ -506,7 +645,7 @@ def get_ids_from_query(doc_index, query=None, ids_only=True):
 
 def get_metadata_by_ids(doc_ids, index=None, source=None, source_includes=None, source_excludes=None):
     '''
-    This method returns the metadata corresponding to the list of ids in `doc_ids`.
+    This method returns the metadata corresponding to the list of ids in `doc_ids` retrieved with a single `mget` request.
     The source input parametrize the return value for the _source field.
         source = False                          : Don't return any
         source = []                             : Return all values in the _source
@@ -538,16 +677,85 @@ def get_metadata_by_ids(doc_ids, index=None, source=None, source_includes=None,
             source["includes"] = sorted(
                 set(source_includes + source.get("includes", [])))
 
-    return [obj["_source"] for obj in scan(
-        get_client(),
-        query=dict(
-            query=dict(terms={"_id": doc_ids}),
-            _source=source),
-        size=len(doc_ids),
-        index=index)]
+    if source is False:
+        return mget_metadata_by_ids(doc_ids, index=index, source=False)
+
+    return mget_metadata_by_ids(
+        doc_ids, index=index,
+        source_includes=source.get("includes"),
+        source_excludes=source.get("excludes"))
+
+
+@reconnect_on_failure("elasticsearch")
+def mget_metadata_by_ids(doc_ids, index=None, source=None, source_includes=None, source_excludes=None):
+    '''
+    This method returns the metadata corresponding to the list of ids in `doc_ids` using a single `mget` request.
+    The order of `doc_ids` is preserved and ids that are not found are skipped.
+    '''
+    if index is None:
+        index = NLPDoc.Index.name
+
+    if not doc_ids:
+        return []
+
+    response = get_client().mget(
+        body=dict(ids=list(doc_ids)), index=index, _source=source,
+        _source_includes=source_includes, _source_excludes=source_excludes)
 
+    return [obj.get("_source", {}) for obj in response["docs"] if obj.get("found")]
+
+
+def prepare_nlp_doc_data(data, doc_path, remove_doc_whitespaces=True):
+    '''Reads the document and computes the derived fields of the NLPDoc.
+    This is run in the worker processes of `make_nlp_docs_from_docs_metadata`.
+    '''
+    # Process major document type here so that we don't need to run a
+    # separate processing later.
+    major_doc_types = data.get("major_doc_type")
+    if major_doc_types:
+        data["major_doc_type"] = [MajorDocTypes(
+            mdt).value for mdt in major_doc_types]
 
-def make_nlp_docs_from_docs_metadata(docs_metadata, ignore_existing=True, en_txt_only=True, remove_doc_whitespaces=True, log_freq_rate=25):
+    with open(doc_path, 'rb') as open_file:
+        doc = open_file.read().decode('utf-8', errors='ignore')
+        if remove_doc_whitespaces:
+            doc = re.sub(r"\s+", " ", doc)
+
+    data["body"] = doc
+    data.update(derive_nlp_doc_fields(doc))
+
+    return data
+
+
+def _iter_prepared_nlp_docs(tasks, n_workers, max_pending):
+    # Keep at most `max_pending` documents in flight so that the workers don't
+    # run ahead of the bulk indexing and fill up the memory.
+    tasks = iter(tasks)
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        pending = set()
+
+        for task in tasks:
+            pending.add(executor.submit(prepare_nlp_doc_data, *task))
+
+            if len(pending) < max_pending:
+                continue
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+        for future in pending:
+            yield future.result()
+
+
+def make_nlp_docs_from_docs_metadata(docs_metadata, ignore_existing=True, en_txt_only=True, remove_doc_whitespaces=True, log_freq_rate=25, n_workers=None, chunk_size=200, mongo_batch_size=500, max_pending=None, disable_refresh=True):
+    '''Indexes the documents in `docs_metadata` as NLPDoc.
+
+    The derived fields are extracted in a pool of `n_workers` processes. The
+    metadata are upserted in mongodb in batches of `mongo_batch_size` and the
+    documents are bulk indexed in chunks of `chunk_size`.
+    '''
     # from elasticsearch_dsl import Index
     # i = Index(name=elasticsearch.DOC_INDEX, using=elasticsearch.get_client())
     # i.delete()
@@ -558,65 +766,78 @@ def make_nlp_docs_from_docs_metadata(docs_metadata, ignore_existing=True, en_txt
     # elasticsearch.make_nlp_docs_from_docs_metadata(docs_metadata, ignore_existing=True, en_txt_only=True, remove_doc_whitespaces=True)
     # elasticsearch.make_nlp_docs_from_docs_metadata(docs_metadata, ignore_existing=False, en_txt_only=True, remove_doc_whitespaces=True)
 
-    # test_docs_metadata = mongodb.get_collection(
-    #     db_name="test_nlp", collection_name="docs_metadata")
+    if n_workers is None:
+        n_workers = max(1, os.cpu_count() - 1)
+
+    if max_pending is None:
+        max_pending = 4 * max(n_workers, chunk_size)
+
     docs_count = len(docs_metadata)
-    log_freq = docs_count // log_freq_rate
+    log_freq = max(1, docs_count // log_freq_rate)
 
     existing_ids = set()
 
     if ignore_existing:
-        existing_ids = get_ids(index=NLPDoc.Index.name)
-
-        # for obj in scan(get_client(), query=dict(
-        #         query=dict(match_all={}),
-        #         fields=["_id"]),
-        #         size=5000,
-        #         index=NLPDoc.Index.name):
-        #     existing_ids.add(obj["_id"])
+        existing_ids = get_existing_ids(
+            [data["_id"] for data in docs_metadata], index=NLPDoc.Index.name)
 
     root_path = Path(get_path_from_root())
 
-    for ix, data in enumerate(docs_metadata):
-        doc_path = root_path / data["path_original"]
-        # doc_path = doc_path.parent / "TXT_ORIG" / doc_path.name
-        en_doc_path = doc_path.parent.parent / "EN_TXT_ORIG" / doc_path.name
+    def _tasks():
+        for data in docs_metadata:
+            doc_path = root_path / data["path_original"]
+            # doc_path = doc_path.parent / "TXT_ORIG" / doc_path.name
+            en_doc_path = doc_path.parent.parent / "EN_TXT_ORIG" / doc_path.name
+
+            if en_txt_only and not en_doc_path.exists():
+                continue
 
-        if ix and ix % log_freq == 0:
-            print(f"Processed {ix} of {docs_count} docs...")
+            if data["_id"] in existing_ids:
+                continue
 
-        if en_txt_only and not en_doc_path.exists():
-            continue
+            if not doc_path.exists():
+                continue
 
-        if data["_id"] in existing_ids:
-            continue
+            yield data, doc_path, remove_doc_whitespaces
 
-        if not doc_path.exists():
-            continue
+    mongodb.create_es_nlp_doc_metadata_indexes()
+    es_nlp_doc_metadata_collection = mongodb.get_es_nlp_doc_metadata_collection()
+    mongo_ops = []
 
-        # Process major document type here so that we don't need to run a
-        # separate processing later.
-        major_doc_types = data.get("major_doc_type")
-        if major_doc_types:
-            data["major_doc_type"] = [MajorDocTypes(
-                mdt).value for mdt in major_doc_types]
+    def _flush_mongo_ops():
+        if mongo_ops:
+            es_nlp_doc_metadata_collection.bulk_write(
+                mongo_ops, ordered=False)
+            mongo_ops.clear()
 
-        # create and save and article
-        nlp_doc = NLPDoc(meta={'id': data["_id"]}, **data)
+    def _actions():
+        for ix, data in enumerate(_iter_prepared_nlp_docs(_tasks(), n_workers, max_pending)):
+            if ix and ix % log_freq == 0:
+                print(f"Processed {ix} of {docs_count} docs...")
 
-        with open(doc_path, 'rb') as open_file:
-            doc = open_file.read().decode('utf-8', errors='ignore')
-            if remove_doc_whitespaces:
-                doc = re.sub(r"\s+", " ", doc)
-            nlp_doc.body = doc
+            # create the article using the same fields as in `NLPDoc.save`
+            nlp_doc = NLPDoc(meta={'id': data["_id"]}, **data)
 
-        try:
-            nlp_doc.save()
-        except ConnectionTimeout:
-            try:
-                nlp_doc.save()
-            except ConnectionTimeout:
-                nlp_doc.save()
+            doc_meta = nlp_doc.get_doc_meta()
+            mongo_ops.append(UpdateOne({"_id": doc_meta["_id"]}, {
+                "$set": doc_meta, "$currentDate": {"updated_at": True}}, upsert=True))
+
+            if len(mongo_ops) >= mongo_batch_size:
+                _flush_mongo_ops()
+
+            yield nlp_doc.to_dict(include_meta=True)
+
+        _flush_mongo_ops()
+
+    if disable_refresh:
+        with disabled_refresh(NLPDoc.Index.name, NLPDoc.Index.settings["refresh_interval"]):
+            success, failed = bulk_index(_actions(), chunk_size=chunk_size)
+    else:
+        success, failed = bulk_index(_actions(), chunk_size=chunk_size)
+
+    print(f"Indexed {success} docs, {failed} failed...")
+
+    return success, failed
 
 
 def faceted_search_nlp_docs():
@@ -634,10 +855,14 @@ def faceted_search_nlp_docs():
     #     print(year.strftime('%Y'), ' (SELECTED):' if selected else ':', count)
 
 
+@reconnect_on_failure("elasticsearch")
 def common_search(query, from_result=0, size=10, return_body=False, ignore_cache=False, return_highlights=True, highlight_field="body", fragment_size=100):
     """
     query: DSL query
     """
+    # The searches use the default connection which shares the managed client.
+    get_client()
+
     search = NLPDoc.search()
     search = search.query(query)
     search = search.extra(track_total_hits=True)
@@ -686,7 +911,10 @@ def author_search(query, from_result=0, size=10, return_body=False, ignore_cache
         fragment_size=fragment_size)
 
 
+@reconnect_on_failure("elasticsearch")
 def ids_search(ids, query, from_result=0, size=10, return_body=False, ignore_cache=False, fragment_size=100):
+    get_client()
+
     # query = MultiMatch(query=query, fields=["title", "body"])
 
     search = NLPDoc.search()
@@ -0,0 +1,289 @@
+'''This module implements the lifecycle of the indexes of the collections of
+the vector store.
+
+The vectors of a collection are bulk loaded and flushed once at the end of
+the load. The index is then built, and the search parameter of the index
+(`nprobe` for the IVF indexes, `ef` for HNSW) is selected by a benchmark on
+the collection: the exact neighbours of a sample of the stored vectors are
+computed from the float32 vectors, then the sample is searched with the
+index for increasing values of the parameter. The smallest value reaching
+the target recall@k is selected. The recall and the p50/p99 latencies of
+each value are kept with the configuration of the index.
+
+The existing index is not dropped before the build, the queries keep using
+it until the new index replaces it. The index is not rebuilt if the load
+did not write any vector and the size of the collection did not change.
+
+Collections smaller than `WB_NLP_INDEX_MIN_ROWS` are not indexed since an
+exhaustive search is already fast enough.
+
+The index of a collection with quantized vectors defaults to the index of
+Milvus with the same quantization (IVF_SQ8 for `int8`, IVF_PQ for `pq`).
+The candidates of the indexes that search quantized vectors, i.e., these
+indexes or any index of the local store, are re-ranked with the float32
+vectors, and the benchmark measures the recall after the re-ranking. Milvus
+keeps the float32 vectors, so the IVF_FLAT and HNSW indexes are not
+re-ranked.
+
+Configuration:
+    - WB_NLP_INDEX_TYPE: default type of the index, `IVF_FLAT`, `IVF_SQ8`, `IVF_PQ`, or `HNSW`.
+    - WB_NLP_INDEX_MIN_ROWS: minimum number of vectors of an indexed collection.
+    - WB_NLP_INDEX_TARGET_RECALL: recall@k that the selected search parameter must reach.
+    - WB_NLP_INDEX_BENCHMARK_QUERIES: number of vectors of the collection used as queries.
+    - WB_NLP_INDEX_BENCHMARK_TOPK: the `k` of the recall@k of the benchmark.
+'''
+import os
+import json
+import time
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+
+from wb_nlp.interfaces.vector_store import get_vector_store, get_pq_m, get_rerank_factor
+from wb_nlp.interfaces.neighbor_table import compute_top_k, merge_top_k
+
+
+INDEX_TYPE = os.environ.get("WB_NLP_INDEX_TYPE", "IVF_FLAT")
+INDEX_MIN_ROWS = int(os.environ.get("WB_NLP_INDEX_MIN_ROWS", 50000))
+INDEX_TARGET_RECALL = float(
+    os.environ.get("WB_NLP_INDEX_TARGET_RECALL", 0.95))
+INDEX_BENCHMARK_QUERIES = int(
+    os.environ.get("WB_NLP_INDEX_BENCHMARK_QUERIES", 200))
+INDEX_BENCHMARK_TOPK = int(os.environ.get("WB_NLP_INDEX_BENCHMARK_TOPK", 10))
+
+# Search parameter of each index type and the values tried by the benchmark.
+SEARCH_PARAMS = {
+    "IVF_FLAT": ("nprobe", [1, 2, 4, 8, 16, 32, 64, 128, 256]),
+    "IVF_SQ8": ("nprobe", [1, 2, 4, 8, 16, 32, 64, 128, 256]),
+    "IVF_PQ": ("nprobe", [1, 2, 4, 8, 16, 32, 64, 128, 256]),
+    "HNSW": ("ef", [16, 32, 64, 128, 256, 512]),
+}
+
+
+# Index type used by default for the quantized collections.
+QUANTIZATION_INDEX_TYPES = {
+    "int8": "IVF_SQ8",
+    "pq": "IVF_PQ",
+}
+
+
+def get_default_index_params(index_type, count, dim=None, quantization=None):
+    if index_type == "HNSW":
+        return {"M": 16, "efConstruction": 200}
+
+    # Rule of thumb of the IVF indexes.
+    params = {"nlist": int(np.clip(4 * np.sqrt(count), 1, 16384))}
+
+    if index_type == "IVF_PQ":
+        params["m"] = get_pq_m(dim, (quantization or {}).get("m"))
+
+    return params
+
+
+def load_index_config(path):
+    try:
+        with open(path) as open_file:
+            return json.load(open_file)
+    except FileNotFoundError:
+        return None
+
+
+def save_index_config(path, config):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+
+    with open(tmp_path, "w") as open_file:
+        json.dump(config, open_file)
+
+    os.replace(tmp_path, path)
+
+
+class IndexManager:
+    '''Bulk loads, indexes, and benchmarks a collection of the vector store.
+    '''
+
+    def __init__(self, collection_name, index_type=None, index_params=None, vector_store=None, quantization=None,
+                 min_rows=INDEX_MIN_ROWS, target_recall=INDEX_TARGET_RECALL,
+                 n_queries=INDEX_BENCHMARK_QUERIES, topk=INDEX_BENCHMARK_TOPK):
+        self.collection_name = collection_name
+        self.vector_store = vector_store or get_vector_store()
+        self.quantization = quantization
+        self.index_type = index_type or QUANTIZATION_INDEX_TYPES.get(
+            (quantization or {}).get("type"), INDEX_TYPE)
+        self.index_params = index_params
+        self.min_rows = min_rows
+        self.target_recall = target_recall
+        self.n_queries = n_queries
+        self.topk = topk
+
+        if self.index_type not in SEARCH_PARAMS:
+            raise ValueError(
+                f"Unknown index type: `{self.index_type}`. Accepted values: {', '.join(SEARCH_PARAMS)}...")
+
+        if self.index_type not in self.vector_store.index_types:
+            logging.warning(
+                f"Index type `{self.index_type}` is not supported by the vector store. Using `IVF_FLAT`...")
+            self.index_type = "IVF_FLAT"
+            self.index_params = None
+
+    @contextmanager
+    def bulk_load(self):
+        '''Context of the inserts of a bulk load. The collection is flushed
+        once at the end, also if the load fails, so that the vectors already
+        inserted are kept. The quantization of the vectors is then trained on
+        the whole collection.
+        '''
+        try:
+            yield
+        finally:
+            self.vector_store.flush(self.collection_name)
+            self.vector_store.train_quantizer(self.collection_name)
+
+    def sample_queries(self, ids):
+        rng = np.random.default_rng(1029)
+        sample_ids = rng.choice(ids, size=min(
+            self.n_queries, len(ids)), replace=False)
+
+        vectors = [vec for vec in self.vector_store.get_vectors(
+            self.collection_name, sample_ids.tolist()) if vec is not None]
+
+        return np.vstack(vectors).astype(np.float32)
+
+    def exact_search(self, queries, ids, batch_size=1000):
+        '''Returns the ids of the exact top-k of the `queries` computed from
+        the float32 vectors of the collection read in batches.
+        '''
+        top_ids = np.full((len(queries), self.topk), -1, dtype=np.int64)
+        top_scores = np.full((len(queries), self.topk), -np.inf, dtype=np.float32)
+
+        for start in range(0, len(ids), batch_size):
+            batch_ids = ids[start: start + batch_size].tolist()
+            found = [(int_id, vec) for int_id, vec in zip(
+                batch_ids, self.vector_store.get_vectors(self.collection_name, batch_ids)) if vec is not None]
+
+            if not found:
+                continue
+
+            batch_ids, vectors = zip(*found)
+            top_ids, top_scores = merge_top_k(top_ids, top_scores, *compute_top_k(
+                queries, np.vstack(vectors).astype(np.float32), np.asarray(batch_ids, dtype=np.int64), self.topk), self.topk)
+
+        return [set(row[row >= 0].tolist()) for row in top_ids]
+
+    def measure(self, queries, truth=None, params=None):
+        '''Runs the `queries` one at a time and returns the p50/p99 latencies
+        in milliseconds, the mean recall@k against `truth`, and the results.
+        '''
+        latencies = []
+        results = []
+
+        for query in queries:
+            start = time.perf_counter()
+            hits = self.vector_store.search(
+                self.collection_name, query.reshape(1, -1), self.topk, params=params)[0]
+            latencies.append(time.perf_counter() - start)
+            results.append({hit.id for hit in hits})
+
+        stats = dict(
+            p50_ms=float(np.percentile(latencies, 50) * 1000),
+            p99_ms=float(np.percentile(latencies, 99) * 1000))
+
+        if truth is not None:
+            stats["recall"] = float(np.mean([
+                len(found & expected) / max(len(expected), 1) for found, expected in zip(results, truth)]))
+
+        return stats, results
+
+    def is_lossy(self):
+        '''Whether the index searches quantized vectors, so that its
+        candidates must be re-ranked with the float32 vectors. Milvus keeps
+        the float32 vectors, only its IVF_SQ8 and IVF_PQ indexes quantize them.
+        '''
+        if self.quantization is None:
+            return False
+
+        return self.vector_store.stores_quantized_vectors or \
+            self.index_type in self.vector_store.lossy_index_types
+
+    def is_current(self, config):
+        '''Whether the index described by `config` was built for the current
+        size of the collection with the configured index type.
+        '''
+        if not config:
+            return False
+
+        count = self.vector_store.count(self.collection_name)
+        index_type = "FLAT" if count < self.min_rows else self.index_type
+
+        # The configurations saved before the re-ranking only applied to the
+        # lossy indexes are rebuilt.
+        reranked = "rerank" in (config.get("search_params") or {})
+        if index_type != "FLAT" and reranked != self.is_lossy():
+            return False
+
+        return config.get("count") == count and config.get("index_type") == index_type
+
+    def build(self, previous=None):
+        '''Builds the index of the collection and selects its search
+        parameter. Returns the configuration of the index.
+
+        The existing index keeps serving the queries until the new one
+        replaces it. `previous` is the configuration of the existing index,
+        whose latency and recall are kept for comparison.
+        '''
+        count = self.vector_store.count(self.collection_name)
+
+        if count < self.min_rows:
+            logging.info(
+                f"Collection {self.collection_name} has {count} vectors. Skipping the index...")
+            self.vector_store.drop_index(self.collection_name)
+
+            return dict(index_type="FLAT", params={}, search_params=None, count=count,
+                        quantization=self.quantization, built_at=time.time())
+
+        ids = np.asarray(self.vector_store.list_ids(self.collection_name))
+        queries = self.sample_queries(ids)
+        truth = self.exact_search(queries, ids)
+        previous_stats, _ = self.measure(
+            queries, truth, params=(previous or {}).get("search_params"))
+        previous_stats["index_type"] = (previous or {}).get("index_type")
+
+        params = self.index_params or get_default_index_params(
+            self.index_type, count, dim=queries.shape[1], quantization=self.quantization)
+
+        # The candidates of the quantized vectors are re-ranked.
+        extra_params = {}
+        if self.is_lossy():
+            extra_params["rerank"] = get_rerank_factor(self.quantization)
+
+        print(
+            f"Building the {self.index_type} index of {self.collection_name} with {params}...")
+        self.vector_store.create_index(
+            self.collection_name, self.index_type, params=params)
+
+        param_name, candidates = SEARCH_PARAMS[self.index_type]
+        benchmark = []
+
+        for value in candidates:
+            if param_name == "nprobe" and value > params.get("nlist", value):
+                break
+
+            stats, _ = self.measure(
+                queries, truth, params=dict(extra_params, **{param_name: value}))
+            stats[param_name] = value
+            benchmark.append(stats)
+
+            print(
+                f"{param_name}={value}: recall@{self.topk}={stats['recall']:.4f}, p50={stats['p50_ms']:.2f}ms, p99={stats['p99_ms']:.2f}ms")
+
+            if stats["recall"] >= self.target_recall:
+                break
+
+        selected = next((stats for stats in benchmark if stats["recall"] >= self.target_recall),
+                        max(benchmark, key=lambda stats: stats["recall"]))
+
+        return dict(
+            index_type=self.index_type, params=params,
+            search_params=dict(extra_params, **{param_name: selected[param_name]}),
+            count=count, topk=self.topk, target_recall=self.target_recall, quantization=self.quantization,
+            previous=previous_stats, benchmark=benchmark, built_at=time.time())
@@ -1,27 +1,31 @@
 '''This module is an interface to Milvus.
 '''
-from milvus import Milvus, DataType
+import os
+import grpc
+from milvus import Milvus, DataType, ConnectError
 
-MILVUS_CLIENT = None
+from wb_nlp.interfaces.connections import get_connection_manager
+
+HOST = 'milvus'
+PORT = '19530'
+MILVUS_POOL_SIZE = int(os.environ.get("WB_NLP_MILVUS_POOL_SIZE", 32))
 
 
 def get_milvus_client():
     '''This returns a Milvus client for interfacing with the Milvus server.
     '''
-    global MILVUS_CLIENT
-
-    HOST = 'milvus'
-    PORT = '19530'
+    manager = get_connection_manager()
 
-    if MILVUS_CLIENT is None:
-        MILVUS_CLIENT = Milvus(HOST, PORT)
-    else:
-        try:
-            MILVUS_CLIENT.server_status()
-        except:
-            MILVUS_CLIENT = Milvus(HOST, PORT)
+    manager.register(
+        "milvus",
+        factory=lambda: Milvus(HOST, PORT, pool_size=MILVUS_POOL_SIZE),
+        health_check=lambda client: client.server_status(),
+        close=lambda client: client.close(),
+        get_pool_stats=lambda client: dict(pool_size=MILVUS_POOL_SIZE),
+        # The other errors, e.g., invalid parameters, don't trigger a health check.
+        failure_errors=(ConnectError, grpc.RpcError, grpc.FutureTimeoutError))
 
-    return MILVUS_CLIENT
+    return manager.get("milvus")
 
 
 def get_hex_id(int_id: int):
@@ -65,11 +69,18 @@ def get_collection_ids(collection_name, partition_tag=None):
     return collection_ids
 
 
-def get_embedding_dsl(query_vec, topk, vector_field_name, metric_type="IP"):
+def get_embedding_dsl(query_vec, topk, vector_field_name, metric_type="IP", params=None):
     """This method creates a dsl query for the given query vector.
     The distance metric is specified by the `metric_type` parameter.
+
+    A 2-d `query_vec` is treated as a batch of query vectors.
     """
 
+    if query_vec.ndim == 2 and query_vec.shape[0] > 1:
+        query = [vec for vec in query_vec]
+    else:
+        query = [query_vec.flatten()]
+
     dsl = {
         "bool": {
             "must": [
@@ -77,7 +88,7 @@ def get_embedding_dsl(query_vec, topk, vector_field_name, metric_type="IP"):
                     "vector": {
                         vector_field_name: {
                             "topk": topk,
-                            "query": [query_vec.flatten()],
+                            "query": query,
                             "metric_type": metric_type
                         }
                     }
@@ -86,4 +97,7 @@ def get_embedding_dsl(query_vec, topk, vector_field_name, metric_type="IP"):
         }
     }
 
+    if params:
+        dsl["bool"]["must"][0]["vector"][vector_field_name]["params"] = params
+
     return dsl
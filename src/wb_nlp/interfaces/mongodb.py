@@ -1,49 +1,44 @@
+import os
 import json
 import pymongo
+from pymongo.errors import ConnectionFailure
 from wb_nlp.dir_manager import get_data_dir
+from wb_nlp.interfaces.connections import get_connection_manager
 
-MONGODB_CLIENT = None
 HOST = "mongodb"
 PORT = 27017
+MONGODB_POOL_SIZE = int(os.environ.get("WB_NLP_MONGODB_POOL_SIZE", 100))
 
 
-def test_or_get_client(host, port):
-    # Create a temporary client with short timeout to test for existence.
-    _client = pymongo.MongoClient(
-        host=host, port=PORT, serverSelectionTimeoutMS=50)
+def _ping(client):
+    client.admin.command("ping")
 
-    client = None
-    try:
-        _client.server_info()
-
-        # Create a new client with now a longer timeout
-        client = pymongo.MongoClient(host=host, port=port)
-
-    finally:
-        _client.close()
 
-    return client
+def _get_pool_stats(client):
+    return dict(max_pool_size=client.max_pool_size, nodes=len(client.nodes))
 
 
 def get_mongodb_client(host=None, port=None):
-    global MONGODB_CLIENT
-
     _HOST = host or HOST
     _PORT = port or PORT
 
-    if MONGODB_CLIENT is None:
-        MONGODB_CLIENT = test_or_get_client(host=_HOST, port=_PORT)
-    else:
-        try:
-            MONGODB_CLIENT.server_info()
-        except:
-            MONGODB_CLIENT = test_or_get_client(host=_HOST, port=_PORT)
+    manager = get_connection_manager()
+    name = f"mongodb:{_HOST}:{_PORT}"
 
-    if MONGODB_CLIENT is None:
-        raise ValueError(
-            f"Connection is not available due to a possible invalid server details provided. Please confirm host=`{HOST}` and port=`{PORT}` are correct.")
+    manager.register(
+        name,
+        factory=lambda: pymongo.MongoClient(
+            host=_HOST, port=_PORT, maxPoolSize=MONGODB_POOL_SIZE, serverSelectionTimeoutMS=5000),
+        health_check=_ping,
+        close=lambda client: client.close(),
+        get_pool_stats=_get_pool_stats,
+        failure_errors=(ConnectionFailure,))
 
-    return MONGODB_CLIENT
+    try:
+        return manager.get(name)
+    except ConnectionError as e:
+        raise ValueError(
+            f"Connection is not available due to a possible invalid server details provided. Please confirm host=`{_HOST}` and port=`{_PORT}` are correct.") from e
 
 
 def get_collection(db_name, collection_name, host=None, port=None):
@@ -86,3 +81,9 @@ def get_latest_update_collection(host=None, port=None):
 
 def get_es_nlp_doc_metadata_collection(host=None, port=None):
     return get_collection(host=host, port=port, db_name="es", collection_name="nlp_doc")
+
+
+def create_es_nlp_doc_metadata_indexes(host=None, port=None):
+    # `updated_at` is the watermark of the refresh of the doc id map.
+    get_es_nlp_doc_metadata_collection(
+        host=host, port=port).create_index("updated_at")
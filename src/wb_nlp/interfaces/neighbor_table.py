@@ -0,0 +1,289 @@
+'''This module implements the table of the precomputed nearest neighbours of
+the documents of a model.
+
+The related documents of a document only change when the collection of the
+model changes. The top-K neighbours of every document are computed offline
+with batched matrix products over the vectors of the collection (inner
+product) and stored in NumPy arrays on disk loaded by memory-map:
+
+    - int_ids.npy: the sorted int64 `int_id` of the documents.
+    - neighbors.npy: the int64 `int_id` of the neighbours of each document,
+      sorted by decreasing score and padded with -1.
+    - scores.npy: the float32 scores of the neighbours.
+    - duplicates.npy: whether the score of the neighbour is above the
+      duplicate threshold of the table.
+    - hashes.npy: the hash of the vector of each document, used to find the
+      documents that changed.
+
+The table is updated incrementally: the neighbours of the new and changed
+documents are computed against the whole collection, the new documents are
+merged into the neighbours of the other documents, and only the documents
+that had a removed or changed document among their neighbours are
+recomputed. As with the doc id map, each build is written in a new
+generation directory made current by replacing the `CURRENT` file.
+
+Configuration:
+    - WB_NLP_NEIGHBORS_TOPK: number of neighbours stored per document.
+    - WB_NLP_NEIGHBORS_CHECK_INTERVAL: interval in seconds between the checks for a new generation of the table.
+'''
+import os
+import json
+import time
+import shutil
+import threading
+from hashlib import blake2b
+from pathlib import Path
+
+import numpy as np
+
+from wb_nlp.utils.scripts import file_lock
+
+
+NEIGHBORS_TOPK = int(os.environ.get("WB_NLP_NEIGHBORS_TOPK", 50))
+NEIGHBORS_CHECK_INTERVAL = float(
+    os.environ.get("WB_NLP_NEIGHBORS_CHECK_INTERVAL", 60))
+
+ARRAY_NAMES = ["int_ids", "neighbors", "scores", "duplicates", "hashes"]
+KEEP_GENERATIONS = 2
+
+# Maximum number of entries of the score matrix of a block of queries.
+BLOCK_ENTRIES = 2 ** 25
+
+# Above this fraction of documents to recompute the table is rebuilt.
+FULL_REBUILD_FRACTION = 0.5
+
+
+def hash_vectors(vectors):
+    return np.fromiter(
+        (int.from_bytes(blake2b(np.ascontiguousarray(vec).tobytes(), digest_size=8).digest(), "little")
+         for vec in vectors), dtype=np.uint64, count=len(vectors))
+
+
+def merge_top_k(ids_a, scores_a, ids_b, scores_b, topk):
+    '''Merges two (ids, scores) matrices row by row and returns the `topk`
+    entries of each row sorted by decreasing score.
+    '''
+    ids = np.hstack([ids_a, ids_b])
+    scores = np.hstack([scores_a, scores_b])
+
+    if scores.shape[1] > topk:
+        part = np.argpartition(-scores, topk - 1, axis=1)[:, :topk]
+        ids = np.take_along_axis(ids, part, axis=1)
+        scores = np.take_along_axis(scores, part, axis=1)
+
+    order = np.argsort(-scores, axis=1, kind="stable")
+
+    return np.take_along_axis(ids, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+def compute_top_k(queries, vectors, vector_ids, topk):
+    '''Returns the (ids, scores) of the `topk` rows of `vectors` with the
+    largest inner product with each of the `queries`, padded with -1 and
+    -inf if there are less than `topk` vectors.
+    '''
+    n_queries = len(queries)
+    ids = np.full((n_queries, topk), -1, dtype=np.int64)
+    scores = np.full((n_queries, topk), -np.inf, dtype=np.float32)
+
+    if n_queries == 0 or len(vectors) == 0:
+        return ids, scores
+
+    block_size = max(1, BLOCK_ENTRIES // len(vectors))
+
+    for start in range(0, n_queries, block_size):
+        block_scores = queries[start: start + block_size] @ vectors.T
+        block_ids = np.broadcast_to(vector_ids, block_scores.shape)
+
+        ids[start: start + block_size], scores[start: start + block_size] = merge_top_k(
+            ids[start: start + block_size], scores[start: start + block_size],
+            block_ids, block_scores.astype(np.float32), topk)
+
+    return ids, scores
+
+
+class NeighborTable:
+    '''Precomputed top-K neighbours of the documents of a collection.
+    '''
+
+    def __init__(self, root_dir, topk=NEIGHBORS_TOPK, duplicate_threshold=0.999, check_interval=NEIGHBORS_CHECK_INTERVAL):
+        self.root_dir = Path(root_dir)
+        self.topk = topk
+        self.duplicate_threshold = duplicate_threshold
+        self.check_interval = check_interval
+
+        self.generation = None
+        self.arrays = None
+        self.meta = None
+        self.checked_at = 0
+        self._lock = threading.Lock()
+
+    @property
+    def current_file(self):
+        return self.root_dir / "CURRENT"
+
+    @property
+    def lock_file(self):
+        return self.root_dir / ".lock"
+
+    def read_current(self):
+        try:
+            return json.loads(self.current_file.read_text())
+        except FileNotFoundError:
+            return None
+
+    def load_arrays(self, current):
+        gen_dir = self.root_dir / current["generation"]
+
+        return {name: np.load(gen_dir / f"{name}.npy", mmap_mode="r")
+                for name in ARRAY_NAMES}
+
+    def load(self):
+        '''Loads the current generation of the table if it changed.
+        '''
+        current = self.read_current()
+
+        if current is None or self.generation == current["generation"]:
+            return
+
+        arrays = self.load_arrays(current)
+
+        with self._lock:
+            self.arrays = arrays
+            self.meta = current
+            self.generation = current["generation"]
+
+    def check(self):
+        now = time.time()
+
+        if now - self.checked_at > self.check_interval:
+            self.checked_at = now
+            self.load()
+
+    def lookup(self, int_id):
+        '''Returns the (neighbors, scores, duplicates) of the document, or None
+        if the document is not in the table.
+        '''
+        self.check()
+
+        arrays = self.arrays
+        if arrays is None or len(arrays["int_ids"]) == 0:
+            return None
+
+        position = int(np.searchsorted(arrays["int_ids"], int_id))
+        if position >= len(arrays["int_ids"]) or arrays["int_ids"][position] != int_id:
+            return None
+
+        neighbors = np.asarray(arrays["neighbors"][position])
+        valid = neighbors >= 0
+
+        return (neighbors[valid], np.asarray(arrays["scores"][position])[valid],
+                np.asarray(arrays["duplicates"][position])[valid])
+
+    def build(self, int_ids, vectors, full=False):
+        '''Updates the table with the `vectors` of the collection identified by
+        `int_ids`. Returns the number of documents whose neighbours were
+        fully recomputed.
+        '''
+        int_ids = np.asarray(int_ids, dtype=np.int64)
+        order = np.argsort(int_ids, kind="stable")
+        int_ids = int_ids[order]
+        vectors = np.asarray(vectors, dtype=np.float32)[order]
+        hashes = hash_vectors(vectors)
+
+        n_docs = len(int_ids)
+
+        with file_lock(self.lock_file):
+            current = self.read_current()
+
+            if current is not None and current["topk"] != self.topk:
+                full = True
+
+            neighbors = np.full((n_docs, self.topk), -1, dtype=np.int64)
+            scores = np.full((n_docs, self.topk), -np.inf, dtype=np.float32)
+            recompute = np.ones(n_docs, dtype=bool)
+
+            if current is not None and not full and current["size"]:
+                old = self.load_arrays(current)
+                old_ids = old["int_ids"]
+
+                positions = np.minimum(np.searchsorted(
+                    old_ids, int_ids), len(old_ids) - 1)
+                unchanged = (old_ids[positions] == int_ids) & (
+                    old["hashes"][positions] == hashes)
+
+                # Documents removed from the collection or whose vector changed.
+                stale_ids = np.setdiff1d(old_ids, int_ids[unchanged])
+                fresh = ~unchanged
+
+                if not fresh.any() and not len(stale_ids):
+                    return 0
+
+                old_neighbors = old["neighbors"][positions[unchanged]]
+                dirty = np.isin(old_neighbors, stale_ids).any(axis=1)
+
+                merge_rows = np.flatnonzero(unchanged)[~dirty]
+                recompute[merge_rows] = False
+
+                if recompute.sum() <= FULL_REBUILD_FRACTION * n_docs:
+                    # Add the new and changed documents to the neighbours of the others.
+                    new_ids, new_scores = compute_top_k(
+                        vectors[merge_rows], vectors[fresh], int_ids[fresh], self.topk)
+
+                    neighbors[merge_rows], scores[merge_rows] = merge_top_k(
+                        old["neighbors"][positions[merge_rows]],
+                        old["scores"][positions[merge_rows]],
+                        new_ids, new_scores, self.topk)
+                else:
+                    recompute[:] = True
+
+            rows = np.flatnonzero(recompute)
+            neighbors[rows], scores[rows] = compute_top_k(
+                vectors[rows], vectors, int_ids, self.topk)
+
+            self.write_generation(dict(
+                int_ids=int_ids,
+                neighbors=neighbors,
+                scores=scores,
+                duplicates=scores > self.duplicate_threshold,
+                hashes=hashes,
+            ))
+
+        return len(rows)
+
+    def write_generation(self, arrays):
+        '''Writes `arrays` in a new generation directory and makes it current.
+        Must be called while holding the lock of the table.
+        '''
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+
+        generation = f"gen-{time.time_ns()}"
+        tmp_dir = self.root_dir / f"{generation}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir()
+
+        for name in ARRAY_NAMES:
+            np.save(tmp_dir / f"{name}.npy", arrays[name])
+
+        os.replace(tmp_dir, self.root_dir / generation)
+
+        tmp_current = self.current_file.with_suffix(".tmp")
+        tmp_current.write_text(json.dumps(dict(
+            generation=generation, size=len(arrays["int_ids"]), topk=self.topk,
+            duplicate_threshold=self.duplicate_threshold, built_at=time.time())))
+        os.replace(tmp_current, self.current_file)
+
+        generations = sorted(self.root_dir.glob("gen-*[0-9]"))
+        for gen_dir in generations[:-KEEP_GENERATIONS]:
+            shutil.rmtree(gen_dir, ignore_errors=True)
+
+    def get_stats(self):
+        self.check()
+
+        with self._lock:
+            if self.arrays is None:
+                return dict(generation=None, size=0)
+
+            return dict(
+                self.meta,
+                nbytes=sum(a.nbytes for a in self.arrays.values()),
+            )
@@ -0,0 +1,1136 @@
+'''This module implements a pluggable interface to the vector stores used to
+keep the document and indicator embeddings.
+
+Two backends are available:
+    - `milvus`: uses the Milvus server (default).
+    - `local`: keeps a memory-mapped float32 matrix and an id array per
+      collection on disk and runs the search in-process.
+
+The backend is selected with the `WB_NLP_VECTOR_STORE` environment variable.
+The local backend does not need a running Milvus server which makes it
+possible to run the API on a single box.
+
+The vectors of a collection can be quantized (`float16`, `int8`, or `pq`).
+The local backend then scans the compact codes and re-ranks the best
+`rerank * topk` candidates with the float32 vectors, which are
+memory-mapped and only read for the candidates. Milvus keeps the
+float32 vectors and quantizes in its index (IVF_SQ8 or IVF_PQ), the
+candidates of these indexes are re-ranked the same way.
+'''
+import os
+import json
+import fcntl
+import shutil
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from wb_nlp import dir_manager
+from wb_nlp.interfaces import milvus
+from wb_nlp.interfaces.connections import reconnect_on_failure
+
+
+VECTOR_STORE_BACKEND = os.environ.get("WB_NLP_VECTOR_STORE", "milvus")
+LOCAL_VECTOR_STORE_DIR = os.environ.get(
+    "WB_NLP_LOCAL_VECTOR_STORE_DIR",
+    dir_manager.get_path_from_root("models", "vector_store"))
+
+VECTOR_FIELD_NAME = "embedding"
+
+# Collections smaller than this are always searched exhaustively even
+# if an index is available since a flat scan is already fast enough.
+BRUTE_FORCE_MAX_ROWS = 50000
+
+# Number of attempts to load a collection whose version changed while loading.
+LOAD_RETRIES = 3
+
+# Number of rows scored at once in the brute-force search.
+SEARCH_BLOCK_SIZE = 65536
+
+QUANTIZATION_TYPES = ("float16", "int8", "pq")
+
+# Default number of candidates, as a multiple of `topk`, re-ranked with the
+# float32 vectors when the search runs on quantized vectors.
+RERANK_FACTORS = {
+    "float16": 2,
+    "int8": 4,
+    "pq": 16,
+}
+
+# Arrays of the local store with one entry per quantized vector.
+QUANTIZED_ARRAYS = {
+    "float16": ["codes"],
+    "int8": ["codes", "code_scales"],
+    "pq": ["codes"],
+}
+
+# Maximum number of vectors used to train the codebooks of the product quantization.
+PQ_TRAIN_SIZE = 65536
+
+# Number of sub-vectors of the product quantization supported by Milvus.
+PQ_M_VALUES = [96, 64, 56, 48, 40, 32, 28, 24, 20, 16, 12, 8, 4, 3, 2, 1]
+
+VectorHit = namedtuple("VectorHit", ["id", "distance"])
+
+_VECTOR_STORE = None
+
+
+class BaseVectorStore:
+    '''Interface expected from the vector store backends.
+
+    The `search` method returns, for each query vector, a list of `VectorHit`
+    sorted from the most to the least similar entry.
+    '''
+
+    # Index types supported by `create_index`.
+    index_types = ()
+
+    # Index types that search quantized vectors.
+    lossy_index_types = ()
+
+    # Whether the backend stores the quantized vectors of the quantized
+    # collections. Otherwise only the lossy indexes quantize the vectors.
+    stores_quantized_vectors = False
+
+    # Whether the inserted vectors are kept by the backend until `flush` is
+    # called from any process, so that the flush can wait for the end of a
+    # bulk load.
+    supports_deferred_flush = False
+
+    def list_collections(self):
+        raise NotImplementedError
+
+    def has_collection(self, collection_name):
+        return collection_name in self.list_collections()
+
+    def create_collection(self, collection_name, dim, quantization=None):
+        '''Creates the collection of vectors of dimension `dim`. The
+        `quantization` is a dictionary with the `type` of the quantization
+        and its parameters, e.g., `{"type": "pq", "m": 16}`.
+        '''
+        raise NotImplementedError
+
+    def drop_collection(self, collection_name):
+        raise NotImplementedError
+
+    def insert(self, collection_name, vectors, ids, partition_tag=None):
+        raise NotImplementedError
+
+    def flush(self, collection_name):
+        raise NotImplementedError
+
+    def delete(self, collection_name, ids):
+        raise NotImplementedError
+
+    def count(self, collection_name):
+        raise NotImplementedError
+
+    def describe(self, collection_name):
+        '''Returns the `count`, the `dim`, the `partitions`, and the `version`
+        of the collection, if available, without listing its entries.
+        '''
+        raise NotImplementedError
+
+    def list_ids(self, collection_name, partition_tag=None):
+        raise NotImplementedError
+
+    def get_vectors(self, collection_name, ids):
+        '''Returns a list aligned with `ids` containing the stored vectors or
+        `None` if the id is not in the collection.
+        '''
+        raise NotImplementedError
+
+    def search(self, collection_name, query_vecs, topk, metric_type="IP", params=None):
+        raise NotImplementedError
+
+    def create_index(self, collection_name, index_type, params=None):
+        raise NotImplementedError
+
+    def drop_index(self, collection_name):
+        raise NotImplementedError
+
+    def train_quantizer(self, collection_name):
+        '''Trains the quantization of the stored vectors on the whole
+        collection, e.g., at the end of a bulk load. Returns whether the
+        quantization was retrained.
+        '''
+        return False
+
+    def rerank(self, collection_name, query_vecs, results, topk, metric_type="IP"):
+        '''Re-scores the candidates in `results` with the stored float32
+        vectors and returns the `topk` best of each query.
+        '''
+        candidate_ids = sorted({hit.id for hits in results for hit in hits})
+        vectors = dict(zip(candidate_ids, self.get_vectors(
+            collection_name, candidate_ids)))
+
+        reranked = []
+        for query_vec, hits in zip(query_vecs, results):
+            hit_ids = [hit.id for hit in hits if vectors.get(hit.id) is not None]
+
+            if not hit_ids:
+                reranked.append([])
+                continue
+
+            candidates = np.vstack([vectors[hit_id] for hit_id in hit_ids])
+
+            if metric_type == "L2":
+                scores = ((candidates - query_vec) ** 2).sum(axis=1)
+                order = np.argsort(scores, kind="stable")
+            else:
+                scores = candidates @ query_vec
+                order = np.argsort(-scores, kind="stable")
+
+            reranked.append([VectorHit(id=hit_ids[ix], distance=float(scores[ix]))
+                             for ix in order[:topk]])
+
+        return reranked
+
+
+class MilvusVectorStore(BaseVectorStore):
+    '''Vector store backed by the Milvus server.
+    '''
+
+    index_types = ("IVF_FLAT", "IVF_SQ8", "IVF_PQ", "HNSW")
+    lossy_index_types = ("IVF_SQ8", "IVF_PQ")
+    supports_deferred_flush = True
+
+    def __init__(self, vector_field_name=VECTOR_FIELD_NAME):
+        self.vector_field_name = vector_field_name
+
+    @property
+    def client(self):
+        return milvus.get_milvus_client()
+
+    @reconnect_on_failure("milvus")
+    def list_collections(self):
+        return self.client.list_collections()
+
+    @reconnect_on_failure("milvus")
+    def create_collection(self, collection_name, dim, quantization=None):
+        # Milvus keeps the float32 vectors, the quantization is done by the
+        # index of the collection (see `index_manager`).
+        collection_params = {
+            "fields": [
+                {"name": self.vector_field_name, "type": milvus.DataType.FLOAT_VECTOR,
+                    "params": {"dim": dim}},
+            ],
+            "segment_row_limit": 4096,
+            "auto_id": False
+        }
+
+        self.client.create_collection(collection_name, collection_params)
+
+    @reconnect_on_failure("milvus")
+    def drop_collection(self, collection_name):
+        if self.has_collection(collection_name):
+            self.client.drop_collection(collection_name)
+
+    # A retry after a partial insert would duplicate the entities.
+    @reconnect_on_failure("milvus", retry=False)
+    def insert(self, collection_name, vectors, ids, partition_tag=None):
+        client = self.client
+
+        entities = [
+            {"name": self.vector_field_name, "values": [np.asarray(v, dtype=np.float32).flatten() for v in vectors],
+                "type": milvus.DataType.FLOAT_VECTOR},
+        ]
+
+        if partition_tag is not None and not client.has_partition(collection_name, partition_tag):
+            client.create_partition(collection_name, partition_tag)
+
+        return client.insert(collection_name, entities, list(ids), partition_tag=partition_tag)
+
+    @reconnect_on_failure("milvus")
+    def flush(self, collection_name):
+        self.client.flush([collection_name])
+
+    @reconnect_on_failure("milvus", retry=False)
+    def delete(self, collection_name, ids):
+        ids = list(ids)
+        if ids:
+            self.client.delete_entity_by_id(collection_name, ids)
+
+    @reconnect_on_failure("milvus")
+    def count(self, collection_name):
+        return self.client.count_entities(collection_name)
+
+    @reconnect_on_failure("milvus")
+    def describe(self, collection_name):
+        client = self.client
+        info = client.get_collection_info(collection_name)
+
+        dim = None
+        index = None
+        for field in info.get("fields", []):
+            if field.get("name") == self.vector_field_name:
+                dim = field.get("params", {}).get("dim")
+
+                for field_index in field.get("indexes") or []:
+                    if field_index.get("index_type"):
+                        index = dict(index_type=field_index["index_type"],
+                                     params=field_index.get("params", {}))
+
+        return dict(
+            count=client.count_entities(collection_name), dim=dim,
+            partitions=list(client.list_partitions(collection_name)), version=None, index=index)
+
+    @reconnect_on_failure("milvus")
+    def list_ids(self, collection_name, partition_tag=None):
+        return milvus.get_collection_ids(collection_name, partition_tag=partition_tag)
+
+    @reconnect_on_failure("milvus")
+    def get_vectors(self, collection_name, ids):
+        entities = self.client.get_entity_by_id(collection_name, ids=list(ids))
+
+        return [None if ent is None else np.array(getattr(ent, self.vector_field_name), dtype=np.float32)
+                for ent in entities]
+
+    @reconnect_on_failure("milvus")
+    def search(self, collection_name, query_vecs, topk, metric_type="IP", params=None):
+        query_vecs = np.asarray(query_vecs, dtype=np.float32).reshape(
+            -1, np.shape(query_vecs)[-1])
+
+        # The `rerank` factor is not a parameter of the Milvus search.
+        params = dict(params or {})
+        rerank = params.pop("rerank", None)
+
+        dsl = milvus.get_embedding_dsl(
+            query_vecs, topk * rerank if rerank else topk, vector_field_name=self.vector_field_name,
+            metric_type=metric_type, params=params or None)
+        results = self.client.search(collection_name, dsl)
+
+        results = [[VectorHit(id=ent.id, distance=ent.distance) for ent in result] for result in results]
+
+        if rerank:
+            results = self.rerank(
+                collection_name, query_vecs, results, topk, metric_type=metric_type)
+
+        return results
+
+    @reconnect_on_failure("milvus")
+    def create_index(self, collection_name, index_type, params=None):
+        self.client.create_index(
+            collection_name, self.vector_field_name,
+            {"index_type": index_type, "metric_type": "IP", "params": params or {}})
+
+    @reconnect_on_failure("milvus")
+    def drop_index(self, collection_name):
+        self.client.drop_index(collection_name, self.vector_field_name)
+
+
+def _top_k(scores, ids, topk, largest=True):
+    '''Returns the top `topk` entries along the first axis of the `scores`
+    matrix (n_rows x n_queries) as (scores, ids) matrices of shape
+    (topk x n_queries), not sorted. The `ids` are either the ids of the rows
+    or a matrix of the same shape as `scores`.
+    '''
+    n_rows = scores.shape[0]
+
+    if np.ndim(ids) == 1:
+        ids = np.broadcast_to(np.reshape(ids, (-1, 1)), scores.shape)
+
+    if n_rows <= topk:
+        return scores, ids
+
+    signed = -scores if largest else scores
+    part = np.argpartition(signed, topk - 1, axis=0)[:topk]
+
+    return np.take_along_axis(scores, part, axis=0), np.take_along_axis(ids, part, axis=0)
+
+
+def _brute_force_search(vectors, ids, query_vecs, topk, metric_type="IP", rows=None):
+    '''Exhaustive search over `vectors` processed in blocks so that the score
+    matrix never exceeds `SEARCH_BLOCK_SIZE` rows. If `rows` is given, only
+    those row positions are scored.
+    '''
+    largest = metric_type == "IP"
+    n_rows = vectors.shape[0] if rows is None else len(rows)
+
+    best_scores = None
+    best_ids = None
+
+    if metric_type == "L2":
+        query_sq = (query_vecs ** 2).sum(axis=1)
+
+    for start in range(0, n_rows, SEARCH_BLOCK_SIZE):
+        if rows is None:
+            block = np.asarray(vectors[start: start + SEARCH_BLOCK_SIZE])
+            block_ids = ids[start: start + SEARCH_BLOCK_SIZE]
+        else:
+            block_rows = rows[start: start + SEARCH_BLOCK_SIZE]
+            block = np.asarray(vectors[block_rows])
+            block_ids = ids[block_rows]
+
+        scores = block @ query_vecs.T
+
+        if metric_type == "L2":
+            scores = (block ** 2).sum(axis=1).reshape(-1, 1) - \
+                2 * scores + query_sq.reshape(1, -1)
+        elif metric_type != "IP":
+            raise ValueError(f"Unknown metric_type: `{metric_type}`")
+
+        block_scores, block_ids = _top_k(
+            scores, block_ids, topk, largest=largest)
+
+        if best_scores is None:
+            best_scores, best_ids = block_scores, block_ids
+        else:
+            best_scores, best_ids = _top_k(
+                np.vstack([best_scores, block_scores]),
+                np.vstack([best_ids, block_ids]),
+                topk, largest=largest)
+
+    if best_scores is None:
+        return [[] for _ in range(len(query_vecs))]
+
+    results = []
+    for qix in range(best_scores.shape[1]):
+        q_scores = best_scores[:, qix]
+        q_ids = best_ids[:, qix]
+
+        order = np.argsort(-q_scores if largest else q_scores, kind="stable")
+        results.append([VectorHit(id=int(q_ids[ix]), distance=float(q_scores[ix]))
+                        for ix in order])
+
+    return results
+
+
+def _kmeans(data, n_clusters, n_iter=10, seed=1029):
+    '''Plain Lloyd's k-means used to train the coarse quantizer of the IVF index.
+    '''
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignments = _assign(data, centroids)
+
+        for cix in range(n_clusters):
+            members = data[assignments == cix]
+            if len(members):
+                centroids[cix] = members.mean(axis=0)
+            else:
+                # Re-seed empty clusters with a random point.
+                centroids[cix] = data[rng.integers(len(data))]
+
+    return centroids
+
+
+def _sample_rows(vectors, size, seed=1029):
+    rng = np.random.default_rng(seed)
+
+    return np.asarray(vectors[np.sort(rng.choice(len(vectors), size=size, replace=False))])
+
+
+def get_rerank_factor(quantization):
+    return int(quantization.get("rerank") or RERANK_FACTORS[quantization["type"]])
+
+
+def get_pq_m(dim, m=None):
+    '''Returns the number of sub-vectors of the product quantization of
+    vectors of dimension `dim`: `m` if given, otherwise the largest value
+    supported by Milvus that divides `dim` with sub-vectors of at least 4
+    dimensions.
+    '''
+    if m is not None:
+        if dim % m:
+            raise ValueError(
+                f"The number of sub-vectors m={m} must divide the dimension {dim}.")
+        return m
+
+    return next((m for m in PQ_M_VALUES if dim % m == 0 and dim // m >= 4), 1)
+
+
+def _train_pq(data, m):
+    '''Trains the codebooks (m x 256 x dim / m) of the product quantization.
+    '''
+    data = np.asarray(data, dtype=np.float32)
+    n_clusters = min(256, len(data))
+    sub_dim = data.shape[1] // m
+
+    codebooks = np.zeros((m, 256, sub_dim), dtype=np.float32)
+    for j in range(m):
+        codebooks[j, :n_clusters] = _kmeans(
+            data[:, j * sub_dim: (j + 1) * sub_dim], n_clusters)
+
+    return codebooks
+
+
+def _encode(quantization, vectors, codebooks=None):
+    '''Returns the row-aligned arrays of the quantized `vectors`.
+    '''
+    vectors = np.asarray(vectors, dtype=np.float32)
+    kind = quantization["type"]
+
+    if kind == "float16":
+        return dict(codes=vectors.astype(np.float16))
+
+    if kind == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        codes = np.rint(vectors / scales.reshape(-1, 1)).astype(np.int8)
+
+        return dict(codes=codes, code_scales=scales.astype(np.float32))
+
+    if kind == "pq":
+        m, n_clusters, sub_dim = codebooks.shape
+        codes = np.empty((len(vectors), m), dtype=np.uint8)
+
+        for j in range(m):
+            codes[:, j] = _assign(
+                vectors[:, j * sub_dim: (j + 1) * sub_dim], codebooks[j])
+
+        return dict(codes=codes)
+
+    raise ValueError(
+        f"Unknown quantization: `{kind}`. Accepted values: {', '.join(QUANTIZATION_TYPES)}...")
+
+
+class QuantizedVectors:
+    '''Read-only view of the quantized vectors of a collection. Indexing
+    the view returns the decoded float32 rows.
+    '''
+
+    def __init__(self, quantization, arrays, dim):
+        self.kind = quantization["type"]
+        self.arrays = arrays
+        self.shape = (len(arrays["codes"]), dim)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.arrays.values())
+
+    def __getitem__(self, key):
+        codes = np.asarray(self.arrays["codes"][key])
+
+        if self.kind == "float16":
+            return codes.astype(np.float32)
+
+        if self.kind == "int8":
+            scales = np.asarray(self.arrays["code_scales"][key])
+            return codes.astype(np.float32) * np.reshape(scales, np.shape(scales) + (1,))
+
+        codebooks = self.arrays["pq_codebooks"]
+        decoded = codebooks[np.arange(len(codebooks)), codes]
+
+        return decoded.reshape(codes.shape[:-1] + (-1,))
+
+
+def _assign(data, centroids):
+    '''Assigns each row of `data` to the nearest centroid (L2).
+    '''
+    assignments = np.empty(len(data), dtype=np.int32)
+    centroids_sq = (centroids ** 2).sum(axis=1)
+
+    for start in range(0, len(data), SEARCH_BLOCK_SIZE):
+        block = np.asarray(data[start: start + SEARCH_BLOCK_SIZE])
+        dist = centroids_sq.reshape(1, -1) - 2 * (block @ centroids.T)
+        assignments[start: start + SEARCH_BLOCK_SIZE] = dist.argmin(axis=1)
+
+    return assignments
+
+
+class LocalVectorStore(BaseVectorStore):
+    '''In-process vector store.
+
+    Each collection lives in its own directory containing a `meta.json` file
+    and versioned `.npy` files for the vectors, ids and partition codes. The
+    arrays are memory-mapped on load so that several processes can share the
+    same pages through the OS page cache.
+
+    Inserted vectors are buffered in memory and only written to disk on
+    `flush`. Writers serialize on a file lock so that parallel workers can
+    load the same collection. Readers reload a collection when the version
+    recorded in `meta.json` changes.
+    '''
+
+    index_types = ("IVF_FLAT",)
+    stores_quantized_vectors = True
+
+    def __init__(self, root_dir=LOCAL_VECTOR_STORE_DIR):
+        self.root_dir = Path(root_dir)
+        self._pending = {}
+        self._loaded = {}
+        self._lock = threading.RLock()
+
+    def get_collection_dir(self, collection_name):
+        return self.root_dir / collection_name
+
+    def _meta_path(self, collection_name):
+        return self.get_collection_dir(collection_name) / "meta.json"
+
+    def read_meta(self, collection_name):
+        meta_path = self._meta_path(collection_name)
+
+        if not meta_path.exists():
+            raise ValueError(
+                f"Collection `{collection_name}` does not exist in the local vector store.")
+
+        with open(meta_path) as open_file:
+            return json.load(open_file)
+
+    def _write_meta(self, collection_name, meta):
+        meta_path = self._meta_path(collection_name)
+        tmp_path = meta_path.with_suffix(".json.tmp")
+
+        with open(tmp_path, "w") as open_file:
+            json.dump(meta, open_file)
+
+        os.replace(tmp_path, meta_path)
+
+    @contextmanager
+    def _write_lock(self, collection_name):
+        lock_path = self.get_collection_dir(collection_name) / ".lock"
+
+        with open(lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _array_path(self, collection_name, name, version):
+        return self.get_collection_dir(collection_name) / f"{name}-{version}.npy"
+
+    def _save_array(self, collection_name, name, version, array):
+        path = self._array_path(collection_name, name, version)
+        tmp_path = path.with_suffix(".tmp")
+
+        with open(tmp_path, "wb") as open_file:
+            np.save(open_file, array)
+
+        os.replace(tmp_path, path)
+
+    def _link_array(self, collection_name, name, version, new_version):
+        '''Makes the array of `version` also available as the array of
+        `new_version`. The file of `version` is not modified.
+        '''
+        path = self._array_path(collection_name, name, new_version)
+        tmp_path = path.with_suffix(".tmp")
+
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+        try:
+            # The arrays are never modified in place so that both versions can share the file.
+            os.link(self._array_path(collection_name, name, version), tmp_path)
+        except OSError:
+            shutil.copyfile(self._array_path(
+                collection_name, name, version), tmp_path)
+
+        os.replace(tmp_path, path)
+
+    def _remove_stale_arrays(self, collection_name, version):
+        # Open memory maps of older versions stay valid after unlinking.
+        for path in self.get_collection_dir(collection_name).glob("*.npy"):
+            if not path.stem.endswith(f"-{version}"):
+                path.unlink()
+
+    def list_collections(self):
+        if not self.root_dir.exists():
+            return []
+
+        return sorted(p.parent.name for p in self.root_dir.glob("*/meta.json"))
+
+    def has_collection(self, collection_name):
+        return self._meta_path(collection_name).exists()
+
+    def create_collection(self, collection_name, dim, quantization=None):
+        if quantization is not None:
+            if quantization["type"] not in QUANTIZATION_TYPES:
+                raise ValueError(
+                    f"Unknown quantization: `{quantization['type']}`. Accepted values: {', '.join(QUANTIZATION_TYPES)}...")
+
+            quantization = dict(quantization)
+            if quantization["type"] == "pq":
+                quantization["m"] = get_pq_m(dim, quantization.get("m"))
+
+        collection_dir = self.get_collection_dir(collection_name)
+        collection_dir.mkdir(parents=True, exist_ok=True)
+
+        with self._write_lock(collection_name):
+            if self.has_collection(collection_name):
+                return
+
+            self._write_meta(collection_name, dict(
+                dim=int(dim), version=0, count=0, partitions=[], index=None, quantization=quantization))
+
+    def _row_array_names(self, meta):
+        # Arrays with one entry per vector.
+        names = ["vectors", "ids", "partitions"]
+
+        if meta.get("quantization") is not None:
+            names.extend(QUANTIZED_ARRAYS[meta["quantization"]["type"]])
+        if meta.get("index") is not None:
+            names.append("ivf_assignments")
+
+        return names
+
+    def _shared_array_names(self, meta):
+        names = []
+
+        if (meta.get("quantization") or {}).get("type") == "pq":
+            names.append("pq_codebooks")
+        if meta.get("index") is not None:
+            names.append("ivf_centroids")
+
+        return names
+
+    def drop_collection(self, collection_name):
+        collection_dir = self.get_collection_dir(collection_name)
+
+        with self._lock:
+            self._pending.pop(collection_name, None)
+            self._loaded.pop(collection_name, None)
+
+        if not collection_dir.exists():
+            return
+
+        for path in collection_dir.iterdir():
+            path.unlink()
+        collection_dir.rmdir()
+
+    def insert(self, collection_name, vectors, ids, partition_tag=None):
+        meta = self.read_meta(collection_name)
+
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(
+            -1, meta["dim"])
+        ids = np.asarray(ids, dtype=np.int64)
+
+        assert len(vectors) == len(ids)
+
+        with self._lock:
+            self._pending.setdefault(collection_name, []).append(
+                (vectors, ids, partition_tag))
+
+        return ids.tolist()
+
+    def flush(self, collection_name):
+        with self._lock:
+            pending = self._pending.pop(collection_name, [])
+
+        if not pending:
+            return
+
+        with self._write_lock(collection_name):
+            meta = self.read_meta(collection_name)
+            version = meta["version"]
+            partitions = list(meta["partitions"])
+
+            new_vectors = np.vstack([p[0] for p in pending])
+            new_ids = np.concatenate([p[1] for p in pending])
+
+            new_codes = []
+            for vectors, _, partition_tag in pending:
+                if partition_tag not in partitions:
+                    partitions.append(partition_tag)
+                new_codes.append(
+                    np.full(len(vectors), partitions.index(partition_tag), dtype=np.int32))
+            new_codes = np.concatenate(new_codes)
+
+            # Keep only the last occurrence of an id, similar to an upsert.
+            _, last_pos = np.unique(new_ids[::-1], return_index=True)
+            keep = np.sort(len(new_ids) - 1 - last_pos)
+            new_vectors, new_ids, new_codes = new_vectors[keep], new_ids[keep], new_codes[keep]
+
+            if meta["count"]:
+                vectors = np.load(self._array_path(
+                    collection_name, "vectors", version), mmap_mode="r")
+                ids = np.load(self._array_path(
+                    collection_name, "ids", version))
+                codes = np.load(self._array_path(
+                    collection_name, "partitions", version))
+
+                retained = ~np.isin(ids, new_ids)
+                vectors = np.vstack([vectors[retained], new_vectors])
+                ids = np.concatenate([ids[retained], new_ids])
+                codes = np.concatenate([codes[retained], new_codes])
+            else:
+                vectors, ids, codes = new_vectors, new_ids, new_codes
+                retained = None
+
+            version += 1
+            self._save_array(collection_name, "vectors", version, vectors)
+            self._save_array(collection_name, "ids", version, ids)
+            self._save_array(collection_name, "partitions", version, codes)
+
+            quantization = meta.get("quantization")
+            if quantization is not None:
+                codebooks = None
+
+                if quantization["type"] == "pq":
+                    # The codebooks are trained on the first vectors, and
+                    # retrained on the whole collection by `train_quantizer`
+                    # at the end of the bulk load, or by `create_index`.
+                    if retained is not None:
+                        codebooks = np.load(self._array_path(
+                            collection_name, "pq_codebooks", meta["version"]))
+                    else:
+                        codebooks = _train_pq(new_vectors, quantization["m"])
+                        meta["pq_trained_on"] = len(new_vectors)
+
+                    self._save_array(collection_name, "pq_codebooks",
+                                     version, codebooks)
+
+                for name, array in _encode(quantization, new_vectors, codebooks).items():
+                    if retained is not None:
+                        old_array = np.load(self._array_path(
+                            collection_name, name, meta["version"]), mmap_mode="r")
+                        array = np.concatenate([old_array[retained], array])
+
+                    self._save_array(collection_name, name, version, array)
+
+            index = meta.get("index")
+            if index is not None:
+                centroids = np.load(self._array_path(
+                    collection_name, "ivf_centroids", meta["version"]))
+                assignments = _assign(new_vectors, centroids)
+
+                if retained is not None:
+                    old_assignments = np.load(self._array_path(
+                        collection_name, "ivf_assignments", meta["version"]))
+                    assignments = np.concatenate(
+                        [old_assignments[retained], assignments])
+
+                self._save_array(collection_name, "ivf_centroids",
+                                 version, centroids)
+                self._save_array(
+                    collection_name, "ivf_assignments", version, assignments)
+
+            meta.update(version=version, count=int(
+                len(ids)), partitions=partitions)
+            self._write_meta(collection_name, meta)
+            self._remove_stale_arrays(collection_name, version)
+
+    def delete(self, collection_name, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+
+        with self._write_lock(collection_name):
+            meta = self.read_meta(collection_name)
+            version = meta["version"]
+
+            if not meta["count"] or not len(ids):
+                return
+
+            stored_ids = np.load(self._array_path(
+                collection_name, "ids", version))
+            retained = ~np.isin(stored_ids, ids)
+
+            if retained.all():
+                return
+
+            row_names = self._row_array_names(meta)
+
+            for name in row_names + self._shared_array_names(meta):
+                array = np.load(self._array_path(
+                    collection_name, name, version), mmap_mode="r")
+                if name in row_names:
+                    array = array[retained]
+                self._save_array(collection_name, name, version + 1, np.asarray(array))
+
+            meta.update(version=version + 1, count=int(retained.sum()))
+            self._write_meta(collection_name, meta)
+            self._remove_stale_arrays(collection_name, version + 1)
+
+    def _load(self, collection_name):
+        '''Loads (or reuses) the memory-mapped arrays of the collection.
+        '''
+        for attempt in range(LOAD_RETRIES):
+            meta = self.read_meta(collection_name)
+
+            with self._lock:
+                loaded = self._loaded.get(collection_name)
+                if loaded is not None and loaded["meta"]["version"] == meta["version"]:
+                    return loaded
+
+            try:
+                loaded = self._load_arrays(collection_name, meta)
+                break
+            except FileNotFoundError:
+                # A writer published a new version and removed the arrays
+                # of this one after `meta.json` was read.
+                if attempt == LOAD_RETRIES - 1:
+                    raise
+
+        with self._lock:
+            self._loaded[collection_name] = loaded
+
+        return loaded
+
+    def _load_arrays(self, collection_name, meta):
+        version = meta["version"]
+        loaded = dict(meta=meta)
+
+        if meta["count"]:
+            loaded["vectors"] = np.load(self._array_path(
+                collection_name, "vectors", version), mmap_mode="r")
+            loaded["ids"] = np.load(self._array_path(
+                collection_name, "ids", version), mmap_mode="r")
+            loaded["partitions"] = np.load(self._array_path(
+                collection_name, "partitions", version), mmap_mode="r")
+        else:
+            loaded["vectors"] = np.empty((0, meta["dim"]), dtype=np.float32)
+            loaded["ids"] = np.empty(0, dtype=np.int64)
+            loaded["partitions"] = np.empty(0, dtype=np.int32)
+
+        quantization = meta.get("quantization")
+        if quantization is not None and meta["count"]:
+            names = QUANTIZED_ARRAYS[quantization["type"]] + \
+                self._shared_array_names(dict(quantization=quantization))
+            loaded["quantized"] = QuantizedVectors(quantization, {
+                name: np.load(self._array_path(collection_name, name, version), mmap_mode="r") for name in names}, meta["dim"])
+
+        loaded["id_order"] = np.argsort(loaded["ids"], kind="stable")
+        loaded["sorted_ids"] = np.asarray(loaded["ids"])[loaded["id_order"]]
+
+        if meta.get("index") is not None and meta["count"]:
+            assignments = np.load(self._array_path(
+                collection_name, "ivf_assignments", version))
+            loaded["ivf_centroids"] = np.load(self._array_path(
+                collection_name, "ivf_centroids", version))
+            loaded["ivf_order"] = np.argsort(assignments, kind="stable")
+            loaded["ivf_offsets"] = np.concatenate([[0], np.cumsum(np.bincount(
+                assignments, minlength=len(loaded["ivf_centroids"])))])
+
+        return loaded
+
+    def count(self, collection_name):
+        return self.read_meta(collection_name)["count"]
+
+    def describe(self, collection_name):
+        meta = self.read_meta(collection_name)
+
+        return dict(count=meta["count"], dim=meta["dim"],
+                    partitions=meta["partitions"], version=meta["version"], index=meta.get("index"),
+                    quantization=meta.get("quantization"))
+
+    def list_ids(self, collection_name, partition_tag=None):
+        loaded = self._load(collection_name)
+        ids = np.asarray(loaded["ids"])
+
+        if partition_tag is not None:
+            partitions = loaded["meta"]["partitions"]
+            if partition_tag not in partitions:
+                return []
+            ids = ids[np.asarray(loaded["partitions"]) ==
+                      partitions.index(partition_tag)]
+
+        return ids.tolist()
+
+    def get_vectors(self, collection_name, ids):
+        loaded = self._load(collection_name)
+        ids = np.asarray(ids, dtype=np.int64)
+        sorted_ids = loaded["sorted_ids"]
+
+        if len(sorted_ids) == 0:
+            return [None] * len(ids)
+
+        pos = np.searchsorted(sorted_ids, ids).clip(max=len(sorted_ids) - 1)
+        found = sorted_ids[pos] == ids
+        rows = loaded["id_order"][pos]
+
+        return [np.array(loaded["vectors"][row]) if is_found else None
+                for row, is_found in zip(rows, found)]
+
+    def search(self, collection_name, query_vecs, topk, metric_type="IP", params=None):
+        loaded = self._load(collection_name)
+        query_vecs = np.asarray(query_vecs, dtype=np.float32).reshape(
+            -1, loaded["meta"]["dim"])
+        ids = loaded["ids"]
+        params = dict(params or {})
+        rerank = params.pop("rerank", None)
+
+        # The quantized vectors are scanned for `rerank * topk` candidates.
+        vectors = loaded.get("quantized")
+        if vectors is not None:
+            rerank = rerank or get_rerank_factor(
+                loaded["meta"]["quantization"])
+            candidates = topk * max(int(rerank), 1)
+        else:
+            vectors = loaded["vectors"]
+            candidates = topk
+            rerank = None
+
+        if "ivf_centroids" in loaded and loaded["meta"]["count"] > BRUTE_FORCE_MAX_ROWS:
+            results = self._ivf_search(
+                loaded, vectors, query_vecs, candidates, metric_type, params)
+        else:
+            results = _brute_force_search(
+                vectors, ids, query_vecs, candidates, metric_type=metric_type)
+
+        if rerank:
+            results = self.rerank(
+                collection_name, query_vecs, results, topk, metric_type=metric_type)
+
+        return results
+
+    def _ivf_search(self, loaded, vectors, query_vecs, topk, metric_type, params):
+        centroids = loaded["ivf_centroids"]
+        nprobe = min(int(params.get(
+            "nprobe", loaded["meta"]["index"]["params"].get("nprobe", 16))), len(centroids))
+        order = loaded["ivf_order"]
+        offsets = loaded["ivf_offsets"]
+
+        dist = (centroids ** 2).sum(axis=1).reshape(1, -1) - \
+            2 * (query_vecs @ centroids.T)
+        probes = np.argsort(dist, axis=1)[:, :nprobe]
+
+        results = []
+        for query_vec, probe in zip(query_vecs, probes):
+            rows = np.sort(np.concatenate(
+                [order[offsets[p]: offsets[p + 1]] for p in probe]))
+            results.extend(_brute_force_search(
+                vectors, loaded["ids"], query_vec.reshape(1, -1),
+                topk, metric_type=metric_type, rows=rows))
+
+        return results
+
+    def create_index(self, collection_name, index_type, params=None):
+        '''Builds an IVF_FLAT index for the collection. The coarse quantizer
+        is trained on a sample of the stored vectors.
+
+        The index is written as a new version of the collection. The arrays
+        of the current version are left untouched for the readers using it.
+        '''
+        if index_type != "IVF_FLAT":
+            raise ValueError(
+                f"Index type `{index_type}` is not supported by the local vector store.")
+
+        params = dict(params or {})
+
+        with self._write_lock(collection_name):
+            meta = self.read_meta(collection_name)
+            version = meta["version"]
+            new_version = version + 1
+
+            if not meta["count"]:
+                return
+
+            vectors = np.load(self._array_path(
+                collection_name, "vectors", version), mmap_mode="r")
+
+            nlist = min(int(params.get("nlist", 1024)), len(vectors))
+            params["nlist"] = nlist
+
+            sample = _sample_rows(vectors, min(len(vectors), 256 * nlist))
+
+            centroids = _kmeans(sample, nlist).astype(np.float32)
+            assignments = _assign(vectors, centroids)
+
+            self._save_array(collection_name, "ivf_centroids",
+                             new_version, centroids)
+            self._save_array(collection_name, "ivf_assignments",
+                             new_version, assignments)
+            written = {"ivf_centroids", "ivf_assignments"}
+
+            if (meta.get("quantization") or {}).get("type") == "pq":
+                # Retrain the codebooks on the whole collection.
+                written.update(self._encode_pq(
+                    collection_name, meta, vectors, sample, new_version))
+
+            meta["index"] = dict(index_type=index_type, params=params)
+
+            for name in self._row_array_names(meta) + self._shared_array_names(meta):
+                if name not in written:
+                    self._link_array(collection_name, name, version, new_version)
+
+            # Publish the new version before removing the arrays of the old one.
+            meta["version"] = new_version
+            self._write_meta(collection_name, meta)
+            self._remove_stale_arrays(collection_name, new_version)
+
+    def _encode_pq(self, collection_name, meta, vectors, sample, version):
+        '''Trains the codebooks of the product quantization on `sample` and
+        writes the codebooks and the codes of `vectors` under `version`.
+        Returns the names of the arrays written.
+        '''
+        quantization = meta["quantization"]
+        codebooks = _train_pq(sample, quantization["m"])
+        self._save_array(collection_name, "pq_codebooks", version, codebooks)
+
+        codes = np.concatenate([
+            _encode(quantization, vectors[start: start + SEARCH_BLOCK_SIZE], codebooks)["codes"]
+            for start in range(0, len(vectors), SEARCH_BLOCK_SIZE)])
+        self._save_array(collection_name, "codes", version, codes)
+
+        meta["pq_trained_on"] = len(sample)
+
+        return {"pq_codebooks", "codes"}
+
+    def train_quantizer(self, collection_name):
+        '''Retrains the codebooks of the product quantization on a sample of
+        the collection and re-encodes the vectors. Skipped if the codebooks
+        were trained on at least half of the vectors that the sample holds.
+        '''
+        with self._write_lock(collection_name):
+            meta = self.read_meta(collection_name)
+
+            if (meta.get("quantization") or {}).get("type") != "pq" or not meta["count"]:
+                return False
+
+            sample_size = min(meta["count"], PQ_TRAIN_SIZE)
+            if 2 * meta.get("pq_trained_on", 0) >= sample_size:
+                return False
+
+            version = meta["version"]
+            new_version = version + 1
+
+            vectors = np.load(self._array_path(
+                collection_name, "vectors", version), mmap_mode="r")
+            written = self._encode_pq(
+                collection_name, meta, vectors, _sample_rows(vectors, sample_size), new_version)
+
+            for name in self._row_array_names(meta) + self._shared_array_names(meta):
+                if name not in written:
+                    self._link_array(collection_name, name, version, new_version)
+
+            meta["version"] = new_version
+            self._write_meta(collection_name, meta)
+            self._remove_stale_arrays(collection_name, new_version)
+
+            return True
+
+    def drop_index(self, collection_name):
+        with self._write_lock(collection_name):
+            meta = self.read_meta(collection_name)
+
+            if meta.get("index") is None:
+                return
+
+            meta["index"] = None
+
+            # Bump the version so that readers drop the index.
+            version = meta["version"] + 1
+            if meta["count"]:
+                for name in self._row_array_names(meta) + self._shared_array_names(meta):
+                    self._link_array(collection_name, name, meta["version"], version)
+
+            meta["version"] = version
+            self._write_meta(collection_name, meta)
+            self._remove_stale_arrays(collection_name, version)
+
+
+def get_vector_store(backend=None):
+    '''Returns the vector store for the configured backend.
+    '''
+    global _VECTOR_STORE
+
+    backend = backend or VECTOR_STORE_BACKEND
+
+    if backend == "milvus":
+        if not isinstance(_VECTOR_STORE, MilvusVectorStore):
+            _VECTOR_STORE = MilvusVectorStore()
+    elif backend == "local":
+        if not isinstance(_VECTOR_STORE, LocalVectorStore):
+            _VECTOR_STORE = LocalVectorStore()
+    else:
+        raise ValueError(
+            f"Unknown vector store backend: `{backend}`. Accepted values: `milvus` and `local`...")
+
+    return _VECTOR_STORE
@@ -1,10 +1,12 @@
 '''This module implements the word2vec model service that is responsible
 for training the model as well as a backend interface for the API.
 '''
-from functools import partial, lru_cache
+from contextlib import nullcontext
 import os
 import gc
 import json
+import uuid
+import shutil
 import logging
 from pathlib import Path
 import pickle
@@ -17,10 +19,6 @@ from contexttimer import Timer
 import joblib
 from joblib import delayed, Parallel
 
-from sklearn.metrics.pairwise import cosine_similarity, euclidean_distances
-
-from milvus import DataType
-
 from wb_cleaning.cleaning import stopwords
 from wb_cleaning.processing.corpus import MultiDirGenerator, replace_phrases
 from wb_cleaning.utils.scripts import (
@@ -32,19 +30,34 @@ from wb_cleaning.utils.scripts import (
 )
 
 from wb_nlp.interfaces.milvus import (
-    get_milvus_client,
-    get_collection_ids,
-    get_embedding_dsl,
     get_hex_id,
     get_int_id,
 )
+from wb_nlp.interfaces.vector_store import get_vector_store
+from wb_nlp.interfaces.collection_catalog import get_collection_catalog
+from wb_nlp.interfaces.index_manager import (
+    IndexManager, SEARCH_PARAMS, load_index_config, save_index_config)
+from wb_nlp.interfaces.doc_topic_store import DocTopicStore, build_doc_topic_store_from_es
 from wb_nlp.interfaces import mongodb, elasticsearch
 from wb_nlp.types.models import ModelRunInfo, ModelTypes
 from wb_nlp import dir_manager
 from wb_nlp.utils.scripts import (
     get_cleaner,
+    file_lock,
 )
-from wb_nlp import live_cache
+from wb_nlp.utils.result_cache import get_result_cache, hash_text
+from wb_nlp.utils.similarity import SimilarityKernel, normalize_rows
+from wb_nlp.utils.manifest import DocsManifest, get_file_hash, WRITTEN, FAILED
+from wb_nlp.interfaces.doc_id_map import get_doc_id_map
+from wb_nlp.interfaces.neighbor_table import NeighborTable
+
+# Arrays larger than this (in bytes) are stored as separate .npy files in the
+# serving copy of the models so that they can be memory-mapped.
+SERVING_SEP_LIMIT = 1024 * 1024
+
+# Arrays exported with the serving copy of the models: the word vectors used
+# by the similarity queries, their L2-normalized copy, and the vocabulary.
+SERVING_ARRAYS = ["word_vectors.npy", "word_vectors_norm.npy", "index2word.npy"]
 
 
 def read_text_file(fname):
@@ -66,12 +79,20 @@ class BaseModel:
         model_run_info_id=None,
         raise_empty_doc_status=True,
         log_level=logging.INFO,
+        read_only=False,
     ):
         configure_logger(log_level)
         self.log_level = log_level
         self.logger = logging.getLogger(__file__)
         self.trainable = False
 
+        # In read-only mode, the model is loaded from its memory-mapped serving
+        # copy and nothing is written to the databases or the vector store.
+        if read_only and model_run_info_id is None:
+            raise ValueError(
+                "A `model_run_info_id` is required to load a model in read-only mode...")
+        self.read_only = read_only
+
         self.model_class = model_class  # Example: LdaMulticore
         self.model_config_type = model_config_type  # Example: LDAModelConfig
         self.expected_model_name = expected_model_name
@@ -94,6 +115,7 @@ class BaseModel:
 
         self.model = None
         self.mallet_model = None
+        self.similarity_kernel = None
         self.raise_empty_doc_status = raise_empty_doc_status
 
         # # Try to load the model
@@ -101,8 +123,11 @@ class BaseModel:
         self.load()
         self.set_model_specific_attributes()
 
-        self.logger.info("Creating milvus collection...")
-        self.create_milvus_collection()
+        if self.read_only:
+            self.milvus_vector_field_name = "embedding"
+        else:
+            self.logger.info("Creating vector store collection...")
+            self.create_milvus_collection()
 
         self.doc_topic_meta_fields = [
             "adm_region", "country", "corpus", "date_published",
@@ -130,37 +155,41 @@ class BaseModel:
     def create_milvus_collection(self):
         self.milvus_vector_field_name = "embedding"
 
-        self.collection_params = {
-            "fields": [
-                {"name": self.milvus_vector_field_name, "type": DataType.FLOAT_VECTOR,
-                    "params": {"dim": self.dim}},
-            ],
-            "segment_row_limit": 4096,
-            "auto_id": False
-        }
-
-        if self.model_collection_id not in get_milvus_client().list_collections():
-            get_milvus_client().create_collection(
-                self.model_collection_id, self.collection_params)
+        vector_store = get_vector_store()
+        if not vector_store.has_collection(self.model_collection_id):
+            vector_store.create_collection(
+                self.model_collection_id, self.dim, quantization=self.get_quantization())
 
     def drop_milvus_collection(self):
-        if self.model_collection_id in get_milvus_client().list_collections():
-            get_milvus_client().drop_collection(self.model_collection_id)
+        get_vector_store().drop_collection(self.model_collection_id)
+        self.get_index_config_file().unlink(missing_ok=True)
+        shutil.rmtree(self.model_dir / "neighbors", ignore_errors=True)
+        self.bump_collection_version()
+
+        # The manifest tracks the content of the collection so it must be removed as well.
+        self.get_docs_manifest().reset()
+
+    def get_docs_manifest(self):
+        return DocsManifest(
+            self.model_dir / f"{self.model_collection_id}-docs_manifest.sqlite")
 
     def get_doc_id_from_int_id(self, int_id):
-        return live_cache.DOCS_INT_ID_TO_ID[int_id]
-        # # es_nlp_doc_metadata_collection = mongodb.get_es_nlp_doc_metadata_collection()
+        return get_doc_id_map().get_doc_id(int_id)
 
-        # res = es_nlp_doc_metadata_collection.find_one(
-        #     {"int_id": int_id}, projection=["id"])
-        # return res["id"]
+    def get_doc_ids_from_int_ids(self, int_ids):
+        return get_doc_id_map().get_doc_ids(int_ids)
 
     def get_int_id_from_doc_id(self, doc_id):
-        es_nlp_doc_metadata_collection = mongodb.get_es_nlp_doc_metadata_collection()
+        return get_doc_id_map().get_int_id(doc_id)
+
+    def set_payload_doc_ids(self, payload):
+        # The results of the vector index have the `int_id` of the documents.
+        doc_ids = self.get_doc_ids_from_int_ids([p["id"] for p in payload])
 
-        res = es_nlp_doc_metadata_collection.find_one(
-            {"id": doc_id}, projection=["int_id"])
-        return res["int_id"]
+        for p, doc_id in zip(payload, doc_ids):
+            p["id"] = doc_id
+
+        return payload
 
     def set_processed_corpus_id(self):
         # Generate an identifier corresponding to the processed data.
@@ -409,7 +438,7 @@ class BaseModel:
             self.set_model_word_vectors()
 
     def save_model(self):
-        if not self.trainable:
+        if self.read_only or not self.trainable:
             self.log("Model state is set to trainable=False and can't be saved!")
             return
 
@@ -453,49 +482,180 @@ class BaseModel:
             self.model = None
             return
 
-        model_file_name = str(self.model_file_name)
+        if self.read_only:
+            self.load_serving_model()
+            return
 
         try:
-            self.logger.info("Actually loading model...")
-            self.model = self.model_class.load(model_file_name)
-            self.logger.info("Model loaded...")
+            self.load_full_model()
 
-            # model_runs_info_collection = mongodb.get_model_runs_info_collection()
-            # assert model_runs_info_collection.find_one({"_id": self.model_run_info["model_run_info_id"]}), "Trained model present but `model_run_info` not in db, aborting load... Options: You can delete the model and retrain. Alternatively, if `model_run_info` is stored available, please make sure to upload it in the correct collection. Also note that the Milvus table must exist!"
+            # Force save model to also update the `model_run_info` on db.
+            self.save_model()
+            # self.set_model_word_vectors()
 
-            if self.model_name in [ModelTypes.lda.value, ModelTypes.mallet.value]:
+        except FileNotFoundError:
+            self.model = None
 
-                self.g_dict = Dictionary()
-                self.g_dict.id2token = self.model.id2word
-                self.g_dict.token2id = {k: v for v,
-                                        k in self.g_dict.id2token.items()}
+    def load_full_model(self):
+        model_file_name = str(self.model_file_name)
 
-                if self.model_name == ModelTypes.mallet.value:
-                    self.mallet_model = self.model
+        self.logger.info("Actually loading model...")
+        self.model = self.model_class.load(model_file_name)
+        self.logger.info("Model loaded...")
 
-                    self.model = malletmodel2ldamodel(
-                        self.model, iterations=self.model.iterations)
+        # model_runs_info_collection = mongodb.get_model_runs_info_collection()
+        # assert model_runs_info_collection.find_one({"_id": self.model_run_info["model_run_info_id"]}), "Trained model present but `model_run_info` not in db, aborting load... Options: You can delete the model and retrain. Alternatively, if `model_run_info` is stored available, please make sure to upload it in the correct collection. Also note that the Milvus table must exist!"
 
-            # Force save model to also update the `model_run_info` on db.
-            self.save_model()
-            # self.set_model_word_vectors()
+        if self.model_name in [ModelTypes.lda.value, ModelTypes.mallet.value]:
+            self.set_g_dict()
+
+            if self.model_name == ModelTypes.mallet.value:
+                self.mallet_model = self.model
+
+                self.model = malletmodel2ldamodel(
+                    self.model, iterations=self.model.iterations)
+
+    def set_g_dict(self):
+        self.g_dict = Dictionary()
+        self.g_dict.id2token = self.model.id2word
+        self.g_dict.token2id = {k: v for v,
+                                k in self.g_dict.id2token.items()}
+
+    def get_serving_model_file_name(self):
+        return self.model_dir / "serving" / f"{self.model_collection_id}.model"
+
+    def get_serving_model_class(self):
+        # The serving copy of a mallet model is the converted gensim LdaModel.
+        if self.model_name == ModelTypes.mallet.value:
+            return gensim.models.LdaModel
+
+        return self.model_class
+
+    def is_serving_model_stale(self):
+        serving_file_name = self.get_serving_model_file_name()
+
+        if not serving_file_name.exists():
+            return True
+
+        if not all((serving_file_name.parent / name).exists() for name in SERVING_ARRAYS):
+            return True
+
+        return serving_file_name.stat().st_mtime < self.model_file_name.stat().st_mtime
+
+    def export_serving_model(self):
+        """
+        This method saves an uncompressed copy of the trained model where the large arrays are stored as
+        separate .npy files that can be memory-mapped. The worker processes of the API that load the
+        same model share the pages of these arrays instead of each holding a copy.
+        """
+        serving_dir = self.get_serving_model_file_name().parent
+
+        with file_lock(self.model_dir / ".serving.lock"):
+            if not self.is_serving_model_stale():
+                return
+
+            if self.model is None:
+                self.load_full_model()
+
+            tmp_dir = serving_dir.with_name(f"{serving_dir.name}.{os.getpid()}.tmp")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            tmp_dir.mkdir(parents=True)
+
+            self.model.save(
+                str(tmp_dir / self.get_serving_model_file_name().name),
+                sep_limit=SERVING_SEP_LIMIT)
+
+            word_vectors, index2word = self.compute_model_word_vectors()
+            np.save(tmp_dir / "word_vectors.npy", word_vectors)
+            np.save(tmp_dir / "word_vectors_norm.npy",
+                    normalize_rows(word_vectors))
+            np.save(tmp_dir / "index2word.npy", np.array(index2word, dtype=str))
+
+            # Open memory maps of the replaced copy stay valid after the files are removed.
+            if serving_dir.exists():
+                old_dir = serving_dir.with_name(
+                    f"{serving_dir.name}.{os.getpid()}.old")
+                os.replace(serving_dir, old_dir)
+                shutil.rmtree(old_dir, ignore_errors=True)
+
+            os.replace(tmp_dir, serving_dir)
 
-        except FileNotFoundError:
             self.model = None
+            self.mallet_model = None
+            gc.collect()
+
+    def load_serving_model(self):
+        if self.is_serving_model_stale():
+            self.logger.info("Exporting the serving copy of the model...")
+            self.export_serving_model()
+
+        serving_file_name = self.get_serving_model_file_name()
+
+        self.logger.info(f"Loading serving model: {serving_file_name}")
+        self.model = self.get_serving_model_class().load(
+            str(serving_file_name), mmap="r")
+        self.logger.info("Model loaded...")
 
-    def set_model_word_vectors(self):
         if self.model_name in [ModelTypes.lda.value, ModelTypes.mallet.value]:
+            self.set_g_dict()
 
-            self.word_vectors = self.model.expElogbeta
-            self.word_vectors = self.word_vectors / \
-                (1e-10 + self.word_vectors.sum(axis=0))
+    def compute_model_word_vectors(self):
+        if self.model_name in [ModelTypes.lda.value, ModelTypes.mallet.value]:
+
+            word_vectors = self.model.expElogbeta
+            word_vectors = word_vectors / \
+                (1e-10 + word_vectors.sum(axis=0))
 
-            self.word_vectors = self.word_vectors.T
-            self.index2word = self.model.id2word
+            word_vectors = word_vectors.T
+            index2word = [self.model.id2word[i]
+                          for i in range(len(self.model.id2word))]
 
         elif self.model_name == ModelTypes.word2vec.value:
+            word_vectors = self.model.wv.vectors
+            index2word = self.model.wv.index2word
+
+        return np.ascontiguousarray(word_vectors, dtype=np.float32), index2word
+
+    def set_model_word_vectors(self):
+        self.similarity_kernel = None
+
+        if self.read_only:
+            self.attach_model_word_vectors()
+        else:
+            self.word_vectors, self.index2word = self.compute_model_word_vectors()
+            self.word_vectors_norm = normalize_rows(self.word_vectors)
+
+        if self.model_name == ModelTypes.word2vec.value:
+            # Prevent gensim from computing its own normalized copy of the vectors.
+            self.model.wv.vectors_norm = self.word_vectors_norm
+
+    def attach_model_word_vectors(self):
+        """
+        This method memory-maps the word vectors exported with the serving copy of the model.
+        The pages are shared by all the processes that attach to the same model.
+        """
+        serving_dir = self.get_serving_model_file_name().parent
+
+        if self.model_name == ModelTypes.word2vec.value:
+            # Same content as the exported file and already memory-mapped with the model.
             self.word_vectors = self.model.wv.vectors
-            self.index2word = self.model.wv.index2word
+        else:
+            self.word_vectors = np.load(
+                serving_dir / "word_vectors.npy", mmap_mode="r")
+        self.word_vectors_norm = np.load(
+            serving_dir / "word_vectors_norm.npy", mmap_mode="r")
+        self.index2word = np.load(
+            serving_dir / "index2word.npy", mmap_mode="r")
+
+    def get_similarity_kernel(self):
+        if self.similarity_kernel is None:
+            noise_mask = np.array(
+                [word in stopwords.noise_words for word in self.index2word], dtype=bool)
+
+            self.similarity_kernel = SimilarityKernel(
+                self.word_vectors, vectors_norm=self.word_vectors_norm, exclude_mask=noise_mask)
+
+        return self.similarity_kernel
 
     def get_model_params(self):
         params = dict(self.model_config[f"{self.model_name}_config"])
@@ -553,9 +713,7 @@ class BaseModel:
             raise ValueError('Model not trained!')
 
     def check_wvecs(self):
-        collection_doc_ids = get_collection_ids(self.model_collection_id)
-
-        if len(collection_doc_ids) == 0:
+        if not get_collection_catalog().is_ready(self.model_collection_id, version=self.get_collection_version()):
             raise ValueError('Document vectors not available!')
 
     def transform_doc(self, document, normalize=True, tolist=False):
@@ -568,17 +726,39 @@ class BaseModel:
         self.check_model()
         return dict(doc_vec=None, success=None)
 
+    def transform_docs_batch(self, texts, normalize=True):
+        """
+        This method converts a list of cleaned texts into a matrix of document vectors.
+        It returns a tuple of a numpy array of shape (len(texts), self.dim) and a boolean
+        array indicating whether the transformation of each text went successfully.
+
+        Models should override this with a vectorized implementation. The default
+        implementation falls back to calling `transform_doc` for each text.
+        """
+        doc_vecs = np.zeros((len(texts), self.dim))
+        success = np.zeros(len(texts), dtype=bool)
+
+        for ix, text in enumerate(texts):
+            payload = self.transform_doc(text, normalize=normalize)
+            doc_vecs[ix] = payload["doc_vec"].flatten()
+            success[ix] = payload["success"]
+
+        return doc_vecs, success
+
     def transform_docs(self, docs, normalize=True, tolist=False):
         """
         This method accepts a dataframe as input that must contain a `phrase_text` column.
         It will expand the dataframe to include derived columns, namely, `doc_vec` and `success`.
         """
-        p_transform_doc = partial(
-            self.transform_doc, normalize=normalize, tolist=tolist)
-        cols = ["doc_vec", "success"]
+        doc_vecs, success = self.transform_docs_batch(
+            docs["phrase_text"].tolist(), normalize=normalize)
+
+        if tolist:
+            docs["doc_vec"] = doc_vecs.tolist()
+        else:
+            docs["doc_vec"] = [doc_vec.reshape(1, -1) for doc_vec in doc_vecs]
 
-        docs[cols] = docs["phrase_text"].map(
-            p_transform_doc).apply(pd.Series)[cols]
+        docs["success"] = success
 
         return docs
 
@@ -610,15 +790,18 @@ class BaseModel:
         return self.transform_docs(docs, normalize=normalize)
 
     def normalize_vectors(self, vectors):
-        return [doc_vec / np.linalg.norm(doc_vec, ord=2) for doc_vec in vectors]
+        vectors = np.asarray(vectors)
+        return vectors / np.linalg.norm(vectors, ord=2, axis=1, keepdims=True)
 
     def build_docs_group(self, docs, is_topic_model, group_id, max_group, collection_name, partition_group):
-        milvus_client = get_milvus_client()
+        vector_store = get_vector_store()
         normalize = not is_topic_model
 
         print(f"Loading group {group_id + 1} / {max_group + 1}...")
-        docs["text"] = docs.apply(
-            lambda _doc: read_text_file(self.cleaned_docs_dir / _doc["corpus"] / f"{_doc['id']}.txt"), axis=1)
+        docs["path"] = docs.apply(
+            lambda _doc: self.cleaned_docs_dir / _doc["corpus"] / f"{_doc['id']}.txt", axis=1)
+        docs["text"] = docs["path"].map(read_text_file)
+        content_hashes = dict(zip(docs["id"], docs["path"].map(get_file_hash)))
 
         docs["_l"] = docs["text"].map(len)
         docs = docs.sort_values("_l")
@@ -632,21 +815,22 @@ class BaseModel:
         self.log(
             f"Finished reading {len(docs)} files, starting vector generation...")
 
-        results = self.process_docs(docs, normalize=normalize)
+        doc_vecs, success = self.transform_docs_batch(
+            docs["text"].map(replace_phrases).tolist(), normalize=normalize)
 
         print(f"{group_id + 1}. Finished vector generation, storing vectors to db...")
 
-        results = [(ix, p['doc_vec'].flatten())
-                   for ix, (_, p) in enumerate(results.iterrows()) if p['success']]
+        manifest = self.get_docs_manifest()
+        manifest.mark_written(
+            docs[~success]["id"].tolist(), vector_written=FAILED,
+            topics_written=FAILED, content_hashes=content_hashes)
 
-        if len(results) == 0:
+        if not success.any():
             return False
 
-        locs, vectors = list(zip(*results))
-        doc_int_ids = docs.iloc[list(
-            locs)]['int_id'].tolist()
-        doc_ids = docs.iloc[list(
-            locs)]['id'].tolist()
+        vectors = doc_vecs[success]
+        doc_int_ids = docs[success]['int_id'].tolist()
+        doc_ids = docs[success]['id'].tolist()
 
         # If LDA model, dump topics in mongodb document_topics collection.
         if is_topic_model:
@@ -673,6 +857,9 @@ class BaseModel:
                               ["id"]].set_index("id").T.to_dict(),
                 ignore_existing=False)
 
+            DocTopicStore(self.model_run_info['model_run_info_id']).write_shard(
+                doc_ids, vectors)
+
             # for doc_id, topic_list in zip(doc_ids, vectors):
             #     topics = {f"topic_{topic_id}": value for topic_id, value in enumerate(topic_list)}
 
@@ -681,22 +868,26 @@ class BaseModel:
             #         topics=topics,
             #         model_run_info_id=self.model_run_info['model_run_info_id'])
 
-        entities = [
-            {"name": self.milvus_vector_field_name, "values": self.normalize_vectors(vectors) if is_topic_model else vectors,
-                "type": DataType.FLOAT_VECTOR},
-        ]
-
-        if not milvus_client.has_partition(collection_name, partition_group):
-            milvus_client.create_partition(
-                collection_name, partition_group)
-
-        ids = milvus_client.insert(collection_name, entities,
-                                   doc_int_ids, partition_tag=partition_group)
+        ids = vector_store.insert(
+            collection_name,
+            self.normalize_vectors(vectors) if is_topic_model else vectors,
+            doc_int_ids, partition_tag=partition_group)
 
         assert len(set(ids).difference(
             doc_int_ids)) == 0
 
-        milvus_client.flush([collection_name])
+        if not vector_store.supports_deferred_flush:
+            # The inserts are buffered in this process.
+            vector_store.flush(collection_name)
+
+        manifest.mark_written(
+            doc_ids, vector_written=WRITTEN,
+            topics_written=WRITTEN if is_topic_model else None,
+            content_hashes=content_hashes)
+
+        progress = manifest.get_progress()
+        print(
+            f"{group_id + 1}. Stored {len(doc_ids)} vectors. Manifest progress: {progress['written']} / {progress['total']} written, {progress['failed']} failed...")
 
         return True
 
@@ -709,44 +900,109 @@ class BaseModel:
 
         es_nlp_doc_metadata_collection = mongodb.get_es_nlp_doc_metadata_collection()
 
-        milvus_client = get_milvus_client()
+        vector_store = get_vector_store()
         collection_name = self.model_collection_id
 
-        if collection_name not in milvus_client.list_collections():
-            milvus_client.create_collection(
-                collection_name, self.collection_params)
+        if not vector_store.has_collection(collection_name):
+            vector_store.create_collection(
+                collection_name, self.dim, quantization=self.get_quantization())
 
-        collection_doc_ids = list(set(get_collection_ids(collection_name)))
+        is_topic_model = self.model_name in [
+            ModelTypes.lda.value, ModelTypes.mallet.value]
 
-        projection = ["id", "int_id", "hex_id", "corpus"]
-        projection = [
-            i for i in projection if i not in self.doc_topic_meta_fields] + self.doc_topic_meta_fields
+        # The manifest tracks which cleaned documents were already processed so
+        # that only the new or changed documents are loaded from the db and embedded.
+        manifest = self.get_docs_manifest()
+        collection_size = vector_store.count(collection_name)
 
-        cleaned_ids = [i.stem for i in self.cleaned_docs_dir.glob("*/*.txt")]
+        if collection_size == 0 and manifest.get_progress()["written"] > 0:
+            self.log(
+                "Warning: The collection is empty but the manifest is not. Resetting the manifest...")
+            manifest.reset()
 
-        docs_metadata_df = pd.DataFrame(
-            list(es_nlp_doc_metadata_collection.find(projection=projection)), columns=projection)
+        bootstrap = manifest.is_empty()
 
-        docs_for_processing = docs_metadata_df[
-            (~docs_metadata_df['int_id'].isin(collection_doc_ids)) & docs_metadata_df["id"].isin(cleaned_ids)]
+        with Timer() as timer:
+            delta = manifest.sync(self.cleaned_docs_dir)
 
         print(
-            f"Collection size: {len(collection_doc_ids)}\nCleaned ids count: {len(cleaned_ids)}\ndocs_metadata_df size: {docs_metadata_df.shape[0]}")
+            f"Manifest sync found {len(delta['new'])} new, {len(delta['changed'])} changed, and {len(delta['removed'])} removed documents in {timer.elapsed:.2f}s...")
+
+        if delta["removed_int_ids"] and collection_size > 0:
+            # The cleaned documents were deleted, their vectors must not be returned by the searches.
+            vector_store.delete(collection_name, delta["removed_int_ids"])
+
+        manifest.remove(delta["removed"])
+
+        missing_ids = manifest.get_missing_int_ids()
+        id_to_int_id = {}
+        for start in range(0, len(missing_ids), 10000):
+            batch_ids = missing_ids[start: start + 10000]
+            id_to_int_id.update(
+                (doc_id, int_id) for doc_id, int_id in zip(batch_ids, self.get_int_ids_from_doc_ids(batch_ids))
+                if int_id is not None)
+
+        manifest.set_int_ids(id_to_int_id)
+
+        if bootstrap and collection_size > 0:
+            # Collection built before the manifest was available.
+            # The documents already in the collection are considered processed.
+            manifest.mark_existing(
+                vector_store.list_ids(collection_name), with_topics=is_topic_model)
+
+        if is_topic_model and collection_size > 0 and not DocTopicStore(self.model_run_info["model_run_info_id"]).exists():
+            # Topics built before the doc-topic store was available.
+            print("Materializing the doc-topic store from elasticsearch...")
+            build_doc_topic_store_from_es(
+                self.model_run_info["model_run_info_id"], self.dim)
+
+        pending = manifest.get_pending(with_topics=is_topic_model)
+        progress = manifest.get_progress()
+        written_before = progress["written"]
+
         print(
-            f"Sample milvus_ids: {collection_doc_ids[:10]}\nSample clean_ids: {cleaned_ids[:10]}")
+            f"Collection size: {collection_size}\nManifest size: {progress['total']}\nWritten: {progress['written']}\nFailed: {progress['failed']}\nPending: {len(pending)}")
+
+        if not pending:
+            if is_topic_model:
+                self.update_doc_topic_store()
+            return
+
+        pending_ids = [doc_id for doc_id, _, _ in pending]
+
+        if collection_size > 0:
+            # Remove the vectors of changed documents as well as those from
+            # groups interrupted before the manifest got updated.
+            vector_store.delete(
+                collection_name, [int_id for _, int_id, _ in pending])
+
+        projection = ["id", "int_id", "hex_id", "corpus"]
+        projection = [
+            i for i in projection if i not in self.doc_topic_meta_fields] + self.doc_topic_meta_fields
+
+        docs_metadata = []
+        for start in range(0, len(pending_ids), 10000):
+            docs_metadata.extend(es_nlp_doc_metadata_collection.find(
+                {"id": {"$in": pending_ids[start: start + 10000]}}, projection=projection))
+
+        docs_for_processing = pd.DataFrame(docs_metadata, columns=projection)
 
         dask_client = create_dask_cluster(
             logger=self.logger, n_workers=pool_workers)
 
-        is_topic_model = self.model_name in [
-            ModelTypes.lda.value, ModelTypes.mallet.value]
-
         print(f"IS TOPIC MODEL: {is_topic_model}")
 
         print(f"Processing {docs_for_processing.shape[0]} files...")
 
+        index_manager = self.get_index_manager()
+
+        # Disable the refresh of the topics index while the groups bulk load the topics.
+        refresh_context = elasticsearch.disabled_refresh(
+            elasticsearch.DOC_TOPIC_INDEX) if is_topic_model else nullcontext()
+
         try:
-            with joblib.parallel_backend('dask'):
+            # The collection is flushed once at the end of the load.
+            with joblib.parallel_backend('dask'), refresh_context, index_manager.bulk_load():
                 if not docs_for_processing.empty:
                     # Perform normalization of topic model vectors only when we load them in Milvus.
                     normalize = not is_topic_model
@@ -766,6 +1022,10 @@ class BaseModel:
                         results = Parallel(verbose=10, batch_size='auto')(
                             delayed(self.build_docs_group)(docs, is_topic_model, group_id, max_group, collection_name, partition_group) for group_id, docs in sub_docs.groupby(group_value))
 
+                        progress = manifest.get_progress()
+                        print(
+                            f"Finished corpus {partition_group}. Manifest progress: {progress['written']} / {progress['total']} written, {progress['failed']} failed...")
+
                         # for group_id, sub_sub_docs in sub_docs.groupby(group_value):
                         #     self.log(
                         #         f"Loading group {group_id + 1} / {max_group + 1}...")
@@ -842,62 +1102,158 @@ class BaseModel:
             raise(e)
         finally:
             dask_client.close()
+            self.bump_collection_version()
+
+        # Rebuild the index and the neighbours only if the collection changed.
+        written = manifest.get_progress()["written"] - written_before
+        if written or not index_manager.is_current(self.get_index_config()):
+            self.build_index(index_manager)
+            self.build_neighbor_table()
+
+        if is_topic_model:
+            self.update_doc_topic_store()
+
+    def update_doc_topic_store(self):
+        # Merge the topics written by the groups into the doc-topic matrix of the model.
+        print("Consolidating the doc-topic store...")
+        DocTopicStore(self.model_run_info["model_run_info_id"]).consolidate()
 
-    @lru_cache(maxsize=128)
     def get_doc_vec(self, document, normalize=True, assert_success=True, flatten=True):
+        # The vectors are cached by the content of the document since these don't
+        # change for a given model.
+        doc_vec, success = get_result_cache().get_or_compute(
+            (self.model_id, "doc_vec", hash_text(document), normalize),
+            lambda: self.compute_doc_vec(document, normalize=normalize))
+
+        if assert_success and not success:
+            raise ValueError("Document was mapped to the zero vector!")
+
+        return doc_vec.flatten() if flatten else doc_vec.copy()
+
+    def compute_doc_vec(self, document, normalize=True):
         document = replace_phrases(document)
         doc_vec_payload = self.transform_doc(document, normalize=normalize)
-        doc_vec = doc_vec_payload['doc_vec']
 
-        if assert_success and not doc_vec_payload['success']:
-            raise ValueError("Document was mapped to the zero vector!")
+        return doc_vec_payload['doc_vec'], doc_vec_payload['success']
 
-        return doc_vec.flatten() if flatten else doc_vec
+    def get_collection_version_file(self):
+        return self.model_dir / f"{self.model_collection_id}-collection_version"
 
-    @lru_cache(maxsize=128)
-    def cached_milvus_result(self, document, topk, metric_type="IP"):
-        # print(f"First access for {document}...")
-        with Timer() as timer:
-            print(f"CMR Elapsed 1: {timer.elapsed}")
+    def get_collection_version(self):
+        # The version changes whenever vectors are added to or removed from the collection.
+        # The catalog caches it so that the file is not read on every query.
+        return get_collection_catalog().get_version(
+            self.model_collection_id, self.get_collection_version_file())
+
+    def bump_collection_version(self):
+        version_file = self.get_collection_version_file()
+        version_file.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_file = version_file.with_name(
+            f"{version_file.name}.{os.getpid()}.tmp")
+        tmp_file.write_text(uuid.uuid4().hex)
+        os.replace(tmp_file, version_file)
+
+        get_collection_catalog().invalidate(self.model_collection_id)
+
+    def get_index_config_file(self):
+        return self.model_dir / f"{self.model_collection_id}-index.json"
+
+    def get_index_manager(self):
+        # The type and the parameters of the index can be set in the `model_run_info`.
+        index = self.model_run_info.get("index") or {}
+
+        if index.get("index_type") not in SEARCH_PARAMS:
+            index = {}
+
+        return IndexManager(
+            self.model_collection_id, index_type=index.get("index_type"), index_params=index.get("params"),
+            quantization=self.get_quantization())
+
+    def get_quantization(self):
+        # Optional quantization of the stored vectors set in the `model_run_info`,
+        # e.g., {"type": "int8", "rerank": 4}. Applies to new collections.
+        return self.model_run_info.get("quantization")
+
+    def build_index(self, index_manager=None):
+        # Builds the index of the collection and stores its configuration in the
+        # `model_run_info` and next to the model for the serving workers.
+        index_manager = index_manager or self.get_index_manager()
+        index = index_manager.build(previous=self.get_index_config())
+
+        self.model_run_info["index"] = index
+        mongodb.get_model_runs_info_collection().update_one(
+            {"_id": self.model_run_info["model_run_info_id"]}, {"$set": {"index": index}})
+
+        save_index_config(self.get_index_config_file(), index)
+        self.bump_collection_version()
+
+        return index
+
+    def get_index_config(self):
+        # Reloaded when the collection changes, e.g., after the index is rebuilt.
+        version = self.get_collection_version()
+        cached = getattr(self, "_index_config", None)
+
+        if cached is None or cached[0] != version:
+            config = load_index_config(self.get_index_config_file())
+            cached = (version, config or self.model_run_info.get("index"))
+            self._index_config = cached
+
+        return cached[1]
+
+    def get_search_params(self):
+        index = self.get_index_config()
+
+        return index.get("search_params") if index else None
+
+    def cached_milvus_result(self, document, topk, metric_type="IP", doc_vec=None):
+        # The cache is keyed by the version of the collection so that the results
+        # are invalidated when vectors are added. The `topk` is not part of the key:
+        # a cached result with at least `topk` entries also answers the query.
+        # A precomputed `doc_vec` of the `document` can be passed.
+        cache = get_result_cache()
+        key = (self.model_id, "search", hash_text(document),
+               metric_type, self.get_collection_version())
+
+        cached = cache.get(key)
+        if cached is not None and cached["topk"] >= topk:
+            return cached["entities"][:topk]
+
+        if doc_vec is None:
             doc_vec = self.get_doc_vec(
                 document, normalize=True, assert_success=True, flatten=True)
+        elif not np.any(doc_vec):
+            raise ValueError("Document was mapped to the zero vector!")
 
-            # topk = 1000  # from_result + (2 * size)  # Add buffer
-            # topk = (((from_result + size) // batch_size) + 1) * batch_size
-            # print(f"CMR Elapsed 2: {timer.elapsed}")
-            # dsl = get_embedding_dsl(
-            #     doc_vec, topk, vector_field_name=self.milvus_vector_field_name, metric_type=metric_type)
-            # print(f"CMR Elapsed 3: {timer.elapsed}")
-            # results = get_milvus_client().search(self.model_collection_id, dsl)
-            results = self.search_milvus(
-                doc_vec, topk, vector_field_name=self.milvus_vector_field_name, metric_type="IP")
-
-            print(f"CMR Elapsed 4: {timer.elapsed}")
-            entities = []
-            for position, ent in enumerate(results[0]):
-                entities.append(
-                    dict(
-                        id=ent.id,
-                        distance=ent.distance,
-                        position=position)
-                )
-            print(entities[:10])
+        # topk = 1000  # from_result + (2 * size)  # Add buffer
+        # topk = (((from_result + size) // batch_size) + 1) * batch_size
+        results = self.search_milvus(
+            doc_vec, topk, vector_field_name=self.milvus_vector_field_name, metric_type="IP")
+
+        entities = []
+        for position, ent in enumerate(results[0]):
+            entities.append(
+                dict(
+                    id=ent.id,
+                    distance=ent.distance,
+                    position=position)
+            )
 
-            print(f"CMR Elapsed 4: {timer.elapsed}")
+        cache.set(key, dict(topk=topk, entities=entities))
 
-            return entities
+        return entities
 
     def search_milvus(self, doc_vec, topk, vector_field_name, metric_type="IP"):
 
         # topk = 1000  # from_result + (2 * size)  # Add buffer
         # topk = (((from_result + size) // batch_size) + 1) * batch_size
         # print(f"CMR Elapsed 2: {timer.elapsed}")
-        dsl = get_embedding_dsl(
-            doc_vec, topk, vector_field_name=vector_field_name, metric_type=metric_type)
         # print(f"CMR Elapsed 3: {timer.elapsed}")
-        return get_milvus_client().search(self.model_collection_id, dsl)
+        return get_vector_store().search(
+            self.model_collection_id, doc_vec, topk, metric_type=metric_type, params=self.get_search_params())
 
-    def search_similar_documents(self, document, duplicate_threshold=0.999, show_duplicates=False, serialize=False, metric_type="IP", from_result=0, size=10, batch_size=100):
+    def search_similar_documents(self, document, duplicate_threshold=0.999, show_duplicates=False, serialize=False, metric_type="IP", from_result=0, size=10, batch_size=100, doc_vec=None):
         # document: any text
         # topn: number of returned related documents in the database
         # return_data: string corresponding to a column in the docs or list of column names
@@ -919,7 +1275,7 @@ class BaseModel:
             print(f"SSD Elapsed 1: {timer.elapsed}")
             topk = (((from_result + size) // batch_size) + 1) * batch_size
             entities = self.cached_milvus_result(
-                document, topk=topk, metric_type=metric_type)
+                document, topk=topk, metric_type=metric_type, doc_vec=doc_vec)
 
             print(f"SSD Elapsed 2: {timer.elapsed}")
             payload = []
@@ -934,14 +1290,15 @@ class BaseModel:
                     if ent["distance"] > duplicate_threshold:
                         continue
 
-                payload.append({'id': self.get_doc_id_from_int_id(ent["id"]), 'score': float(np.round(
+                payload.append({'id': ent["id"], 'score': float(np.round(
                     ent["distance"], decimals=5)), 'rank': ent["position"] + 1})
 
                 if len(payload) == size:
                     break
 
             print(f"SSD Elapsed 3: {timer.elapsed}")
-            payload = sorted(payload, key=lambda x: x['rank'])
+            payload = sorted(self.set_payload_doc_ids(
+                payload), key=lambda x: x['rank'])
             if serialize:
                 payload = pd.DataFrame(payload).to_json()
 
@@ -965,114 +1322,248 @@ class BaseModel:
             size=topn,
         )
 
+    def get_int_ids_from_doc_ids(self, doc_ids):
+        return get_doc_id_map().get_int_ids(doc_ids)
+
+    def get_milvus_doc_vectors_by_doc_ids(self, doc_ids):
+        """
+        This method returns the (vectors, success) of the documents in `doc_ids`. The vectors of the
+        documents not found in the vector index are set to zero.
+        """
+        doc_vecs = np.zeros((len(doc_ids), self.dim), dtype=np.float32)
+        success = np.zeros(len(doc_ids), dtype=bool)
+
+        int_ids = self.get_int_ids_from_doc_ids(doc_ids)
+        found = [ix for ix, int_id in enumerate(int_ids) if int_id is not None]
+
+        if found:
+            vectors = get_vector_store().get_vectors(
+                self.model_collection_id, ids=[int_ids[ix] for ix in found])
+
+            for ix, doc_vec in zip(found, vectors):
+                if doc_vec is not None:
+                    doc_vecs[ix] = doc_vec
+                    success[ix] = True
+
+        return doc_vecs, success
+
+    def search_similar_documents_batch(self, documents=None, doc_ids=None, duplicate_threshold=0.999, show_duplicates=False, metric_type="IP", from_result=0, size=10, batch_size=100):
+        """
+        This method is the batch form of `search_similar_documents`. The queries are either the texts in
+        `documents` or the `doc_ids` of documents in the vector index. The vectors of all the queries are
+        computed together and searched in a single request to the vector store.
+
+        Returns a list with a dict(result, success, message) for each query in the input order.
+        """
+        self.check_wvecs()
+
+        if (documents is None) == (doc_ids is None):
+            raise ValueError(
+                "Exactly one of `documents` or `doc_ids` must be provided...")
+
+        if documents is not None:
+            doc_vecs, success = self.transform_docs_batch(
+                [replace_phrases(document) for document in documents], normalize=True)
+            messages = [None if s else "Document was mapped to the zero vector!"
+                        for s in success]
+        else:
+            doc_vecs, success = self.get_milvus_doc_vectors_by_doc_ids(doc_ids)
+            messages = [None if s else f'Document id `{doc_id}` not found in the vector index `{self.model_collection_id}`.'
+                        for doc_id, s in zip(doc_ids, success)]
+
+        topk = (((from_result + size) // batch_size) + 1) * batch_size
+
+        query_entities = [[] for _ in range(len(success))]
+        query_ix = np.flatnonzero(success)
+
+        if len(query_ix):
+            results = get_vector_store().search(
+                self.model_collection_id, doc_vecs[query_ix], topk, metric_type=metric_type, params=self.get_search_params())
+
+            for ix, entities in zip(query_ix, results):
+                query_entities[ix] = entities
+
+        payloads = []
+        for entities, message in zip(query_entities, messages):
+            payload = []
+
+            for position, ent in enumerate(entities):
+                if from_result > position:
+                    continue
+
+                if not show_duplicates:
+                    if ent.distance > duplicate_threshold:
+                        continue
+
+                payload.append({'id': ent.id, 'score': float(np.round(
+                    ent.distance, decimals=5)), 'rank': position + 1})
+
+                if len(payload) == size:
+                    break
+
+            payloads.append(
+                dict(result=payload, success=message is None, message=message))
+
+        # Map the ids of the results of all the queries at once.
+        self.set_payload_doc_ids([p for payload in payloads for p in payload["result"]])
+
+        return payloads
+
     def get_similar_words(self, document, topn=10, serialize=False, metric="cosine_similarity"):
 
-        buffer_topn = 2 * topn
         doc_vec = self.get_doc_vec(
             document, normalize=True, assert_success=True, flatten=False)
 
         # self.log(
         #     f"doc_vec shape: {doc_vec.shape}, word_vectors shape: {self.word_vectors.shape}")
 
-        if cosine_similarity.__name__ == metric:
-            sim = cosine_similarity(doc_vec, self.word_vectors).flatten()
-            argidx = sim.argsort()[-buffer_topn:][::-1]
-        elif euclidean_distances.__name__ == metric:
-            sim = euclidean_distances(doc_vec, self.word_vectors).flatten()
-            argidx = sim.argsort()[:buffer_topn]
-        else:
-            raise ValueError(f"Unknow metric: `{metric}")
-
-        payload = []
-        rank = 1
-        for ix, top_sim_ix in enumerate(argidx, 1):
-            word = self.index2word[top_sim_ix]
-            if word in stopwords.noise_words:
-                continue
-
-            payload.append({"id": int(top_sim_ix), 'word': word, 'score': float(np.round(
-                sim[top_sim_ix], decimals=5)), 'rank': rank})
+        payload = self.get_similar_words_by_vectors(
+            doc_vec, topn=topn, metric=metric)[0]
 
-            rank += 1
-            if rank > topn:
-                break
-
-        payload = sorted(payload, key=lambda x: x['rank'])
         if serialize:
             payload = pd.DataFrame(payload).to_json()
 
         return payload
 
+    def get_similar_words_by_vectors(self, doc_vecs, topn=10, metric="cosine_similarity"):
+        """
+        This method returns the list of similar words for each of the vectors in `doc_vecs`.
+        The similarities of all the vectors are computed in a single matrix product.
+        """
+        indices, scores = self.get_similarity_kernel().top_k(
+            doc_vecs, topk=topn, metric=metric)
+
+        payloads = []
+        for top_indices, top_scores in zip(indices, scores):
+            payloads.append([
+                {"id": int(top_sim_ix), 'word': str(self.index2word[top_sim_ix]), 'score': float(np.round(
+                    score, decimals=5)), 'rank': rank}
+                for rank, (top_sim_ix, score) in enumerate(zip(top_indices, top_scores), 1)])
+
+        return payloads
+
     def get_milvus_doc_vector_by_doc_id(self, doc_id):
         int_id = self.get_int_id_from_doc_id(doc_id)
-        doc = get_milvus_client().get_entity_by_id(
-            self.model_collection_id, ids=[int_id])[0]
+        doc_vec = None
 
-        if doc is None:
+        if int_id is not None:
+            doc_vec = get_vector_store().get_vectors(
+                self.model_collection_id, ids=[int_id])[0]
+
+        if doc_vec is None:
             raise ValueError(
                 f'Document id `{doc_id}` not found in the vector index `{self.model_collection_id}`.')
 
-        doc_vec = np.array(doc.embedding)
         return doc_vec
 
     def get_similar_docs_by_doc_id(self, doc_id, topn=10, duplicate_threshold=0.999, show_duplicates=False, serialize=False, metric_type="IP"):
         self.check_wvecs()
 
-        doc_vec = self.get_milvus_doc_vector_by_doc_id(doc_id)
         topk = 2 * topn
-        dsl = get_embedding_dsl(doc_vec,
-                                topk, vector_field_name=self.milvus_vector_field_name, metric_type=metric_type)
-        results = get_milvus_client().search(self.model_collection_id, dsl)
+        entities = None
+
+        if metric_type == "IP":
+            # Served from the precomputed neighbours if the document is in the table.
+            entities = self.lookup_neighbors(
+                doc_id, topk, duplicate_threshold)
+
+        if entities is None:
+            doc_vec = self.get_milvus_doc_vector_by_doc_id(doc_id)
+            results = get_vector_store().search(
+                self.model_collection_id, doc_vec, topk, metric_type=metric_type, params=self.get_search_params())
+
+            entities = [(ent.id, ent.distance, ent.distance > duplicate_threshold)
+                        for ent in results[0]]
 
-        entities = results[0]
         payload = []
 
-        for rank, ent in enumerate(entities, 1):
+        for rank, (int_id, distance, is_duplicate) in enumerate(entities, 1):
             if not show_duplicates:
-                if ent.distance > duplicate_threshold:
+                if is_duplicate:
                     continue
 
-            payload.append({'id': self.get_doc_id_from_int_id(ent.id), 'score': float(np.round(
-                ent.distance, decimals=5)), 'rank': rank})
+            payload.append({'id': int_id, 'score': float(np.round(
+                distance, decimals=5)), 'rank': rank})
 
             if len(payload) == topn:
                 break
 
-        payload = sorted(payload, key=lambda x: x['rank'])
+        payload = sorted(self.set_payload_doc_ids(
+            payload), key=lambda x: x['rank'])
         if serialize:
             payload = pd.DataFrame(payload).to_json()
 
         return payload
 
+    def get_neighbor_table(self):
+        if getattr(self, "_neighbor_table", None) is None:
+            self._neighbor_table = NeighborTable(self.model_dir / "neighbors")
+
+        return self._neighbor_table
+
+    def lookup_neighbors(self, doc_id, topk, duplicate_threshold=0.999):
+        # Returns the (int_id, score, is_duplicate) of the `topk` nearest neighbours
+        # of the document, or None if the document is not in the table.
+        table = self.get_neighbor_table()
+        int_id = self.get_int_id_from_doc_id(doc_id)
+
+        if int_id is None:
+            return None
+
+        neighbors = table.lookup(int_id)
+
+        if neighbors is None or topk > table.meta["topk"]:
+            return None
+
+        int_ids, scores, duplicates = (a[:topk] for a in neighbors)
+
+        if duplicate_threshold != table.meta["duplicate_threshold"]:
+            duplicates = scores > duplicate_threshold
+
+        return list(zip(int_ids.tolist(), scores.tolist(), duplicates.tolist()))
+
+    def build_neighbor_table(self, full=False, batch_size=1000):
+        # Computes the nearest neighbours of the documents of the collection.
+        # Only the documents affected by the changes of the collection are
+        # recomputed unless `full` is set.
+        vector_store = get_vector_store()
+        collection_name = self.model_collection_id
+
+        int_ids = []
+        vectors = []
+        collection_ids = vector_store.list_ids(collection_name)
+
+        for start in range(0, len(collection_ids), batch_size):
+            batch_ids = collection_ids[start: start + batch_size]
+
+            for int_id, vec in zip(batch_ids, vector_store.get_vectors(collection_name, batch_ids)):
+                if vec is not None:
+                    int_ids.append(int_id)
+                    vectors.append(vec.flatten())
+
+        if not vectors:
+            return 0
+
+        with Timer() as timer:
+            recomputed = self.get_neighbor_table().build(
+                int_ids, np.vstack(vectors), full=full)
+
+        print(
+            f"Recomputed the neighbours of {recomputed} / {len(int_ids)} documents in {timer.elapsed:.2f}s...")
+
+        return recomputed
+
     def get_similar_words_by_doc_id(self, doc_id, topn=10, serialize=False, metric="cosine_similarity"):
         self.check_wvecs()
-        buffer_topn = 2 * topn
 
         doc_vec = self.get_milvus_doc_vector_by_doc_id(doc_id).reshape(1, -1)
 
-        if cosine_similarity.__name__ == metric:
-            sim = cosine_similarity(doc_vec, self.word_vectors).flatten()
-            argidx = sim.argsort()[-buffer_topn:][::-1]
-        elif euclidean_distances.__name__ == metric:
-            sim = euclidean_distances(doc_vec, self.word_vectors).flatten()
-            argidx = sim.argsort()[:buffer_topn]
-        else:
-            raise ValueError(f"Unknow metric: `{metric}")
+        payload = self.get_similar_words_by_vectors(
+            doc_vec, topn=topn, metric=metric)[0]
 
-        payload = []
-        rank = 1
-        for ix, top_sim_ix in enumerate(argidx, 1):
-            word = self.index2word[top_sim_ix]
-            if word in stopwords.noise_words:
-                continue
-            payload.append({'word': word, 'score': float(np.round(
-                sim[top_sim_ix], decimals=5)), 'rank': rank})
-
-            rank += 1
-            if rank > topn:
-                break
+        for p in payload:
+            p.pop("id")
 
-        payload = sorted(payload, key=lambda x: x['rank'])
         if serialize:
             payload = pd.DataFrame(payload).to_json()
 
@@ -4,14 +4,13 @@ from hashlib import md5
 from pathlib import Path
 from joblib import Parallel, delayed
 import pandas as pd
-from milvus import DataType
 from wb_nlp.interfaces.milvus import (
-    get_milvus_client,
-    get_collection_ids,
-    get_embedding_dsl,
     get_hex_id,
     get_int_id,
 )
+from wb_nlp.interfaces.vector_store import get_vector_store
+from wb_nlp.interfaces.collection_catalog import get_collection_catalog
+from wb_nlp.interfaces.index_manager import IndexManager, load_index_config, save_index_config
 from wb_nlp import dir_manager
 from wb_nlp.models import word2vec_base
 
@@ -32,13 +31,16 @@ class IndicatorModel:
         self.indicator_code = indicator_code
 
         self.model_collection_id = f"indicator_{model_run_info_id}_{indicator_code}"
+        self.milvus_vector_field_name = "embedding"
 
         if wvec_model is None:
             wvec_model = self.load_wvec_model()
         self.wvec_model = wvec_model
 
+        # The vectors are built offline by `build_indicator_vectors`, the model
+        # only attaches to the existing collection.
         self.load_metadata_file()
-        self.create_milvus_collection()
+        self.index_config = load_index_config(self.get_index_config_file())
 
     def load_metadata_file(self):
         if self.data_file.endswith(".csv"):
@@ -53,7 +55,7 @@ class IndicatorModel:
 
         self.indicator_df = indicator_df
 
-    def build_indicator_vectors(self, is_parallel=False):
+    def build_indicator_vectors(self, is_parallel=False, n_jobs=None):
         p_lock = Path(dir_manager.get_data_dir(
             "raw", self.model_collection_id))
         if p_lock.exists():
@@ -65,16 +67,14 @@ class IndicatorModel:
                 return
 
         try:
-            milvus_client = get_milvus_client()
+            vector_store = get_vector_store()
             collection_name = self.model_collection_id
 
             docs_metadata_df = self.indicator_df
 
-            if collection_name not in milvus_client.list_collections():
-                milvus_client.create_collection(
-                    collection_name, self.collection_params)
+            self.create_milvus_collection()
 
-            collection_doc_ids = set(get_collection_ids(collection_name))
+            collection_doc_ids = set(vector_store.list_ids(collection_name))
 
             docs_for_processing = docs_metadata_df[
                 ~docs_metadata_df['int_id'].isin(collection_doc_ids)]
@@ -83,7 +83,10 @@ class IndicatorModel:
                 return
 
             if is_parallel:
-                with Parallel(n_jobs=os.cpu_count() - 4) as parallel:
+                if n_jobs is None:
+                    n_jobs = max(1, os.cpu_count() - 4)
+
+                with Parallel(n_jobs=n_jobs) as parallel:
                     docs_for_processing["text"] = parallel(delayed(self.wvec_model.clean_text)(
                         text) for text in docs_for_processing["txt_meta"])
             else:
@@ -102,24 +105,29 @@ class IndicatorModel:
             doc_ids = docs_for_processing.iloc[list(
                 locs)]['id'].tolist()
 
-            entities = [
-                {"name": self.milvus_vector_field_name, "values": vectors,
-                    "type": DataType.FLOAT_VECTOR},
-            ]
-
-            if not milvus_client.has_partition(collection_name, self.indicator_code):
-                milvus_client.create_partition(
-                    collection_name, self.indicator_code)
+            index_manager = IndexManager(
+                collection_name, quantization=self.wvec_model.get_quantization())
 
-            ids = milvus_client.insert(collection_name, entities,
-                                       doc_int_ids, partition_tag=self.indicator_code)
+            with index_manager.bulk_load():
+                ids = vector_store.insert(collection_name, vectors,
+                                          doc_int_ids, partition_tag=self.indicator_code)
 
             assert len(set(ids).difference(
                 doc_int_ids)) == 0
 
-            milvus_client.flush([collection_name])
+            self.index_config = index_manager.build(previous=self.index_config)
+            save_index_config(self.get_index_config_file(), self.index_config)
         finally:
             p_lock.unlink(missing_ok=True)
+            get_collection_catalog().invalidate(self.model_collection_id)
+
+    def is_ready(self):
+        return get_collection_catalog().is_ready(self.model_collection_id)
+
+    def check_wvecs(self):
+        if not self.is_ready():
+            raise ValueError(
+                f'Indicator vectors not available for {self.indicator_code}! These are built with scripts/models/build_indicator_vectors.py...')
 
     def load_wvec_model(self):
         self.wvec_model = word2vec_base.Word2VecModel(
@@ -140,10 +148,13 @@ class IndicatorModel:
             vector=avec, topn=topn, ret_cols=ret_cols, as_records=as_records)
 
     def search_milvus(self, doc_vec, topn, vector_field_name, metric_type="IP"):
+        self.check_wvecs()
 
-        dsl = get_embedding_dsl(
-            doc_vec, topn, vector_field_name=vector_field_name, metric_type=metric_type)
-        return get_milvus_client().search(self.model_collection_id, dsl)
+        search_params = self.index_config.get(
+            "search_params") if self.index_config else None
+
+        return get_vector_store().search(
+            self.model_collection_id, doc_vec, topn, metric_type=metric_type, params=search_params)
 
     def get_similar_indicators_by_document(self, document, topn=10, ret_cols=None, as_records=True):
         result = self.wvec_model.process_doc(
@@ -189,24 +200,19 @@ class IndicatorModel:
         return sim_data
 
     def create_milvus_collection(self):
-        self.milvus_vector_field_name = "embedding"
-
-        self.collection_params = {
-            "fields": [
-                {"name": self.milvus_vector_field_name, "type": DataType.FLOAT_VECTOR,
-                    "params": {"dim": self.wvec_model.dim}},
-            ],
-            "segment_row_limit": 4096,
-            "auto_id": False
-        }
-
-        if self.model_collection_id not in get_milvus_client().list_collections():
-            get_milvus_client().create_collection(
-                self.model_collection_id, self.collection_params)
+        vector_store = get_vector_store()
+        if not vector_store.has_collection(self.model_collection_id):
+            vector_store.create_collection(
+                self.model_collection_id, self.wvec_model.dim, quantization=self.wvec_model.get_quantization())
 
     def drop_milvus_collection(self):
-        if self.model_collection_id in get_milvus_client().list_collections():
-            get_milvus_client().drop_collection(self.model_collection_id)
+        get_vector_store().drop_collection(self.model_collection_id)
+        get_collection_catalog().invalidate(self.model_collection_id)
+        self.get_index_config_file().unlink(missing_ok=True)
+        self.index_config = None
+
+    def get_index_config_file(self):
+        return self.wvec_model.model_dir / f"{self.model_collection_id}-index.json"
 
 
 if __name__ == "__main__":
@@ -28,6 +28,7 @@ from wb_nlp.interfaces.milvus import (
     get_milvus_client, get_hex_id, get_int_id,
     get_collection_ids, get_embedding_dsl,
 )
+from wb_nlp.interfaces.collection_catalog import get_collection_catalog
 from wb_nlp.interfaces import mongodb
 from wb_nlp.types.models import LDAModelConfig, ModelRunInfo
 from wb_nlp import dir_manager
@@ -785,9 +786,7 @@ class LDAModel:
             raise ValueError('Model not trained!')
 
     def check_wvecs(self):
-        collection_doc_ids = get_collection_ids(self.model_collection_id)
-
-        if len(collection_doc_ids) == 0:
+        if not get_collection_catalog().is_ready(self.model_collection_id):
             raise ValueError('Document vectors not available!')
 
     # def rescue_code(self, function):
@@ -8,16 +8,22 @@ import pandas as pd
 from gensim.models.ldamulticore import LdaMulticore
 
 import numpy as np
+from scipy.stats import rankdata
 
 from wb_nlp.interfaces.milvus import (
     get_milvus_client, get_embedding_dsl
 )
 from wb_nlp.interfaces import mongodb, elasticsearch
+from wb_nlp.interfaces.doc_topic_store import DocTopicStore
+from wb_nlp.utils.result_cache import LocalTier, RESULT_CACHE_TTL
 
 from wb_nlp.types.models import LDAModelConfig, ModelTypes
 
 from wb_nlp.models.base import BaseModel
 
+# Number of topic composition queries whose ranking is cached per model.
+TOPIC_RANK_CACHE_SIZE = 32
+
 
 class LDAModel(BaseModel):
     def __init__(
@@ -31,7 +37,10 @@ class LDAModel(BaseModel):
         model_run_info_id=None,
         raise_empty_doc_status=True,
         log_level=logging.INFO,
+        read_only=False,
     ):
+        self.doc_topic_store = None
+        self.topic_rank_cache = LocalTier(maxsize=TOPIC_RANK_CACHE_SIZE)
 
         super().__init__(
             model_config_id=model_config_id,
@@ -43,6 +52,7 @@ class LDAModel(BaseModel):
             model_run_info_id=model_run_info_id,
             raise_empty_doc_status=raise_empty_doc_status,
             log_level=log_level,
+            read_only=read_only,
         )
 
         self.topic_composition_ranges = None
@@ -90,6 +100,48 @@ class LDAModel(BaseModel):
 
         return dict(doc_vec=doc_vec, success=success)
 
+    def transform_docs_batch(self, texts, normalize=True, chunksize=2000):
+        # texts: list of cleaned strings
+        # The topic inference is done in chunks of documents instead of one
+        # document at a time. This replicates `self.model[doc]`, i.e., the
+        # normalized gamma with the values below the model's minimum_probability
+        # set to zero.
+        self.check_model()
+
+        doc_vecs = np.zeros((len(texts), self.dim))
+        success = np.ones(len(texts), dtype=bool)
+
+        bows = []
+        bow_locs = []
+
+        for ix, text in enumerate(texts):
+            tokens = text.lower().split()
+
+            if len(tokens) == 1:
+                # Single token documents use the term topics instead of the inference.
+                payload = self.transform_doc(text, normalize=normalize)
+                doc_vecs[ix] = payload["doc_vec"].flatten()
+                success[ix] = payload["success"]
+                continue
+
+            bows.append(self.g_dict.doc2bow(tokens))
+            bow_locs.append(ix)
+
+        minimum_probability = max(self.model.minimum_probability, 1e-8)
+
+        for start in range(0, len(bows), chunksize):
+            gamma, _ = self.model.inference(bows[start: start + chunksize])
+            topic_dist = gamma / gamma.sum(axis=1, keepdims=True)
+            topic_dist[topic_dist < minimum_probability] = 0
+
+            if normalize:
+                topic_dist /= np.linalg.norm(topic_dist,
+                                             ord=2, axis=1, keepdims=True)
+
+            doc_vecs[bow_locs[start: start + chunksize]] = topic_dist
+
+        return doc_vecs, success
+
     def infer_topics(self, text, topn_topics=None, total_topic_score=None, serialize=False):
         if isinstance(text, str):
             text = text.split()
@@ -377,7 +429,77 @@ class LDAModel(BaseModel):
 
         return doc_df
 
+    def _rank_docs_by_topic_composition(self, topic_percentage, return_all_topics, store_version):
+        # topic_percentage: tuple of (topic_id, value) pairs sorted by topic id.
+        # store_version: version of the doc-topic store used to invalidate the cache when the store is updated.
+        key = (topic_percentage, return_all_topics, store_version)
+        entry = self.topic_rank_cache.get(key)
+
+        if entry is None:
+            value = self._compute_rank_docs_by_topic_composition(
+                topic_percentage, return_all_topics)
+            self.topic_rank_cache.set(key, value, RESULT_CACHE_TTL)
+        else:
+            value = entry[1]
+
+        return value
+
+    def _compute_rank_docs_by_topic_composition(self, topic_percentage, return_all_topics):
+        _, topics = self.get_doc_topic_store().load()
+
+        mask = np.ones(len(topics), dtype=bool)
+        for topic_id, value in topic_percentage:
+            mask &= topics[:, topic_id] >= value
+
+        rows = np.flatnonzero(mask)
+
+        if return_all_topics:
+            cols = np.arange(topics.shape[1])
+        else:
+            cols = np.array([topic_id for topic_id, _ in topic_percentage])
+
+        # Same ranking as the pandas implementation: the documents are sorted by
+        # the mean of their ranks across the topics of interest.
+        mean_rank = np.zeros(len(rows))
+        if len(rows):
+            doc_topics = np.round(
+                topics[rows][:, cols].astype(np.float64), 5)
+            mean_rank = rankdata(-doc_topics, axis=0).mean(axis=1)
+
+        return rows, cols, mean_rank
+
+    def _local_get_docs_by_topic_composition(self, topic_percentage, from_result=0, size=10, return_all_topics=False):
+        doc_topic_store = self.get_doc_topic_store()
+        ids, topics = doc_topic_store.load()
+
+        rows, cols, mean_rank = self._rank_docs_by_topic_composition(
+            tuple(sorted(topic_percentage.items())), return_all_topics,
+            doc_topic_store.read_meta()["version"])
+
+        doc_count = len(rows)
+        payload = []
+
+        k = min(from_result + size, doc_count)
+        if from_result < k:
+            # Only the documents up to the requested page need to be sorted.
+            top = np.argpartition(mean_rank, k - 1)[:k]
+            top = top[np.lexsort((top, mean_rank[top]))][from_result:]
+
+            for rank, pos in enumerate(top, from_result + 1):
+                row = rows[pos]
+                payload.append({
+                    'id': str(ids[row]),
+                    'topic': {f"topic_{col}": float(np.round(topics[row, col], 5)) for col in cols},
+                    'rank': rank})
+
+        return doc_count, payload
+
     def get_docs_by_topic_composition_count(self, topic_percentage):
+        if self.get_doc_topic_store().exists():
+            doc_count, _ = self._local_get_docs_by_topic_composition(
+                topic_percentage, from_result=0, size=0)
+            return doc_count
+
         search = self._get_docs_by_topic_composition_search(topic_percentage)
         return search.count()
 
@@ -390,6 +512,17 @@ class LDAModel(BaseModel):
 
         # topic_percentage = {6: 0.1, 42: 0.1}
 
+        if self.get_doc_topic_store().exists():
+            self.check_wvecs()
+
+            doc_count, payload = self._local_get_docs_by_topic_composition(
+                topic_percentage, from_result=from_result, size=size, return_all_topics=return_all_topics)
+
+            if serialize:
+                payload = pd.DataFrame(payload).to_json()
+
+            return dict(total=doc_count, hits=payload)
+
         doc_df = self._get_docs_by_topic_composition(
             topic_percentage, return_all_topics=return_all_topics)
         doc_count = len(doc_df)
@@ -444,10 +577,24 @@ class LDAModel(BaseModel):
 
         return payload
 
+    def get_doc_topic_store(self):
+        if self.doc_topic_store is None:
+            self.doc_topic_store = DocTopicStore(
+                self.model_run_info["model_run_info_id"])
+
+        return self.doc_topic_store
+
     def get_topic_composition_ranges(self, serialize=False):
         self.check_wvecs()
 
+        doc_topic_store = self.get_doc_topic_store()
+
+        if self.topic_composition_ranges is None and doc_topic_store.exists():
+            self.topic_composition_ranges = doc_topic_store.get_topic_stats()
+
         if self.topic_composition_ranges is None:
+            # Fallback to the elasticsearch aggregations if the doc-topic store
+            # has not been materialized for this model yet.
             model_run_info_id = self.model_run_info["model_run_info_id"]
 
             topic_stats = []
@@ -477,6 +624,17 @@ class LDAModel(BaseModel):
 
         return payload
 
+    def get_topic_composition_quantiles(self, serialize=False):
+        self.check_wvecs()
+
+        # Data structure: {topic_id: {quantile: value}}
+        payload = self.get_doc_topic_store().get_topic_quantiles()
+
+        if serialize:
+            payload = pd.DataFrame(payload).to_json()
+
+        return payload
+
     def get_topic_share(self, topic_id: int, doc_ids: list):
         model_run_info_id = self.model_run_info["model_run_info_id"]
         doc_topic_collection = mongodb.get_document_topics_collection()
@@ -59,6 +59,7 @@ class MalletModel(LDAModel):
         model_run_info_id=None,
         raise_empty_doc_status=True,
         log_level=logging.INFO,
+        read_only=False,
     ):
 
         super().__init__(
@@ -71,6 +72,7 @@ class MalletModel(LDAModel):
             model_run_info_id=model_run_info_id,
             raise_empty_doc_status=raise_empty_doc_status,
             log_level=log_level,
+            read_only=read_only,
         )
 
     def train_model(self, retrain=False):
@@ -106,6 +108,15 @@ class MalletModel(LDAModel):
         else:
             self.log('Warning: Model already trained. Not doing anything...')
 
+    def get_mallet_model(self):
+        # Models loaded in read-only mode only hold the converted LdaModel.
+        # The mallet model is loaded on demand when its data is needed.
+        if self.mallet_model is None and self.model_file_name.exists():
+            self.mallet_model = self.model_class.load(
+                str(self.model_file_name))
+
+        return self.mallet_model
+
     def get_mallet_topic(self, topicid, topn=10, normalize=True):
         """Get `topn` most probable words for the given `topicid`.
         Parameters
@@ -120,13 +131,13 @@ class MalletModel(LDAModel):
             Sequence of probable words, as a list of `(word, token_count)` for `topicid` topic.
         """
 
-        topic = self.mallet_model.word_topics[topicid]
+        topic = self.get_mallet_model().word_topics[topicid]
 
         if normalize:
             topic = topic / topic.sum()  # normalize to probability dist
 
         bestn = matutils.argsort(topic, topn, reverse=True)
-        beststr = [(self.mallet_model.id2word[idx], topic[idx])
+        beststr = [(self.get_mallet_model().id2word[idx], topic[idx])
                    for idx in bestn]
         return beststr
 
@@ -153,10 +164,12 @@ class MalletModel(LDAModel):
         self.dfr_data_dir = Path(dir_manager.get_path_from_root(
             "models", "dfr", "data", self.model_run_info["model_run_info_id"]))
 
+        mallet_model = self.get_mallet_model()
+
         dt = pd.read_csv(
-            self.mallet_model.fdoctopics(), delimiter='\t', header=None,
-            names=[i for i in range(self.mallet_model.num_topics)], index_col=None,
-            usecols=[i + 2 for i in range(self.mallet_model.num_topics)],
+            mallet_model.fdoctopics(), delimiter='\t', header=None,
+            names=[i for i in range(mallet_model.num_topics)], index_col=None,
+            usecols=[i + 2 for i in range(mallet_model.num_topics)],
         )
 
         dt.index = self.corpus_ids
@@ -168,7 +181,7 @@ class MalletModel(LDAModel):
 
         self.logger.info('Generating dfr-browser data...')
         ddt = transform_dt(dt.values.T)
-        ttw = self.get_tw(self.mallet_model)
+        ttw = self.get_tw(mallet_model)
 
         # docs_metadata = mongodb.get_docs_metadata_collection()
         docs_metadata = mongodb.get_collection(
@@ -203,7 +216,7 @@ class MalletModel(LDAModel):
         with zf.ZipFile(self.dfr_data_dir / 'dt.json.zip', "w") as zip_file:
             zip_file.write(self.dfr_data_dir / 'dt.json', 'dt.json')
 
-        scaled_topics = self.scale_topics(self.mallet_model.word_topics)
+        scaled_topics = self.scale_topics(mallet_model.word_topics)
         scaled_topics = pd.DataFrame(scaled_topics)
         scaled_topics.to_csv(self.dfr_data_dir /
                              'topic_scaled.csv', index=None, header=None)
@@ -7,6 +7,7 @@ import json
 from gensim.models import Word2Vec
 import numpy as np
 import pandas as pd
+from scipy.sparse import csr_matrix
 from sklearn.metrics.pairwise import cosine_similarity, euclidean_distances
 from sklearn.cluster import KMeans, DBSCAN
 import networkx as nx
@@ -33,8 +34,10 @@ class Word2VecModel(BaseModel):
         model_run_info_id=None,
         raise_empty_doc_status=True,
         log_level=logging.INFO,
+        read_only=False,
     ):
         self.word2index = None
+        self.doc_token_index = None
 
         super().__init__(
             model_config_id=model_config_id,
@@ -46,6 +49,7 @@ class Word2VecModel(BaseModel):
             model_run_info_id=model_run_info_id,
             raise_empty_doc_status=raise_empty_doc_status,
             log_level=log_level,
+            read_only=read_only,
         )
 
     def combine_word_vectors(self, word_vecs):
@@ -79,6 +83,49 @@ class Word2VecModel(BaseModel):
 
         return dict(doc_vec=doc_vec, success=success)
 
+    def get_doc_token_index(self):
+        # Mapping of the tokens used in computing the document vectors
+        # to their row in the word vectors matrix. Noise words are excluded.
+        if self.doc_token_index is None:
+            self.doc_token_index = {
+                w: i for i, w in enumerate(self.index2word) if w not in stopwords.noise_words}
+
+        return self.doc_token_index
+
+    def transform_docs_batch(self, texts, normalize=True):
+        # texts: list of cleaned strings
+        # The document vectors are computed as the product of the sparse
+        # token count matrix with the word vectors divided by the number
+        # of tokens, which is equivalent to the mean of the word vectors.
+        self.check_model()
+        token_index = self.get_doc_token_index()
+
+        indices = []
+        indptr = [0]
+        for text in texts:
+            indices.extend([token_index[i] for i in text.lower().split() if i in token_index])
+            indptr.append(len(indices))
+
+        counts = csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), indices, indptr),
+            shape=(len(texts), len(self.index2word)))
+
+        n_tokens = np.diff(indptr)
+        success = n_tokens > 0
+
+        if self.raise_empty_doc_status and not success.all():
+            raise ValueError(
+                f"{(~success).sum()} document(s) have no token in the model vocabulary!")
+
+        doc_vecs = counts.dot(self.model.wv.vectors)
+        doc_vecs[success] /= n_tokens[success].reshape(-1, 1)
+
+        if normalize:
+            doc_vecs[success] /= np.linalg.norm(
+                doc_vecs[success], ord=2, axis=1, keepdims=True)
+
+        return doc_vecs, success
+
     def get_w2v_similar_words(self, word, topn=10, serialize=False, metric="cosine_similarity"):
         if self.word2index is None:
             self.word2index = {w: i for i, w in enumerate(self.index2word)}
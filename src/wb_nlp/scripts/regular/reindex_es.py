@@ -2,7 +2,7 @@ from elasticsearch_dsl import Index
 from wb_nlp.interfaces import elasticsearch, mongodb
 
 
-def reindex_es(ignore_existing=False, en_txt_only=True, remove_doc_whitespaces=True, delete_index=False):
+def reindex_es(ignore_existing=False, en_txt_only=True, remove_doc_whitespaces=True, delete_index=False, n_workers=None, chunk_size=200, mongo_batch_size=500):
     if delete_index:
         print("Deleting index...")
         i = Index(name=elasticsearch.DOC_INDEX,
@@ -17,12 +17,14 @@ def reindex_es(ignore_existing=False, en_txt_only=True, remove_doc_whitespaces=T
     print(f"Found {len(docs_metadata)}...")
 
     elasticsearch.make_nlp_docs_from_docs_metadata(
-        docs_metadata, ignore_existing=ignore_existing, en_txt_only=en_txt_only, remove_doc_whitespaces=remove_doc_whitespaces)
+        docs_metadata, ignore_existing=ignore_existing, en_txt_only=en_txt_only, remove_doc_whitespaces=remove_doc_whitespaces,
+        n_workers=n_workers, chunk_size=chunk_size, mongo_batch_size=mongo_batch_size)
 
 
-def main(ignore_existing=False, en_txt_only=True, remove_doc_whitespaces=True, delete_index=False):
+def main(ignore_existing=False, en_txt_only=True, remove_doc_whitespaces=True, delete_index=False, n_workers=None, chunk_size=200, mongo_batch_size=500):
     reindex_es(ignore_existing=ignore_existing, en_txt_only=en_txt_only,
-               remove_doc_whitespaces=remove_doc_whitespaces, delete_index=delete_index)
+               remove_doc_whitespaces=remove_doc_whitespaces, delete_index=delete_index,
+               n_workers=n_workers, chunk_size=chunk_size, mongo_batch_size=mongo_batch_size)
 
 
 if __name__ == "__main__":
@@ -47,6 +49,15 @@ if __name__ == "__main__":
     parser.add_argument('--delete-index', dest='delete_index',
                         type=boolean_string, default=False)
 
+    parser.add_argument('--n-workers', dest='n_workers',
+                        type=int, default=None)
+
+    parser.add_argument('--chunk-size', dest='chunk_size',
+                        type=int, default=200)
+
+    parser.add_argument('--mongo-batch-size', dest='mongo_batch_size',
+                        type=int, default=500)
+
     args = parser.parse_args()
     print(args)
 
@@ -161,6 +161,36 @@ class SimilarDocsByDocIDParams(ModelIDParams):
     metric_type: MilvusMetricTypes = MilvusMetricTypes.IP
 
 
+class SimilarDocsBatchParams(ModelIDParams):
+    raw_texts: List[str] = Field(
+        None, max_items=1000, description="List of input texts. Either `raw_texts` or `doc_ids` must be provided.")
+    doc_ids: List[str] = Field(
+        None, max_items=1000, description="List of IDs of reference documents from the `docs_metadata`.")
+    topn_docs: int = Field(
+        10, ge=1, description='Number of similar documents to return for each input.')
+
+    show_duplicates: bool = Field(
+        False, description='Flag that indicates whether to return highly similar or possibly duplicate documents.'
+    )
+    duplicate_threshold: float = Field(
+        0.98, ge=0, description='Threshold to use to indicate whether a document is highly similar or possibly a duplicate of the input.'
+    )
+    metric_type: MilvusMetricTypes = MilvusMetricTypes.IP
+
+
+class SemanticSearchBatchParams(ModelIDParams):
+    queries: List[str] = Field(
+        None, max_items=1000, description="List of queries. Either `queries` or `doc_ids` must be provided.")
+    doc_ids: List[str] = Field(
+        None, max_items=1000, description="List of IDs of reference documents from the `docs_metadata`.")
+    from_result: int = Field(
+        0, ge=0, description="Pagination parameter indicating the start, in terms of rank, of the returned documents.")
+    size: int = Field(
+        10, ge=1, description="Pagination parameter corresponding to the maximum number of documents to return for each query.")
+    clean: bool = Field(
+        False, description="Flag that indicates whether the queries will be cleaned using the cleaning pipeline of the model.")
+
+
 class TopicCompositionParams(ModelIDParams):
     topic_percentage: dict = Field(
         ..., description="Key-value pair where key is the topic id and value is the minimum percentage desired for the topic.")
@@ -0,0 +1,201 @@
+'''This module implements the cache of the documents uploaded to the API or
+retrieved from urls.
+
+The documents are addressed by the SHA-256 of their raw content. Each
+document has a directory on the local disk that stores the extracted text
+and the artifacts derived from it, e.g., the text cleaned and the vector
+computed by a model. The urls are mapped to the content they returned
+together with their `ETag` and `Last-Modified` headers so that the content
+can be revalidated with a conditional request.
+
+The total size of the cache is bounded. When it is exceeded, the least
+recently used documents are removed.
+
+Configuration:
+    - WB_NLP_INGESTION_CACHE_DIR: directory of the cache.
+    - WB_NLP_INGESTION_CACHE_MAX_BYTES: maximum size of the cache in bytes.
+'''
+import os
+import json
+import time
+import shutil
+import threading
+from hashlib import sha256
+from pathlib import Path
+
+import numpy as np
+
+from wb_nlp import dir_manager
+from wb_nlp.utils.scripts import file_lock
+
+
+INGESTION_CACHE_DIR = os.environ.get(
+    "WB_NLP_INGESTION_CACHE_DIR",
+    dir_manager.get_path_from_root("models", "cache", "ingestion"))
+INGESTION_CACHE_MAX_BYTES = int(
+    os.environ.get("WB_NLP_INGESTION_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+INGESTION_CACHE = None
+
+
+def get_content_key(content):
+    return sha256(content).hexdigest()
+
+
+def get_dir_size(path):
+    return sum(p.stat().st_size for p in Path(path).iterdir() if p.is_file())
+
+
+class IngestionCache:
+    '''Content-addressed cache of documents on the local disk.
+    '''
+
+    def __init__(self, root_dir=INGESTION_CACHE_DIR, max_bytes=INGESTION_CACHE_MAX_BYTES):
+        self.root_dir = Path(root_dir)
+        self.objects_dir = self.root_dir / "objects"
+        self.urls_dir = self.root_dir / "urls"
+        self.max_bytes = max_bytes
+
+        # Estimate of the size of the cache, computed on the first write.
+        self.size = None
+        self.evictions = 0
+        self.stats = dict(hits=0, misses=0)
+        self._lock = threading.Lock()
+
+    def get_object_dir(self, key):
+        return self.objects_dir / key[:2] / key
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _read(self, key, file_name, loader):
+        object_dir = self.get_object_dir(key)
+
+        try:
+            value = loader(object_dir / file_name)
+        except (FileNotFoundError, NotADirectoryError):
+            self._count("misses")
+            return None
+
+        # The mtime of the directory tracks the last use for the eviction.
+        try:
+            os.utime(object_dir)
+        except FileNotFoundError:
+            pass
+
+        self._count("hits")
+        return value
+
+    def _write(self, key, file_name, writer):
+        object_dir = self.get_object_dir(key)
+        object_dir.mkdir(parents=True, exist_ok=True)
+
+        path = object_dir / file_name
+        tmp_path = path.with_name(f"{file_name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        writer(tmp_path)
+        os.replace(tmp_path, path)
+
+        self.add_size(path.stat().st_size)
+
+    def get_text(self, key):
+        return self._read(key, "text.txt", lambda p: p.read_text(encoding="utf-8"))
+
+    def set_text(self, key, text):
+        self._write(key, "text.txt", lambda p: p.write_text(text, encoding="utf-8"))
+
+    def get_cleaned(self, key, name):
+        '''Returns the text of the document cleaned by `name`, e.g., a model id.
+        '''
+        return self._read(key, f"cleaned-{name}.txt", lambda p: p.read_text(encoding="utf-8"))
+
+    def set_cleaned(self, key, name, text):
+        self._write(key, f"cleaned-{name}.txt",
+                    lambda p: p.write_text(text, encoding="utf-8"))
+
+    def get_vector(self, key, name):
+        '''Returns the vector of the document computed by `name`, e.g., a model id.
+        '''
+        return self._read(key, f"vector-{name}.npy", lambda p: np.load(p))
+
+    def set_vector(self, key, name, vector):
+        def _save(path):
+            with open(path, "wb") as open_file:
+                np.save(open_file, np.asarray(vector))
+
+        self._write(key, f"vector-{name}.npy", _save)
+
+    def get_url_file(self, url):
+        return self.urls_dir / f"{sha256(url.encode('utf-8')).hexdigest()}.json"
+
+    def get_url(self, url):
+        '''Returns the entry of the content last returned by `url`.
+        '''
+        try:
+            return json.loads(self.get_url_file(url).read_text())
+        except FileNotFoundError:
+            return None
+
+    def set_url(self, url, key, etag=None, last_modified=None, content_type=None):
+        self.urls_dir.mkdir(parents=True, exist_ok=True)
+        url_file = self.get_url_file(url)
+
+        tmp_file = url_file.with_name(f"{url_file.name}.{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps(dict(
+            url=url, key=key, etag=etag, last_modified=last_modified,
+            content_type=content_type, fetched_at=time.time())))
+        os.replace(tmp_file, url_file)
+
+    def add_size(self, nbytes):
+        with self._lock:
+            if self.size is not None:
+                self.size += nbytes
+
+        if self.size is None or self.size > self.max_bytes:
+            self.evict()
+
+    def iter_objects(self):
+        if not self.objects_dir.exists():
+            return
+
+        for prefix_dir in self.objects_dir.iterdir():
+            for object_dir in prefix_dir.iterdir():
+                try:
+                    yield object_dir, object_dir.stat().st_mtime, get_dir_size(object_dir)
+                except FileNotFoundError:
+                    # Removed by another process.
+                    continue
+
+    def evict(self):
+        '''Removes the least recently used documents until the cache is under
+        90% of its capacity so that this does not run on every write.
+        '''
+        with file_lock(self.root_dir / ".lock"):
+            objects = sorted(self.iter_objects(), key=lambda o: o[1])
+            size = sum(o[2] for o in objects)
+
+            for object_dir, _, object_size in objects:
+                if size <= 0.9 * self.max_bytes:
+                    break
+
+                shutil.rmtree(object_dir, ignore_errors=True)
+                size -= object_size
+                self.evictions += 1
+
+        # The url entries of removed documents are treated as misses.
+        with self._lock:
+            self.size = size
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, size=self.size,
+                        max_bytes=self.max_bytes, evictions=self.evictions)
+
+
+def get_ingestion_cache():
+    global INGESTION_CACHE
+
+    if INGESTION_CACHE is None:
+        INGESTION_CACHE = IngestionCache()
+
+    return INGESTION_CACHE
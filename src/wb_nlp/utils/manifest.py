@@ -0,0 +1,340 @@
+'''This module implements persistent manifests of the documents processed
+by the pipelines.
+
+The manifest of the document vectors of a model keeps for each cleaned
+document its file stats, content hash, and whether its vector was written
+in the vector store and its topics written in Elasticsearch. This allows
+the builds to only process the new or changed documents and to resume
+after a failure.
+
+The manifest of the PDF files keeps the status of the extraction of the
+text and the cover of each raw PDF so that the reruns of the document
+pipeline skip the finished files. PDFs that don't exist are recorded with
+a `missing` status and processed again once they are added.
+'''
+import os
+import time
+import sqlite3
+from hashlib import md5
+from contextlib import contextmanager
+from pathlib import Path
+
+# Values of the `vector_written` and `topics_written` columns.
+PENDING = 0
+WRITTEN = 1
+# The document was processed but mapped to the zero vector.
+FAILED = -1
+
+# Values of the `status` column of the PDF manifest.
+PDF_DONE = "done"
+PDF_FAILED = "failed"
+PDF_TIMEOUT = "timeout"
+# Neither the PDF nor a scraped text of the document exists.
+PDF_MISSING = "missing"
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS docs (
+    id TEXT PRIMARY KEY,
+    int_id INTEGER,
+    corpus TEXT,
+    size INTEGER,
+    mtime REAL,
+    content_hash TEXT,
+    vector_written INTEGER DEFAULT 0,
+    topics_written INTEGER DEFAULT 0,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS docs_vector_written ON docs (vector_written);
+CREATE INDEX IF NOT EXISTS docs_int_id ON docs (int_id);
+'''
+
+_PDF_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pdfs (
+    id TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    status TEXT,
+    message TEXT,
+    elapsed REAL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS pdfs_status ON pdfs (status);
+'''
+
+
+def get_file_stat(fname):
+    '''Returns the (size, mtime) of the file, (None, None) if it does not exist.
+    '''
+    try:
+        stat = os.stat(fname)
+    except FileNotFoundError:
+        return None, None
+
+    return stat.st_size, stat.st_mtime
+
+
+def get_file_hash(fname):
+    hasher = md5()
+    with open(fname, "rb") as open_file:
+        for chunk in iter(lambda: open_file.read(1 << 20), b""):
+            hasher.update(chunk)
+
+    return hasher.hexdigest()
+
+
+def scan_cleaned_docs(cleaned_docs_dir):
+    '''Lists the cleaned documents in `cleaned_docs_dir/<corpus>/<id>.txt`
+    together with their size and modification time.
+    '''
+    for corpus_entry in os.scandir(cleaned_docs_dir):
+        if not corpus_entry.is_dir():
+            continue
+
+        for entry in os.scandir(corpus_entry.path):
+            if not entry.name.endswith(".txt"):
+                continue
+
+            stat = entry.stat()
+            yield dict(
+                id=entry.name[:-len(".txt")],
+                corpus=corpus_entry.name,
+                size=stat.st_size,
+                mtime=stat.st_mtime,
+                path=entry.path)
+
+
+class DocsManifest:
+    '''Persistent manifest of the documents for which vectors are built.
+
+    The manifest is stored as an sqlite database so that the workers
+    processing the document groups can update it concurrently.
+    '''
+
+    def __init__(self, manifest_path):
+        self.manifest_path = Path(manifest_path)
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(str(self.manifest_path), timeout=120)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def is_empty(self):
+        with self.connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0] == 0
+
+    def reset(self):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM docs")
+
+    def sync(self, cleaned_docs_dir):
+        '''Compares the files in `cleaned_docs_dir` with the manifest.
+
+        New documents are added as pending. Documents whose size or
+        modification time changed are hashed and, if the content is different,
+        set back to pending. Returns a dictionary with the ids of the `new`
+        and `changed` documents, the ids of the `removed` documents that are
+        no longer in `cleaned_docs_dir`, and the `removed_int_ids` of those
+        that have a vector in the store.
+
+        The removed documents are kept in the manifest until `remove` is
+        called, so that they are found again by the next sync if their
+        vectors could not be deleted.
+        '''
+        with self.connect() as conn:
+            known = {row[0]: row[1:] for row in conn.execute(
+                "SELECT id, size, mtime, content_hash, vector_written, int_id FROM docs")}
+
+        new_rows = []
+        changed_rows = []
+        touched_rows = []
+        seen = set()
+
+        for doc in scan_cleaned_docs(cleaned_docs_dir):
+            seen.add(doc["id"])
+            prev = known.get(doc["id"])
+
+            if prev is None:
+                new_rows.append(doc)
+                continue
+
+            size, mtime, content_hash, vector_written, _ = prev
+
+            if size == doc["size"] and mtime == doc["mtime"]:
+                continue
+
+            doc["content_hash"] = get_file_hash(doc["path"])
+
+            if content_hash is not None and content_hash == doc["content_hash"]:
+                touched_rows.append(doc)
+            else:
+                doc["vector_written"] = vector_written
+                changed_rows.append(doc)
+
+        # An empty scan is more likely an unmounted volume than the removal
+        # of all the documents.
+        removed = [doc_id for doc_id in known if doc_id not in seen] if seen else []
+
+        now = time.time()
+
+        with self.connect() as conn:
+            conn.executemany(
+                "INSERT INTO docs (id, corpus, size, mtime, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(d["id"], d["corpus"], d["size"], d["mtime"], now) for d in new_rows])
+
+            conn.executemany(
+                "UPDATE docs SET size = ?, mtime = ?, content_hash = ?, updated_at = ? WHERE id = ?",
+                [(d["size"], d["mtime"], d["content_hash"], now, d["id"]) for d in touched_rows])
+
+            conn.executemany(
+                "UPDATE docs SET corpus = ?, size = ?, mtime = ?, content_hash = ?, vector_written = 0, topics_written = 0, updated_at = ? WHERE id = ?",
+                [(d["corpus"], d["size"], d["mtime"], d["content_hash"], now, d["id"]) for d in changed_rows])
+
+        return dict(
+            new=[d["id"] for d in new_rows],
+            # Changed documents that already have a vector in the store.
+            changed=[d["id"] for d in changed_rows if d["vector_written"] == WRITTEN],
+            removed=removed,
+            removed_int_ids=[
+                known[doc_id][4] for doc_id in removed
+                if known[doc_id][3] == WRITTEN and known[doc_id][4] is not None])
+
+    def remove(self, doc_ids):
+        with self.connect() as conn:
+            conn.executemany(
+                "DELETE FROM docs WHERE id = ?", [(doc_id,) for doc_id in doc_ids])
+
+    def get_missing_int_ids(self):
+        with self.connect() as conn:
+            return [row[0] for row in conn.execute("SELECT id FROM docs WHERE int_id IS NULL")]
+
+    def set_int_ids(self, id_to_int_id):
+        with self.connect() as conn:
+            conn.executemany(
+                "UPDATE docs SET int_id = ? WHERE id = ?",
+                [(int(int_id), doc_id) for doc_id, int_id in id_to_int_id.items()])
+
+    def get_int_ids(self, doc_ids):
+        rows = []
+        with self.connect() as conn:
+            for start in range(0, len(doc_ids), 900):
+                batch = doc_ids[start: start + 900]
+                rows.extend(conn.execute(
+                    f"SELECT int_id FROM docs WHERE int_id IS NOT NULL AND id IN ({','.join('?' * len(batch))})",
+                    batch))
+
+        return [row[0] for row in rows]
+
+    def mark_existing(self, int_ids, with_topics=False):
+        '''Marks the documents already available in the vector store as written.
+        This is used to bootstrap the manifest of a collection built before the
+        manifest was introduced.
+        '''
+        now = time.time()
+        with self.connect() as conn:
+            conn.executemany(
+                "UPDATE docs SET vector_written = 1, topics_written = ?, updated_at = ? WHERE int_id = ?",
+                [(WRITTEN if with_topics else PENDING, now, int(int_id)) for int_id in int_ids])
+
+    def get_pending(self, with_topics=False):
+        '''Returns the (id, int_id, corpus) of the documents that have a known
+        int_id and are not yet processed.
+        '''
+        query = "SELECT id, int_id, corpus FROM docs WHERE int_id IS NOT NULL AND (vector_written = 0"
+        if with_topics:
+            query += " OR topics_written = 0"
+        query += ") ORDER BY corpus, id"
+
+        with self.connect() as conn:
+            return conn.execute(query).fetchall()
+
+    def mark_written(self, doc_ids, vector_written=WRITTEN, topics_written=None, content_hashes=None):
+        now = time.time()
+        content_hashes = content_hashes or {}
+
+        if topics_written is None:
+            topics_written = PENDING
+
+        with self.connect() as conn:
+            conn.executemany(
+                "UPDATE docs SET vector_written = ?, topics_written = ?, content_hash = COALESCE(?, content_hash), updated_at = ? WHERE id = ?",
+                [(vector_written, topics_written, content_hashes.get(doc_id), now, doc_id) for doc_id in doc_ids])
+
+    def get_progress(self):
+        with self.connect() as conn:
+            total, written, failed = conn.execute(
+                "SELECT COUNT(*), SUM(vector_written = 1), SUM(vector_written = -1) FROM docs").fetchone()
+
+        return dict(total=total, written=written or 0, failed=failed or 0)
+
+
+class PDFManifest:
+    '''Persistent status of the raw PDF files processed by the document pipeline.
+    '''
+
+    def __init__(self, manifest_path):
+        self.manifest_path = Path(manifest_path)
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_PDF_SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(str(self.manifest_path), timeout=120)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_pending(self, pdf_paths, retry_failed=False):
+        '''Returns the paths in `pdf_paths` that are not processed yet. A file
+        is processed again if it changed since it was processed, e.g., a
+        missing file that was added since.
+        '''
+        ids = [Path(p).stem for p in pdf_paths]
+        known = {}
+
+        with self.connect() as conn:
+            for start in range(0, len(ids), 900):
+                batch = ids[start: start + 900]
+                known.update({row[0]: row[1:] for row in conn.execute(
+                    f"SELECT id, size, mtime, status FROM pdfs WHERE id IN ({','.join('?' * len(batch))})", batch)})
+
+        pending = []
+        for pdf_path in pdf_paths:
+            prev = known.get(Path(pdf_path).stem)
+
+            if prev is not None:
+                size, mtime, status = prev
+
+                if (size, mtime) == get_file_stat(pdf_path) and (status == PDF_DONE or not retry_failed):
+                    continue
+
+            pending.append(pdf_path)
+
+        return pending
+
+    def set_status(self, pdf_path, status, message=None, elapsed=None):
+        # The size and mtime of a missing file are NULL.
+        size, mtime = get_file_stat(pdf_path)
+
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pdfs (id, size, mtime, status, message, elapsed, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (Path(pdf_path).stem, size, mtime, status, message, elapsed, time.time()))
+
+    def get_progress(self):
+        with self.connect() as conn:
+            return {row[0]: row[1] for row in conn.execute(
+                "SELECT status, COUNT(*) FROM pdfs GROUP BY status")}
@@ -0,0 +1,350 @@
+'''This module implements the cache of the query results of the models.
+
+The cache has two tiers. The first is an in-process LRU. The optional second
+tier is shared by all the processes serving the models and is either an
+sqlite database on the local disk or a Redis server. Entries are looked up
+in the in-process tier first and in the shared tier on a miss.
+
+Keys are tuples whose first element is the namespace of the entry, e.g.,
+the model id, so that the entries of a model can be invalidated together.
+Values must be picklable.
+
+Configuration:
+    - WB_NLP_RESULT_CACHE_SIZE: maximum number of entries in the in-process tier.
+    - WB_NLP_RESULT_CACHE_TTL: time to live of the entries in seconds.
+    - WB_NLP_RESULT_CACHE_BACKEND: backend of the shared tier: "sqlite", "redis", or empty to disable.
+    - WB_NLP_RESULT_CACHE_PATH: path of the sqlite database of the shared tier.
+    - WB_NLP_RESULT_CACHE_MAX_ENTRIES: maximum number of entries in the sqlite shared tier.
+    - WB_NLP_RESULT_CACHE_REDIS_URL: url of the Redis server of the shared tier.
+'''
+import os
+import time
+import pickle
+import sqlite3
+import logging
+import threading
+from hashlib import sha1
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+from wb_nlp import dir_manager
+
+
+RESULT_CACHE_SIZE = int(os.environ.get("WB_NLP_RESULT_CACHE_SIZE", 1024))
+RESULT_CACHE_TTL = float(os.environ.get("WB_NLP_RESULT_CACHE_TTL", 24 * 3600))
+RESULT_CACHE_BACKEND = os.environ.get("WB_NLP_RESULT_CACHE_BACKEND", "")
+RESULT_CACHE_PATH = os.environ.get(
+    "WB_NLP_RESULT_CACHE_PATH",
+    dir_manager.get_path_from_root("models", "cache", "results.sqlite"))
+RESULT_CACHE_MAX_ENTRIES = int(
+    os.environ.get("WB_NLP_RESULT_CACHE_MAX_ENTRIES", 100000))
+RESULT_CACHE_REDIS_URL = os.environ.get(
+    "WB_NLP_RESULT_CACHE_REDIS_URL", "redis://redis:6379/1")
+
+# Number of inserts of a process between the checks of the size of the
+# sqlite tier. The tier can exceed its capacity by this many entries per
+# process in between.
+SQLITE_EVICTION_INTERVAL = 100
+
+RESULT_CACHE = None
+
+
+def hash_text(text):
+    return sha1(text.encode("utf-8", errors="ignore")).hexdigest()
+
+
+def serialize_key(key):
+    return "|".join(str(k) for k in key)
+
+
+class LocalTier:
+    '''Thread-safe LRU with expiring entries.
+    '''
+
+    def __init__(self, maxsize=RESULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, namespace):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == namespace]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteTier:
+    '''Shared tier stored in an sqlite database on the local disk.
+    '''
+
+    def __init__(self, path=RESULT_CACHE_PATH, max_entries=RESULT_CACHE_MAX_ENTRIES,
+                 eviction_interval=SQLITE_EVICTION_INTERVAL):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.eviction_interval = eviction_interval
+        self.evictions = 0
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript('''
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                namespace TEXT,
+                value BLOB,
+                expires_at REAL,
+                accessed_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at);
+            CREATE INDEX IF NOT EXISTS results_namespace ON results (namespace);
+            ''')
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(str(self.path), timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        now = time.time()
+        skey = serialize_key(key)
+
+        with self.connect() as conn:
+            row = conn.execute(
+                "SELECT value, expires_at FROM results WHERE key = ?", (skey,)).fetchone()
+
+            if row is None:
+                return None
+
+            if row[1] < now:
+                conn.execute("DELETE FROM results WHERE key = ?", (skey,))
+                return None
+
+            conn.execute(
+                "UPDATE results SET accessed_at = ? WHERE key = ?", (now, skey))
+
+        return row[1], pickle.loads(row[0])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, namespace, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (serialize_key(key), str(key[0]), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now + ttl, now))
+
+            with self._writes_lock:
+                self._writes += 1
+                check_size = self._writes % self.eviction_interval == 0
+
+            # Counting the rows scans the table, so the size is only checked
+            # every `eviction_interval` inserts.
+            if check_size:
+                self.evict(conn, now)
+
+    def evict(self, conn, now):
+        count = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+        if count > self.max_entries:
+            conn.execute("DELETE FROM results WHERE expires_at < ?", (now,))
+            count = conn.execute(
+                "SELECT COUNT(*) FROM results").fetchone()[0]
+
+            # Evict down to 90% of the capacity so that this is not run on every check.
+            excess = count - int(0.9 * self.max_entries)
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed_at LIMIT ?)", (excess,))
+                self.evictions += excess
+
+    def invalidate(self, namespace):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM results WHERE namespace = ?",
+                         (str(namespace),))
+
+    def clear(self):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM results")
+
+
+class RedisTier:
+    '''Shared tier stored in a Redis server. The size of the tier is bounded
+    by the `maxmemory` policy of the server.
+    '''
+
+    def __init__(self, url=RESULT_CACHE_REDIS_URL, prefix="wb_nlp:results:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.evictions = 0
+
+    def get(self, key):
+        value = self.client.get(self.prefix + serialize_key(key))
+
+        if value is None:
+            return None
+
+        return None, pickle.loads(value)
+
+    def set(self, key, value, ttl):
+        self.client.set(
+            self.prefix + serialize_key(key),
+            pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+            ex=max(1, int(ttl)))
+
+    def invalidate(self, namespace):
+        for rkey in self.client.scan_iter(match=f"{self.prefix}{namespace}|*"):
+            self.client.delete(rkey)
+
+    def clear(self):
+        for rkey in self.client.scan_iter(match=f"{self.prefix}*"):
+            self.client.delete(rkey)
+
+
+class ResultCache:
+    '''Two-tier cache of the query results.
+    '''
+
+    def __init__(self, local=None, shared=None, ttl=RESULT_CACHE_TTL):
+        self.local = local if local is not None else LocalTier()
+        self.shared = shared
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self.stats = dict(hits=0, shared_hits=0, misses=0, errors=0)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        '''Returns the cached value of `key` or None.
+        '''
+        entry = self.local.get(key)
+
+        if entry is not None:
+            self._count("hits")
+            return entry[1]
+
+        if self.shared is not None:
+            try:
+                entry = self.shared.get(key)
+            except Exception as e:
+                # The shared tier is an optimization, don't fail the query.
+                logging.error(e)
+                self._count("errors")
+                entry = None
+
+            if entry is not None:
+                self._count("shared_hits")
+                expires_at, value = entry
+
+                ttl = self.ttl if expires_at is None else expires_at - time.time()
+                self.local.set(key, value, ttl)
+
+                return value
+
+        self._count("misses")
+        return None
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl or self.ttl
+        self.local.set(key, value, ttl)
+
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, ttl)
+            except Exception as e:
+                logging.error(e)
+                self._count("errors")
+
+    def get_or_compute(self, key, compute, ttl=None):
+        value = self.get(key)
+
+        if value is None:
+            value = compute()
+            self.set(key, value, ttl=ttl)
+
+        return value
+
+    def invalidate(self, namespace):
+        self.local.invalidate(namespace)
+
+        if self.shared is not None:
+            try:
+                self.shared.invalidate(namespace)
+            except Exception as e:
+                logging.error(e)
+                self._count("errors")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+
+        lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+
+        stats.update(
+            hit_rate=(stats["hits"] + stats["shared_hits"]) / lookups if lookups else None,
+            local_size=len(self.local),
+            local_evictions=self.local.evictions,
+            shared_backend=type(self.shared).__name__ if self.shared is not None else None,
+            shared_evictions=self.shared.evictions if self.shared is not None else 0,
+        )
+
+        return stats
+
+
+def get_result_cache(backend=None):
+    global RESULT_CACHE
+
+    if RESULT_CACHE is None:
+        backend = RESULT_CACHE_BACKEND if backend is None else backend
+        shared = None
+
+        if backend == "sqlite":
+            shared = SqliteTier()
+        elif backend == "redis":
+            shared = RedisTier()
+        elif backend:
+            raise ValueError(f"Unknown result cache backend: {backend}...")
+
+        RESULT_CACHE = ResultCache(shared=shared)
+
+    return RESULT_CACHE
@@ -1,8 +1,11 @@
 '''
 Module containing common functions used across the scripts.
 '''
+import fcntl
 import logging
+from contextlib import contextmanager
 from functools import lru_cache
+from pathlib import Path
 
 import click
 
@@ -43,3 +46,19 @@ def get_cleaner(cleaning_config_id):
     cleaner_object = cleaner.BaseCleaner(config=config)
 
     return cleaner_object
+
+
+@contextmanager
+def file_lock(lock_path):
+    '''
+    Exclusive lock across processes based on a lock file.
+    '''
+    lock_path = Path(lock_path)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,115 @@
+'''This module implements the kernel used to find the words most similar to
+one or more query vectors.
+
+The vocabulary matrix is normalized once and the words that must never be
+returned, e.g., noise words, are excluded through a boolean mask before
+the top-k selection. The selection uses `argpartition` so the cost of a
+query scales with the size of the vocabulary only through the matrix
+product.
+'''
+import numpy as np
+
+
+COSINE_SIMILARITY = "cosine_similarity"
+EUCLIDEAN_DISTANCES = "euclidean_distances"
+
+# Maximum number of scores computed at once when answering a batch of queries.
+MAX_BLOCK_SCORES = 1 << 24
+
+
+def normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, ord=2, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+
+    return vectors / norms
+
+
+def top_k_indices(scores, topk, largest=True):
+    '''Returns the indices of the `topk` best entries of each row of the
+    `scores` matrix, sorted from best to worst.
+    '''
+    n_cols = scores.shape[1]
+    signed = -scores if largest else scores
+
+    if topk < n_cols:
+        part = np.argpartition(signed, topk - 1, axis=1)[:, :topk]
+    else:
+        part = np.broadcast_to(np.arange(n_cols), (scores.shape[0], n_cols))
+
+    order = np.argsort(np.take_along_axis(signed, part, axis=1), axis=1)
+
+    return np.take_along_axis(part, order, axis=1)
+
+
+class SimilarityKernel:
+    '''Top-k similarity search against a vocabulary matrix.
+
+    `vectors_norm` is the L2-normalized copy of `vectors`. It is computed if
+    not provided, and can be a memory-mapped array. Rows where `exclude_mask`
+    is True are never returned.
+    '''
+
+    def __init__(self, vectors, vectors_norm=None, exclude_mask=None):
+        self.vectors = vectors
+        self.vectors_norm = normalize_rows(
+            vectors) if vectors_norm is None else vectors_norm
+
+        if exclude_mask is None:
+            exclude_mask = np.zeros(len(vectors), dtype=bool)
+        self.exclude_mask = np.asarray(exclude_mask, dtype=bool)
+
+        self._squared_norms = None
+
+    @property
+    def squared_norms(self):
+        if self._squared_norms is None:
+            self._squared_norms = np.einsum(
+                "ij,ij->i", self.vectors, self.vectors)
+        return self._squared_norms
+
+    def scores(self, query_vecs, metric=COSINE_SIMILARITY):
+        '''Returns the (n_queries x n_words) matrix of scores.
+        '''
+        query_vecs = np.atleast_2d(query_vecs).astype(
+            self.vectors_norm.dtype, copy=False)
+
+        if metric == COSINE_SIMILARITY:
+            return normalize_rows(query_vecs).dot(self.vectors_norm.T)
+
+        elif metric == EUCLIDEAN_DISTANCES:
+            sq_dist = self.squared_norms.reshape(1, -1) - 2 * query_vecs.dot(self.vectors.T)
+            sq_dist += np.einsum("ij,ij->i", query_vecs,
+                                 query_vecs).reshape(-1, 1)
+            return np.sqrt(np.maximum(sq_dist, 0, out=sq_dist), out=sq_dist)
+
+        raise ValueError(f"Unknow metric: `{metric}")
+
+    def top_k(self, query_vecs, topk=10, metric=COSINE_SIMILARITY):
+        '''Returns the (indices, scores) of the `topk` words for each of the query
+        vectors. Both are lists with one array per query sorted from the most to the
+        least similar word.
+        '''
+        query_vecs = np.atleast_2d(query_vecs)
+        largest = metric == COSINE_SIMILARITY
+        fill_value = -np.inf if largest else np.inf
+
+        block_size = max(1, MAX_BLOCK_SCORES // max(1, len(self.vectors_norm)))
+
+        indices = []
+        scores = []
+
+        for start in range(0, len(query_vecs), block_size):
+            block_scores = self.scores(
+                query_vecs[start: start + block_size], metric=metric)
+            block_scores[:, self.exclude_mask] = fill_value
+
+            block_indices = top_k_indices(block_scores, topk, largest=largest)
+            block_top_scores = np.take_along_axis(
+                block_scores, block_indices, axis=1)
+
+            for row_indices, row_scores in zip(block_indices, block_top_scores):
+                valid = np.isfinite(row_scores)
+                indices.append(row_indices[valid])
+                scores.append(row_scores[valid])
+
+        return indices, scores
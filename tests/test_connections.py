@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from wb_nlp.interfaces import connections
+from wb_nlp.interfaces.connections import ConnectionManager, reconnect_on_failure
+
+
+class FakeClient:
+    def __init__(self):
+        self.broken = False
+
+    def ping(self):
+        if self.broken:
+            raise ConnectionError("The connection is lost.")
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    manager = ConnectionManager(health_check_interval=0)
+    monkeypatch.setattr(connections, "CONNECTION_MANAGER", manager)
+
+    manager.register("fake", factory=FakeClient, health_check=lambda client: client.ping(),
+                     retries=1, failure_errors=(ConnectionError,))
+
+    return manager
+
+
+def make_call(error, retry=True):
+    '''Returns a function whose first call loses the connection of its client
+    and fails with `error`, and the list of the clients used by the calls.
+    '''
+    clients = []
+
+    @reconnect_on_failure("fake", retry=retry)
+    def call():
+        client = connections.get_connection_manager().get("fake")
+        clients.append(client)
+
+        if len(clients) == 1:
+            client.broken = True
+            raise error("failed")
+
+        return client
+
+    return call, clients
+
+
+def get_client_stats(manager):
+    return manager.get_stats()["clients"]["fake"]
+
+
+def test_retries_once_with_a_new_client(manager):
+    call, clients = make_call(ConnectionError)
+
+    client = call()
+
+    assert len(clients) == 2
+    assert client is not clients[0]
+    assert get_client_stats(manager)["connects"] == 2
+
+
+def test_other_errors_are_not_retried(manager):
+    call, clients = make_call(KeyError)
+
+    with pytest.raises(KeyError):
+        call()
+
+    assert len(clients) == 1
+    assert get_client_stats(manager)["reported_failures"] == 0
+
+
+def test_writes_are_not_retried(manager):
+    call, clients = make_call(ConnectionError, retry=False)
+
+    with pytest.raises(ConnectionError):
+        call()
+
+    assert len(clients) == 1
+
+    # The failure is still reported so that the next call gets a new client.
+    stats = get_client_stats(manager)
+    assert stats["reported_failures"] == 1
+    assert not stats["healthy"]
+    assert manager.get("fake") is not clients[0]
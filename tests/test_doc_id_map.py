@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pymongo")
+pytest.importorskip("wb_cleaning")
+
+from wb_nlp.interfaces import doc_id_map  # noqa: E402
+from wb_nlp.interfaces.doc_id_map import DocIdMap, build_arrays, merge_arrays, ARRAY_NAMES  # noqa: E402
+
+
+class FakeCollection:
+    '''Collection supporting the queries of the doc id map.
+    '''
+
+    def __init__(self):
+        self.docs = []
+        self.queries = []
+
+    def insert(self, doc_id, int_id, updated_at=None):
+        doc = dict(id=doc_id, int_id=int_id)
+        if updated_at is not None:
+            doc["updated_at"] = updated_at
+        self.docs.append(doc)
+
+    def matches(self, doc, query):
+        for field, condition in query.items():
+            if "$exists" in condition:
+                if (field in doc) != condition["$exists"]:
+                    return False
+            elif "$gte" in condition:
+                if field not in doc or doc[field] < condition["$gte"]:
+                    return False
+            elif "$in" in condition:
+                if doc.get(field) not in condition["$in"]:
+                    return False
+
+        return True
+
+    def find(self, query, projection=None, batch_size=None):
+        self.queries.append(query)
+        return [dict(doc) for doc in self.docs if self.matches(doc, query)]
+
+    def find_one(self, query, projection=None, sort=None):
+        docs = [doc for doc in self.docs if self.matches(doc, query)]
+        if not docs:
+            return None
+
+        (field, direction), = sort
+        return dict(sorted(docs, key=lambda doc: doc[field], reverse=direction < 0)[0])
+
+
+T0 = datetime(2021, 1, 1)
+
+
+def make_pairs(n, start=0):
+    rng = np.random.default_rng(start)
+    int_ids = rng.choice(1 << 59, size=n, replace=False).tolist()
+    # Non-ascii ids of different lengths.
+    doc_ids = [f"doc_{ix}_é" * (1 + ix % 3) for ix in range(start, start + n)]
+
+    return int_ids, doc_ids
+
+
+@pytest.fixture
+def collection():
+    return FakeCollection()
+
+
+@pytest.fixture
+def id_map(tmp_path, collection):
+    return DocIdMap(root_dir=tmp_path / "doc_id_map", collection=collection, check_interval=0)
+
+
+def load(collection, n, start=0, updated_at=T0):
+    int_ids, doc_ids = make_pairs(n, start=start)
+    for ix, (int_id, doc_id) in enumerate(zip(int_ids, doc_ids)):
+        collection.insert(doc_id, int_id, updated_at=updated_at and updated_at + timedelta(seconds=ix))
+
+    return int_ids, doc_ids
+
+
+def assert_arrays_equal(arrays, expected):
+    for name in ARRAY_NAMES:
+        np.testing.assert_array_equal(arrays[name], expected[name], err_msg=name)
+
+
+def test_merge_arrays_matches_build_arrays():
+    int_ids, doc_ids = make_pairs(500)
+
+    merged = merge_arrays(build_arrays(int_ids[:300], doc_ids[:300]), int_ids[300:], doc_ids[300:])
+
+    assert_arrays_equal(merged, build_arrays(int_ids, doc_ids))
+
+
+def test_lookups(id_map, collection):
+    int_ids, doc_ids = load(collection, 200)
+
+    assert id_map.refresh() == 200
+    assert id_map.get_doc_ids(int_ids) == doc_ids
+    assert id_map.get_int_ids(doc_ids) == int_ids
+    assert id_map.get_doc_id(123) is None
+    assert id_map.get_int_id("missing") is None
+
+
+def test_fetch_missing_falls_back_to_the_database(id_map, collection):
+    load(collection, 50)
+    id_map.refresh()
+    id_map.load()
+
+    # Loaded after the refresh.
+    collection.insert("late", 42, updated_at=T0 + timedelta(days=1))
+
+    assert id_map.get_doc_id(42) == "late"
+    assert id_map.get_int_id("late") == 42
+    assert len(id_map) == 50
+    assert id_map.get_stats()["extra"] == 1
+
+
+def test_refresh_reads_from_the_watermark(id_map, collection):
+    load(collection, 100)
+    id_map.refresh()
+
+    watermark = datetime.fromisoformat(id_map.read_current()["watermark"])
+    assert watermark == T0 + timedelta(seconds=99)
+
+    # A write committed out of order, stamped before the watermark.
+    collection.insert("out_of_order", 7, updated_at=watermark - timedelta(minutes=1))
+    new_int_ids, new_doc_ids = load(collection, 20, start=100, updated_at=watermark + timedelta(hours=1))
+
+    assert id_map.refresh() == 21
+    assert collection.queries[-1] == {"updated_at": {"$gte": watermark - doc_id_map.WATERMARK_OVERLAP}}
+
+    assert id_map.get_doc_ids([7] + new_int_ids) == ["out_of_order"] + new_doc_ids
+    assert id_map.get_stats()["extra"] == 0
+
+    all_docs = [(doc["int_id"], doc["id"]) for doc in collection.docs]
+    assert_arrays_equal(id_map.arrays, build_arrays(*map(list, zip(*all_docs))))
+
+
+def test_refresh_without_new_documents_keeps_the_generation(id_map, collection):
+    load(collection, 10)
+    id_map.refresh()
+    current = id_map.read_current()
+
+    assert id_map.refresh() == 0
+    assert id_map.read_current() == current
+
+    # The documents rewritten since only move the watermark.
+    for doc in collection.docs:
+        doc["updated_at"] += timedelta(days=1)
+
+    assert id_map.refresh() == 0
+    assert id_map.read_current()["generation"] == current["generation"]
+    assert id_map.read_current()["watermark"] == (T0 + timedelta(days=1, seconds=9)).isoformat()
+
+
+def test_unstamped_documents_are_scanned(id_map, collection):
+    load(collection, 10, updated_at=None)
+    assert id_map.refresh() == 10
+    assert id_map.read_current()["watermark"] is None
+
+    load(collection, 5, start=10, updated_at=None)
+    assert id_map.refresh() == 5
+    assert collection.queries[-1] == {}
+
+
+def test_generation_swap(tmp_path, id_map, collection):
+    reader = DocIdMap(root_dir=id_map.root_dir, collection=collection, check_interval=0)
+
+    load(collection, 10)
+    id_map.refresh()
+    assert len(reader) == 10
+    old_arrays = reader.arrays
+
+    generations = []
+    for step in range(1, 4):
+        load(collection, 10, start=10 * step, updated_at=T0 + timedelta(days=step))
+        id_map.refresh()
+        generations.append(id_map.read_current()["generation"])
+
+    # The reader loads the new generation on its next check.
+    assert len(reader) == 40
+    assert reader.generation == generations[-1]
+
+    # Only the last generations are kept, the open memory maps stay readable.
+    assert sorted(path.name for path in id_map.root_dir.glob("gen-*")) == \
+        generations[-doc_id_map.KEEP_GENERATIONS:]
+    assert len(old_arrays["int_ids"]) == 10
+    assert not list(id_map.root_dir.glob("*.tmp"))
+
+
+def test_full_refresh_rebuilds_the_map(id_map, collection):
+    load(collection, 10)
+    id_map.refresh()
+
+    # The removed documents are only dropped by a full refresh.
+    del collection.docs[:5]
+
+    assert id_map.refresh() == 0
+    assert id_map.read_current()["size"] == 10
+
+    assert id_map.refresh(full=True) == 5
+    assert id_map.read_current()["size"] == 5
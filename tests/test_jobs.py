@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import sys
+
+import pytest
+
+from app.nlp_api.common.jobs import JobStore, JobLimitError, QUEUED, RUNNING, FAILED
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(root_dir=tmp_path)
+
+
+def get_dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+
+    return process.pid
+
+
+def set_owner_pid(store, job_id, pid):
+    with store.connect() as conn:
+        conn.execute("UPDATE jobs SET owner_pid = ? WHERE job_id = ?", (pid, job_id))
+
+
+def test_create_limits_active_jobs_per_client(store):
+    first = store.create("analyze", "a", max_active_per_client=2)
+    store.create("analyze", "a", max_active_per_client=2)
+
+    with pytest.raises(JobLimitError):
+        store.create("analyze", "a", max_active_per_client=2)
+
+    # The limit is per client.
+    store.create("analyze", "b", max_active_per_client=2)
+
+    # A finished job does not count toward the limit.
+    store.set_finished(first, result={"ok": True})
+    store.create("analyze", "a", max_active_per_client=2)
+
+
+def test_create_limits_queued_jobs(store):
+    jobs = [store.create("analyze", f"client-{ix}", max_queued=3) for ix in range(3)]
+
+    with pytest.raises(JobLimitError):
+        store.create("analyze", "other", max_queued=3)
+
+    # The running jobs are not queued anymore.
+    store.set_running(jobs[0])
+    store.create("analyze", "other", max_queued=3)
+
+
+def test_create_fails_jobs_of_dead_workers(store):
+    dead_pid = get_dead_pid()
+
+    queued = store.create("analyze", "a", max_active_per_client=2)
+    running = store.create("analyze", "a", max_active_per_client=2)
+    store.set_running(running)
+
+    for job_id in [queued, running]:
+        set_owner_pid(store, job_id, dead_pid)
+
+    input_dir = store.get_input_dir(queued)
+    input_dir.mkdir(parents=True)
+
+    # The jobs of the dead worker are released without being polled.
+    job_id = store.create("analyze", "a", max_active_per_client=2, max_queued=1)
+
+    assert store.get(job_id)["status"] == QUEUED
+    for orphaned_id in [queued, running]:
+        job = store.get(orphaned_id)
+        assert job["status"] == FAILED
+        assert job["error"] == "The job was interrupted."
+    assert not input_dir.exists()
+
+
+def test_limit_error_still_fails_jobs_of_dead_workers(store):
+    dead_job = store.create("analyze", "a")
+    store.create("analyze", "b")
+    set_owner_pid(store, dead_job, get_dead_pid())
+
+    with pytest.raises(JobLimitError):
+        store.create("analyze", "c", max_queued=1)
+
+    assert store.get_stats() == {FAILED: 1, QUEUED: 1}
+
+
+def test_jobs_of_live_workers_are_kept(store):
+    job_id = store.create("analyze", "a")
+    store.set_running(job_id)
+
+    assert store.fail_orphaned() == []
+    assert store.get(job_id)["status"] == RUNNING
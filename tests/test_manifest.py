@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from wb_nlp.utils.manifest import (
+    DocsManifest, PDFManifest, get_file_hash,
+    PDF_DONE, PDF_FAILED, PDF_MISSING,
+)
+
+
+@pytest.fixture
+def pdf_manifest(tmp_path):
+    return PDFManifest(tmp_path / "pdf_manifest.sqlite")
+
+
+@pytest.fixture
+def cleaned_docs_dir(tmp_path):
+    cleaned_docs_dir = tmp_path / "cleaned"
+    for corpus, doc_id in [("WB", "wb_1"), ("WB", "wb_2"), ("IMF", "imf_1")]:
+        (cleaned_docs_dir / corpus).mkdir(parents=True, exist_ok=True)
+        (cleaned_docs_dir / corpus / f"{doc_id}.txt").write_text(f"text of {doc_id}")
+
+    return cleaned_docs_dir
+
+
+@pytest.fixture
+def docs_manifest(tmp_path, cleaned_docs_dir):
+    manifest = DocsManifest(tmp_path / "docs_manifest.sqlite")
+    manifest.sync(cleaned_docs_dir)
+    manifest.set_int_ids(dict(wb_1=1, wb_2=2, imf_1=3))
+
+    return manifest
+
+
+def write_vectors(manifest, cleaned_docs_dir):
+    manifest.mark_written(
+        [doc_id for doc_id, _, _ in manifest.get_pending()],
+        content_hashes={
+            path.stem: get_file_hash(path) for path in cleaned_docs_dir.glob("*/*.txt")})
+
+
+def touch(path):
+    stat = path.stat()
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+
+
+def test_docs_manifest_sync_adds_new_documents(cleaned_docs_dir, docs_manifest):
+    assert docs_manifest.get_pending() == [("imf_1", 3, "IMF"), ("wb_1", 1, "WB"), ("wb_2", 2, "WB")]
+
+    write_vectors(docs_manifest, cleaned_docs_dir)
+    (cleaned_docs_dir / "WB" / "wb_3.txt").write_text("text of wb_3")
+
+    delta = docs_manifest.sync(cleaned_docs_dir)
+
+    assert delta == dict(new=["wb_3"], changed=[], removed=[], removed_int_ids=[])
+    assert docs_manifest.get_missing_int_ids() == ["wb_3"]
+    assert docs_manifest.get_progress() == dict(total=4, written=3, failed=0)
+
+
+def test_docs_manifest_sync_resets_changed_documents(cleaned_docs_dir, docs_manifest):
+    write_vectors(docs_manifest, cleaned_docs_dir)
+
+    changed = cleaned_docs_dir / "WB" / "wb_1.txt"
+    changed.write_text("new text of wb_1")
+    touch(changed)
+    # Only the modification time of this one changed.
+    touch(cleaned_docs_dir / "WB" / "wb_2.txt")
+
+    delta = docs_manifest.sync(cleaned_docs_dir)
+
+    assert delta["changed"] == ["wb_1"]
+    assert docs_manifest.get_pending() == [("wb_1", 1, "WB")]
+
+    # The stats of the touched document are updated, it is not hashed again.
+    assert docs_manifest.sync(cleaned_docs_dir)["changed"] == []
+
+
+def test_docs_manifest_sync_finds_removed_documents(cleaned_docs_dir, docs_manifest):
+    docs_manifest.mark_written(["wb_1"])
+
+    (cleaned_docs_dir / "WB" / "wb_1.txt").unlink()
+    (cleaned_docs_dir / "WB" / "wb_2.txt").unlink()
+
+    delta = docs_manifest.sync(cleaned_docs_dir)
+
+    # Only the removed documents with a vector have to be deleted from the store.
+    assert sorted(delta["removed"]) == ["wb_1", "wb_2"]
+    assert delta["removed_int_ids"] == [1]
+
+    # The removed documents stay in the manifest until their vectors are deleted.
+    assert sorted(docs_manifest.sync(cleaned_docs_dir)["removed"]) == ["wb_1", "wb_2"]
+
+    docs_manifest.remove(delta["removed"])
+
+    assert docs_manifest.get_pending() == [("imf_1", 3, "IMF")]
+    assert docs_manifest.get_progress() == dict(total=1, written=0, failed=0)
+    assert docs_manifest.sync(cleaned_docs_dir)["removed"] == []
+
+
+def test_docs_manifest_sync_keeps_documents_of_an_empty_dir(tmp_path, docs_manifest):
+    (tmp_path / "empty").mkdir()
+
+    assert docs_manifest.sync(tmp_path / "empty")["removed"] == []
+    assert docs_manifest.get_progress()["total"] == 3
+
+
+def test_pdf_manifest_skips_processed_files(tmp_path, pdf_manifest):
+    pdf_dir = tmp_path / "PDF_ORIG"
+    pdf_dir.mkdir()
+    done, failed, new = [pdf_dir / f"{name}.pdf" for name in ["done", "failed", "new"]]
+    for pdf_path in [done, failed, new]:
+        pdf_path.write_bytes(b"%PDF")
+
+    pdf_manifest.set_status(done, PDF_DONE)
+    pdf_manifest.set_status(failed, PDF_FAILED)
+
+    assert pdf_manifest.get_pending([done, failed, new]) == [new]
+    assert pdf_manifest.get_pending([done, failed, new], retry_failed=True) == [failed, new]
+
+    # A changed file is processed again.
+    done.write_bytes(b"%PDF-1.4")
+    assert pdf_manifest.get_pending([done]) == [done]
+
+
+def test_pdf_manifest_records_missing_files(tmp_path, pdf_manifest):
+    missing = tmp_path / "PDF_ORIG" / "missing.pdf"
+
+    assert pdf_manifest.get_pending([missing]) == [missing]
+
+    pdf_manifest.set_status(missing, PDF_MISSING, message="File not found.")
+
+    assert pdf_manifest.get_progress() == {PDF_MISSING: 1}
+    assert pdf_manifest.get_pending([missing]) == []
+    assert pdf_manifest.get_pending([missing], retry_failed=True) == [missing]
+
+    # The file is processed once it is added.
+    missing.parent.mkdir()
+    missing.write_bytes(b"%PDF")
+    assert pdf_manifest.get_pending([missing]) == [missing]
+
+
+def test_pdf_manifest_done_without_pdf(tmp_path, pdf_manifest):
+    # The text of a missing pdf was copied from the scraped text.
+    missing = tmp_path / "missing.pdf"
+    pdf_manifest.set_status(missing, PDF_DONE, message="Cover not extracted: ...")
+
+    assert pdf_manifest.get_pending([missing], retry_failed=True) == []
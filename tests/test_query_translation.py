@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+pytest.importorskip("wb_cleaning")
+
+from app.nlp_api.common.query_translation import QueryTranslator  # noqa: E402
+from wb_nlp.utils.result_cache import ResultCache, LocalTier  # noqa: E402
+
+
+class FakeBackend:
+    def __init__(self, fail=False, join_lines=False):
+        self.fail = fail
+        self.join_lines = join_lines
+        self.calls = []
+
+    def __call__(self, text):
+        self.calls.append(text)
+
+        if self.fail:
+            raise ConnectionError("The translation backend is down.")
+
+        lines = [f"en_{line}" for line in text.split("\n")]
+        # Some backends merge the lines of the input.
+        translated = " ".join(lines) if self.join_lines else "\n".join(lines)
+
+        return dict(original=text, translated=translated, src="fr")
+
+
+def make_translator(backend, **kwargs):
+    return QueryTranslator(
+        cache=ResultCache(local=LocalTier(maxsize=100)), translate=backend, **kwargs)
+
+
+def test_translates_missing_tokens_in_one_call():
+    backend = FakeBackend()
+    translator = make_translator(backend)
+
+    translations = translator.translate_tokens(["chat", "chien", "chat"])
+
+    assert {token: tr["translated"] for token, tr in translations.items()} == {
+        "chat": "en_chat", "chien": "en_chien"}
+    assert backend.calls == ["chat\nchien"]
+
+    # The translations are cached.
+    translator.translate_tokens(["chien", "chat"])
+    assert len(backend.calls) == 1
+
+
+def test_translates_one_by_one_if_lines_are_merged():
+    backend = FakeBackend(join_lines=True)
+    translator = make_translator(backend)
+
+    translations = translator.translate_tokens(["chat", "chien"])
+
+    assert translations["chien"]["translated"] == "en_chien"
+    assert backend.calls == ["chat\nchien", "chat", "chien"]
+
+
+def test_failures_are_cached_without_per_token_calls():
+    backend = FakeBackend(fail=True)
+    translator = make_translator(backend, failure_ttl=60)
+
+    assert translator.translate_tokens(["chat", "chien"]) == {}
+    # No fallback to one call per token.
+    assert backend.calls == ["chat\nchien"]
+
+    # The failed tokens are not sent again until the failure expires.
+    assert translator.translate_tokens(["chien"]) == {}
+    assert len(backend.calls) == 1
+
+
+def test_skips_the_backend_when_the_threads_are_busy():
+    release = threading.Event()
+    calls = []
+
+    def slow_backend(text):
+        calls.append(text)
+        release.wait(5)
+        return dict(original=text, translated=text)
+
+    translator = make_translator(slow_backend, timeout=0.01, max_workers=1)
+
+    try:
+        # Times out, the call keeps its thread.
+        assert translator.translate_tokens(["chat"]) == {}
+        # Not submitted since the only thread is busy.
+        assert translator.translate_tokens(["chien"]) == {}
+        assert calls == ["chat"]
+    finally:
+        release.set()
+
+    translator.executor.shutdown(wait=True)
+
+    # The late translation is cached.
+    assert translator.get_cached("chat")["translated"] == "chat"
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import numpy as np
+import pytest
+
+pytest.importorskip("psutil")
+
+from app.nlp_api.common.registry import ModelRegistry, estimate_size_mb  # noqa: E402
+
+
+MB = 1024 ** 2
+
+
+class FakeModel:
+    def __init__(self, size_mb, path=None):
+        if path is None:
+            self.vectors = np.zeros(int(size_mb * MB), dtype=np.uint8)
+        else:
+            np.save(path, np.zeros(int(size_mb * MB), dtype=np.uint8))
+            self.vectors = np.load(path, mmap_mode="r")
+
+        # Views of the same buffer are counted once.
+        self.head = self.vectors[:10]
+        self.cache = {"norms": np.zeros(MB // 8, dtype=np.float64)}
+
+
+def test_estimate_size_counts_arrays_and_memory_maps(tmp_path):
+    assert estimate_size_mb(FakeModel(4)) == pytest.approx(5)
+    assert estimate_size_mb(FakeModel(4, path=tmp_path / "vectors.npy")) == pytest.approx(5)
+
+
+def test_evicts_least_recently_used_models_over_budget():
+    registry = ModelRegistry(
+        lambda model_id: dict(model=FakeModel(2)), memory_budget_mb=10, pinned=["pinned"])
+
+    registry.get("pinned")
+    registry.get("a")
+    registry.get("b")
+    # "a" is now the most recently used unpinned model.
+    registry.get("a")
+    registry.get("c")
+
+    assert "b" not in registry
+    assert all(model_id in registry for model_id in ["pinned", "a", "c"])
+    assert registry.get_total_size_mb() <= 10
+
+
+def test_eviction_hooks_are_called():
+    registry = ModelRegistry(lambda model_id: dict(model=FakeModel(1)))
+    evicted = []
+    registry.add_eviction_hook(lambda model_id, model_run_info: evicted.append(model_id))
+
+    registry.get("a")
+
+    assert registry.evict("a")
+    assert not registry.evict("a")
+    assert evicted == ["a"]
+
+
+def test_slow_load_does_not_block_other_models():
+    slow_started = threading.Event()
+    release_slow = threading.Event()
+    loads = []
+
+    def loader(model_id):
+        loads.append(model_id)
+        if model_id == "slow":
+            slow_started.set()
+            assert release_slow.wait(5)
+
+        return dict(model=FakeModel(0.1))
+
+    registry = ModelRegistry(loader)
+
+    threads = [threading.Thread(target=registry.get, args=("slow",)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+
+    assert slow_started.wait(5)
+    # Loaded while the slow model is loading.
+    registry.get("fast")
+    assert "slow" not in registry
+
+    release_slow.set()
+    for thread in threads:
+        thread.join()
+
+    # The concurrent requests of the slow model loaded it once.
+    assert sorted(loads) == ["fast", "slow"]
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from wb_nlp.utils.result_cache import LocalTier, SqliteTier, ResultCache
+
+
+@pytest.fixture
+def sqlite_tier(tmp_path):
+    return SqliteTier(path=tmp_path / "results.sqlite", max_entries=10, eviction_interval=5)
+
+
+def test_local_tier_evicts_the_least_recently_used():
+    tier = LocalTier(maxsize=2)
+    tier.set(("m", "a"), 1, ttl=60)
+    tier.set(("m", "b"), 2, ttl=60)
+
+    # Reading "a" makes "b" the least recently used.
+    assert tier.get(("m", "a"))[1] == 1
+    tier.set(("m", "c"), 3, ttl=60)
+
+    assert tier.get(("m", "b")) is None
+    assert tier.get(("m", "a"))[1] == 1
+    assert tier.get(("m", "c"))[1] == 3
+    assert tier.evictions == 1
+
+
+def test_local_tier_expires_entries():
+    tier = LocalTier()
+    tier.set(("m", "a"), 1, ttl=-1)
+
+    assert tier.get(("m", "a")) is None
+    assert len(tier) == 0
+
+
+def test_local_tier_invalidates_a_namespace():
+    tier = LocalTier()
+    tier.set(("m1", "a"), 1, ttl=60)
+    tier.set(("m2", "a"), 2, ttl=60)
+
+    tier.invalidate("m1")
+
+    assert tier.get(("m1", "a")) is None
+    assert tier.get(("m2", "a"))[1] == 2
+
+
+def test_sqlite_tier_is_shared_by_instances(tmp_path, sqlite_tier):
+    sqlite_tier.set(("m", "a"), {"result": [1, 2]}, ttl=60)
+
+    other = SqliteTier(path=sqlite_tier.path)
+    _, value = other.get(("m", "a"))
+
+    assert value == {"result": [1, 2]}
+    assert other.get(("m", "b")) is None
+
+
+def test_sqlite_tier_expires_entries(sqlite_tier):
+    sqlite_tier.set(("m", "a"), 1, ttl=-1)
+
+    assert sqlite_tier.get(("m", "a")) is None
+
+    with sqlite_tier.connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM results").fetchone()[0] == 0
+
+
+def test_sqlite_tier_evicts_every_interval(sqlite_tier):
+    def count():
+        with sqlite_tier.connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    for ix in range(14):
+        sqlite_tier.set(("m", ix), ix, ttl=60)
+
+    # The size is checked on the 5th and 10th inserts only.
+    assert count() == 14
+    assert sqlite_tier.evictions == 0
+
+    sqlite_tier.set(("m", 14), 14, ttl=60)
+
+    # Evicted down to 90% of the capacity, the oldest entries first.
+    assert count() == 9
+    assert sqlite_tier.evictions == 6
+    assert sqlite_tier.get(("m", 5)) is None
+    assert sqlite_tier.get(("m", 14))[1] == 14
+
+
+def test_sqlite_tier_invalidates_a_namespace(sqlite_tier):
+    sqlite_tier.set(("m1", "a"), 1, ttl=60)
+    sqlite_tier.set(("m2", "a"), 2, ttl=60)
+
+    sqlite_tier.invalidate("m1")
+
+    assert sqlite_tier.get(("m1", "a")) is None
+    assert sqlite_tier.get(("m2", "a"))[1] == 2
+
+
+def test_shared_hits_are_promoted_to_the_local_tier(sqlite_tier):
+    writer = ResultCache(local=LocalTier(), shared=sqlite_tier)
+    reader = ResultCache(local=LocalTier(), shared=SqliteTier(path=sqlite_tier.path))
+
+    writer.set(("m", "a"), 1)
+
+    assert reader.get(("m", "a")) == 1
+    assert reader.local.get(("m", "a"))[1] == 1
+    assert reader.get(("m", "a")) == 1
+    assert reader.get(("m", "b")) is None
+
+    stats = reader.get_stats()
+    assert (stats["hits"], stats["shared_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["shared_backend"] == "SqliteTier"
+
+
+def test_get_or_compute_computes_once():
+    cache = ResultCache(local=LocalTier())
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return "value"
+
+    assert cache.get_or_compute(("m", "a"), compute) == "value"
+    assert cache.get_or_compute(("m", "a"), compute) == "value"
+    assert len(calls) == 1
+
+
+def test_shared_tier_errors_do_not_fail_the_query():
+    class BrokenTier:
+        evictions = 0
+
+        def get(self, key):
+            raise OSError("unavailable")
+
+        def set(self, key, value, ttl):
+            raise OSError("unavailable")
+
+        def invalidate(self, namespace):
+            raise OSError("unavailable")
+
+    cache = ResultCache(local=LocalTier(), shared=BrokenTier())
+    cache.set(("m", "a"), 1)
+    cache.invalidate("m")
+
+    assert cache.get(("m", "a")) is None
+    assert cache.get_stats()["errors"] == 3
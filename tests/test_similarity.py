@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from wb_nlp.utils import similarity
+from wb_nlp.utils.similarity import (
+    SimilarityKernel, normalize_rows, top_k_indices,
+    COSINE_SIMILARITY, EUCLIDEAN_DISTANCES,
+)
+
+
+def get_similar_words_reference(doc_vec, word_vectors, noise_mask, topn, metric):
+    '''The selection of `get_similar_words` before the kernel: the scores of
+    all the words are sorted, and the noise words are skipped in the best
+    `2 * topn` words.
+    '''
+    buffer_topn = 2 * topn
+
+    if metric == COSINE_SIMILARITY:
+        sim = normalize_rows(word_vectors).dot(normalize_rows(doc_vec).flatten())
+        argidx = sim.argsort()[-buffer_topn:][::-1]
+    else:
+        sim = np.sqrt(((word_vectors - doc_vec) ** 2).sum(axis=1))
+        argidx = sim.argsort()[:buffer_topn]
+
+    selected = [ix for ix in argidx if not noise_mask[ix]][:topn]
+
+    return selected, sim[selected]
+
+
+@pytest.fixture
+def vocabulary():
+    rng = np.random.default_rng(0)
+    word_vectors = rng.normal(size=(2000, 32)).astype(np.float32)
+    noise_mask = rng.random(2000) < 0.05
+
+    return word_vectors, noise_mask
+
+
+@pytest.mark.parametrize("metric", [COSINE_SIMILARITY, EUCLIDEAN_DISTANCES])
+def test_top_k_matches_the_previous_selection(vocabulary, metric):
+    word_vectors, noise_mask = vocabulary
+    kernel = SimilarityKernel(word_vectors, exclude_mask=noise_mask)
+    queries = np.random.default_rng(1).normal(size=(20, 32)).astype(np.float32)
+
+    indices, scores = kernel.top_k(queries, topk=10, metric=metric)
+
+    for query, top_indices, top_scores in zip(queries, indices, scores):
+        expected_indices, expected_scores = get_similar_words_reference(
+            query.reshape(1, -1), word_vectors, noise_mask, 10, metric)
+
+        assert top_indices.tolist() == expected_indices
+        np.testing.assert_allclose(top_scores, expected_scores, rtol=1e-4, atol=1e-4)
+
+
+def test_top_k_never_returns_excluded_words():
+    rng = np.random.default_rng(0)
+    word_vectors = rng.normal(size=(100, 8))
+    # The query is closest to the excluded words.
+    exclude_mask = np.zeros(100, dtype=bool)
+    exclude_mask[:30] = True
+    queries = word_vectors[:5]
+
+    indices, _ = SimilarityKernel(word_vectors, exclude_mask=exclude_mask).top_k(queries, topk=10)
+
+    for top_indices in indices:
+        assert len(top_indices) == 10
+        assert not exclude_mask[top_indices].any()
+
+
+def test_top_k_with_fewer_words_than_topk():
+    word_vectors = np.eye(4)
+    exclude_mask = np.array([False, True, False, False])
+
+    indices, scores = SimilarityKernel(word_vectors, exclude_mask=exclude_mask).top_k(
+        word_vectors[0], topk=10)
+
+    assert indices[0].tolist()[0] == 0
+    assert sorted(indices[0].tolist()) == [0, 2, 3]
+    assert len(scores[0]) == 3
+
+
+def test_top_k_blocks_match_single_queries(vocabulary, monkeypatch):
+    word_vectors, noise_mask = vocabulary
+    kernel = SimilarityKernel(word_vectors, exclude_mask=noise_mask)
+    queries = np.random.default_rng(1).normal(size=(7, 32)).astype(np.float32)
+
+    # Blocks of 3 queries.
+    monkeypatch.setattr(similarity, "MAX_BLOCK_SCORES", 3 * len(word_vectors))
+    indices, scores = kernel.top_k(queries, topk=5)
+
+    for query, top_indices, top_scores in zip(queries, indices, scores):
+        single_indices, single_scores = kernel.top_k(query, topk=5)
+
+        assert top_indices.tolist() == single_indices[0].tolist()
+        np.testing.assert_allclose(top_scores, single_scores[0], rtol=1e-6)
+
+
+def test_top_k_indices_are_sorted():
+    scores = np.array([[0.1, 0.9, 0.5, 0.7], [4.0, 1.0, 3.0, 2.0]])
+
+    assert top_k_indices(scores, 2).tolist() == [[1, 3], [0, 2]]
+    assert top_k_indices(scores, 2, largest=False).tolist() == [[0, 2], [1, 3]]
+    assert top_k_indices(scores, 10).tolist() == [[1, 3, 2, 0], [0, 2, 3, 1]]
+
+
+def test_precomputed_norms_are_used(vocabulary):
+    word_vectors, _ = vocabulary
+    kernel = SimilarityKernel(word_vectors, vectors_norm=normalize_rows(word_vectors))
+
+    indices, scores = kernel.top_k(word_vectors[:3], topk=1)
+
+    assert [top_indices[0] for top_indices in indices] == [0, 1, 2]
+    np.testing.assert_allclose([top_scores[0] for top_scores in scores], 1, rtol=1e-5)
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import numpy as np
+import pytest
+
+from wb_nlp.interfaces import vector_store
+from wb_nlp.interfaces.vector_store import LocalVectorStore, _brute_force_search, _kmeans, _assign
+
+
+DIM = 16
+
+
+def make_vectors(n, dim=DIM, n_clusters=None, seed=0):
+    rng = np.random.default_rng(seed)
+
+    if n_clusters is None:
+        vectors = rng.normal(size=(n, dim))
+    else:
+        centers = rng.normal(size=(n_clusters, dim)) * 4
+        vectors = centers[rng.integers(n_clusters, size=n)] + \
+            rng.normal(size=(n, dim))
+
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    return vectors.astype(np.float32)
+
+
+def exact_top_k(vectors, ids, queries, topk, metric_type="IP"):
+    if metric_type == "IP":
+        order = np.argsort(-(queries @ vectors.T), axis=1, kind="stable")
+    else:
+        dist = ((queries[:, None, :] - vectors[None, :, :]) ** 2).sum(axis=2)
+        order = np.argsort(dist, axis=1, kind="stable")
+
+    return ids[order[:, :topk]]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalVectorStore(root_dir=tmp_path)
+
+
+def load_collection(store, name, vectors, ids, partition_tag=None):
+    if not store.has_collection(name):
+        store.create_collection(name, vectors.shape[1])
+
+    store.insert(name, vectors, ids, partition_tag=partition_tag)
+    store.flush(name)
+
+
+@pytest.mark.parametrize("metric_type", ["IP", "L2"])
+def test_brute_force_search_matches_numpy(monkeypatch, metric_type):
+    # Small blocks to merge the top-k across blocks.
+    monkeypatch.setattr(vector_store, "SEARCH_BLOCK_SIZE", 37)
+
+    vectors = make_vectors(500)
+    ids = np.arange(1000, 1500, dtype=np.int64)
+    queries = make_vectors(20, seed=1)
+
+    results = _brute_force_search(
+        vectors, ids, queries, 10, metric_type=metric_type)
+    expected = exact_top_k(vectors, ids, queries, 10, metric_type=metric_type)
+
+    for hits, expected_ids in zip(results, expected):
+        assert [hit.id for hit in hits] == expected_ids.tolist()
+
+        distances = [hit.distance for hit in hits]
+        assert distances == sorted(distances, reverse=metric_type == "IP")
+
+
+def test_brute_force_search_rows():
+    vectors = make_vectors(200)
+    ids = np.arange(200, dtype=np.int64)
+    queries = make_vectors(5, seed=1)
+    rows = np.arange(0, 200, 3)
+
+    results = _brute_force_search(vectors, ids, queries, 5, rows=rows)
+    expected = exact_top_k(vectors[rows], ids[rows], queries, 5)
+
+    assert [[hit.id for hit in hits] for hits in results] == expected.tolist()
+
+
+def test_brute_force_search_fewer_rows_than_topk():
+    vectors = make_vectors(3)
+    results = _brute_force_search(
+        vectors, np.arange(3, dtype=np.int64), vectors, 10)
+
+    assert [len(hits) for hits in results] == [3, 3, 3]
+    assert [hits[0].id for hits in results] == [0, 1, 2]
+
+
+def test_kmeans_recovers_clusters():
+    rng = np.random.default_rng(0)
+    centers = np.eye(4, DIM, dtype=np.float32) * 10
+    labels = np.repeat(np.arange(4), 50)
+    data = centers[labels] + rng.normal(size=(200, DIM)).astype(np.float32) * 0.1
+
+    centroids = _kmeans(data, 4)
+    assignments = _assign(data, centroids)
+
+    # Each cluster is mapped to a single centroid.
+    for label in range(4):
+        assert len(set(assignments[labels == label])) == 1
+    assert len(set(assignments)) == 4
+
+
+def test_search_exact_top_k(store):
+    vectors = make_vectors(1000)
+    ids = np.arange(1, 1001, dtype=np.int64) * 7
+    queries = make_vectors(10, seed=1)
+
+    load_collection(store, "docs", vectors, ids)
+
+    results = store.search("docs", queries, 10)
+    expected = exact_top_k(vectors, ids, queries, 10)
+
+    assert [[hit.id for hit in hits] for hits in results] == expected.tolist()
+
+
+def test_ivf_search_recall(store, monkeypatch):
+    monkeypatch.setattr(vector_store, "BRUTE_FORCE_MAX_ROWS", 0)
+
+    vectors = make_vectors(5000, n_clusters=50)
+    ids = np.arange(5000, dtype=np.int64)
+    queries = vectors[::100] + make_vectors(50, seed=1) * 0.1
+
+    load_collection(store, "docs", vectors, ids)
+    store.create_index("docs", "IVF_FLAT", params={"nlist": 64})
+
+    expected = exact_top_k(vectors, ids, queries, 10)
+
+    def recall(nprobe):
+        results = store.search("docs", queries, 10, params={"nprobe": nprobe})
+        return np.mean([len({hit.id for hit in hits} & set(row)) / 10
+                        for hits, row in zip(results, expected.tolist())])
+
+    assert recall(8) >= 0.9
+    # Probing all the lists is an exhaustive search.
+    assert recall(64) == 1.0
+
+
+def test_ivf_index_is_kept_on_flush_and_delete(store, monkeypatch):
+    monkeypatch.setattr(vector_store, "BRUTE_FORCE_MAX_ROWS", 0)
+
+    vectors = make_vectors(2000, n_clusters=20)
+    ids = np.arange(2000, dtype=np.int64)
+
+    load_collection(store, "docs", vectors[:1500], ids[:1500])
+    store.create_index("docs", "IVF_FLAT", params={"nlist": 16})
+
+    load_collection(store, "docs", vectors[1500:], ids[1500:])
+    store.delete("docs", ids[:100])
+
+    assert store.read_meta("docs")["index"]["params"]["nlist"] == 16
+    assert store.count("docs") == 1900
+
+    results = store.search("docs", vectors[1500:1510], 1, params={"nprobe": 16})
+    assert [hits[0].id for hits in results] == ids[1500:1510].tolist()
+
+    results = store.search("docs", vectors[:10], 5, params={"nprobe": 16})
+    assert not {hit.id for hits in results for hit in hits} & set(ids[:100].tolist())
+
+
+def test_insert_is_visible_after_flush(store):
+    store.create_collection("docs", DIM)
+    vectors = make_vectors(10)
+
+    store.insert("docs", vectors, range(10))
+
+    assert store.count("docs") == 0
+    assert store.read_meta("docs")["version"] == 0
+
+    store.flush("docs")
+
+    assert store.count("docs") == 10
+    assert store.read_meta("docs")["version"] == 1
+    assert sorted(store.list_ids("docs")) == list(range(10))
+
+
+def test_flush_upserts_and_versions(store):
+    vectors = make_vectors(20)
+
+    load_collection(store, "docs", vectors[:10], range(10), partition_tag="a")
+    # Ids 5 to 9 are replaced by the last inserted vectors.
+    store.insert("docs", vectors[10:15], range(5, 10), partition_tag="b")
+    store.insert("docs", vectors[15:20], range(5, 10), partition_tag="b")
+    store.flush("docs")
+
+    meta = store.read_meta("docs")
+    assert meta["version"] == 2
+    assert meta["count"] == 10
+    assert meta["partitions"] == ["a", "b"]
+
+    stored = store.get_vectors("docs", [0, 5, 9, 42])
+    np.testing.assert_array_equal(stored[0], vectors[0])
+    np.testing.assert_array_equal(stored[1], vectors[15])
+    np.testing.assert_array_equal(stored[2], vectors[19])
+    assert stored[3] is None
+
+    assert sorted(store.list_ids("docs", partition_tag="a")) == list(range(5))
+    assert sorted(store.list_ids("docs", partition_tag="b")) == list(range(5, 10))
+
+    # Only the arrays of the current version are kept.
+    collection_dir = store.get_collection_dir("docs")
+    assert {path.name for path in collection_dir.glob("*.npy")} == {
+        "vectors-2.npy", "ids-2.npy", "partitions-2.npy"}
+
+
+def test_delete_versions(store):
+    vectors = make_vectors(10)
+    load_collection(store, "docs", vectors, range(10))
+
+    store.delete("docs", [1, 2, 100])
+
+    meta = store.read_meta("docs")
+    assert meta["version"] == 2
+    assert meta["count"] == 8
+    assert sorted(store.list_ids("docs")) == [0, 3, 4, 5, 6, 7, 8, 9]
+
+    # Deleting missing ids does not create a version.
+    store.delete("docs", [100])
+    assert store.read_meta("docs")["version"] == 2
+
+
+def test_reader_keeps_its_version(store, tmp_path):
+    vectors = make_vectors(100)
+    load_collection(store, "docs", vectors, range(100))
+
+    reader = LocalVectorStore(root_dir=tmp_path)
+    loaded = reader._load("docs")
+
+    store.delete("docs", range(50))
+    store.create_index("docs", "IVF_FLAT", params={"nlist": 4})
+
+    # The memory maps of the removed version stay readable.
+    np.testing.assert_array_equal(np.asarray(loaded["vectors"]), vectors)
+
+    assert reader.count("docs") == 50
+    assert sorted(reader.list_ids("docs")) == list(range(50, 100))
+
+
+@pytest.mark.parametrize("change", ["create_index", "drop_index"])
+def test_reader_with_stale_meta(store, tmp_path, change):
+    vectors = make_vectors(100)
+    load_collection(store, "docs", vectors, range(100))
+    store.create_index("docs", "IVF_FLAT", params={"nlist": 4})
+
+    reader = LocalVectorStore(root_dir=tmp_path)
+    stale_meta = reader.read_meta("docs")
+    read_meta = reader.read_meta
+
+    # The reader reads `meta.json` before the writer changes the index.
+    calls = []
+
+    def read_meta_once_stale(collection_name):
+        calls.append(collection_name)
+        return stale_meta if len(calls) == 1 else read_meta(collection_name)
+
+    reader.read_meta = read_meta_once_stale
+
+    if change == "create_index":
+        store.create_index("docs", "IVF_FLAT", params={"nlist": 8})
+    else:
+        store.drop_index("docs")
+
+    results = reader.search("docs", vectors[:5], 1)
+
+    assert [hits[0].id for hits in results] == [0, 1, 2, 3, 4]
+    assert reader._load("docs")["meta"]["version"] == store.read_meta("docs")["version"]
+
+
+def test_create_index_does_not_modify_current_version(store):
+    vectors = make_vectors(100)
+    load_collection(store, "docs", vectors, range(100))
+
+    version = store.read_meta("docs")["version"]
+    paths = [store._array_path("docs", name, version)
+             for name in ["vectors", "ids", "partitions"]]
+    inodes = [path.stat().st_ino for path in paths]
+
+    store.create_index("docs", "IVF_FLAT", params={"nlist": 4})
+
+    new_version = store.read_meta("docs")["version"]
+    assert new_version == version + 1
+
+    # The arrays of the new version share the files of the old one.
+    assert [store._array_path("docs", name, new_version).stat().st_ino
+            for name in ["vectors", "ids", "partitions"]] == inodes
+    assert not any(path.exists() for path in paths)
+
+
+def test_concurrent_reader_and_writer(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_store, "BRUTE_FORCE_MAX_ROWS", 0)
+
+    vectors = make_vectors(600, n_clusters=10)
+    # The first 100 vectors are never removed.
+    load_collection(store, "docs", vectors[:100], range(100))
+
+    errors = []
+    done = threading.Event()
+
+    def write():
+        writer = LocalVectorStore(root_dir=tmp_path)
+
+        try:
+            for step in range(20):
+                start = 100 + 25 * step
+                writer.insert("docs", vectors[start: start + 25], range(start, start + 25))
+                writer.flush("docs")
+
+                if step % 3 == 0:
+                    writer.create_index("docs", "IVF_FLAT", params={"nlist": 8})
+                elif step % 3 == 1:
+                    writer.drop_index("docs")
+                else:
+                    writer.delete("docs", range(start - 25, start))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    def read():
+        reader = LocalVectorStore(root_dir=tmp_path)
+
+        try:
+            while not done.is_set():
+                results = reader.search("docs", vectors[:10], 1, params={"nprobe": 8})
+                assert [hits[0].id for hits in results] == list(range(10))
+
+                stored = reader.get_vectors("docs", [0, 50, 99])
+                assert all(vec is not None for vec in stored)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write)] + \
+        [threading.Thread(target=read) for _ in range(3)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+
+    meta = store.read_meta("docs")
+    assert meta["count"] == store.count("docs") == len(store.list_ids("docs"))
+
+
+def test_train_quantizer_retrains_pq_on_the_collection(store):
+    vectors = make_vectors(4000, n_clusters=40)
+    ids = np.arange(4000, dtype=np.int64)
+    queries = vectors[::200]
+
+    store.create_collection("docs", DIM, quantization={"type": "pq", "m": 4})
+
+    # The codebooks of the first flush only see the first batch.
+    for start in range(0, 4000, 500):
+        store.insert("docs", vectors[start: start + 500], ids[start: start + 500])
+        store.flush("docs")
+
+    assert store.read_meta("docs")["pq_trained_on"] == 500
+
+    assert store.train_quantizer("docs")
+
+    meta = store.read_meta("docs")
+    assert meta["pq_trained_on"] == 4000
+    assert meta["count"] == 4000
+
+    results = store.search("docs", queries, 10)
+    expected = exact_top_k(vectors, ids, queries, 10)
+    assert np.mean([len({hit.id for hit in hits} & set(row)) / 10
+                    for hits, row in zip(results, expected.tolist())]) >= 0.9
+
+    # The codebooks are not retrained if the collection did not grow.
+    assert not store.train_quantizer("docs")
+    assert store.read_meta("docs")["version"] == meta["version"]